@@ -94,7 +94,7 @@ class AdminLBaaSReloadAction(AdminView):
         lbaas = self.get_object()
         lbaas.event = LBaaS.RELOAD
         lbaas.save()
-        reload_lbaas.delay(lbaas.id)
+        reload_lbaas.delay(lbaas.id, force=True)
         return redirect(reverse("admin_lbaas_data", args=[kwargs.get("pk")]))
 
 
@@ -1,6 +1,6 @@
 from django.urls import include, re_path
 
-from .views import AdminIndexView, AdminSingInView, AdminSingOutView
+from .views import AdminIndexView, AdminMetadataStatsView, AdminSingInView, AdminSingOutView
 
 urlpatterns = [
     re_path(r"^$", AdminIndexView.as_view(), name="admin_index"),
@@ -21,4 +21,5 @@ urlpatterns = [
     re_path(r"firewall/", include("admin.firewall.urls")),
     re_path(r"floating_ip/", include("admin.floating_ip.urls")),
     re_path(r"issue/", include("admin.issue.urls")),
+    re_path(r"metadata/stats/?$", AdminMetadataStatsView.as_view(), name="admin_metadata_stats"),
 ]
@@ -1,8 +1,10 @@
 from django.contrib.auth import login
 from django.contrib.auth.views import LoginView, LogoutView
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse
 from django.urls import reverse_lazy
 
+from metadata.v1.utils import address_index
+
 from .forms import AdminAuthForm
 from .mixins import AdminTemplateView, AdminView
 
@@ -27,3 +29,10 @@ class AdminSingOutView(AdminView, LogoutView):
 class AdminIndexView(AdminTemplateView):
     admin_required = True
     template_name = "admin/index.html"
+
+
+class AdminMetadataStatsView(AdminView):
+    admin_required = True
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({"address_index": address_index.stats()})
@@ -10,6 +10,7 @@ from compute.webvirt import WebVirtCompute
 from network.models import IPAddress, Network
 from virtance.models import Virtance, VirtanceError
 from virtance.tasks import action_virtance, create_virtance
+from virtance.utils import make_console_ticket
 
 from .filters import VirtanceFilter
 from .tables import VirtanceErrorTable, VirtanceHTMxTable
@@ -92,6 +93,13 @@ class AdminVirtanceConsoleView(AdminTemplateView):
         virtance = self.get_object()
         response = super(AdminVirtanceConsoleView, self).get(request, *args, **kwargs)
         response.set_cookie("uuid", virtance.uuid, httponly=True, domain=settings.SESSION_COOKIE_DOMAIN)
+        response.set_cookie(
+            "ticket",
+            self.console_ticket,
+            max_age=int(settings.NOVNC_TICKET_TTL),
+            httponly=True,
+            domain=settings.SESSION_COOKIE_DOMAIN,
+        )
         return response
 
     def get_context_data(self, **kwargs):
@@ -101,6 +109,7 @@ class AdminVirtanceConsoleView(AdminTemplateView):
         wvcomp = WebVirtCompute(virtance.compute.token, virtance.compute.hostname)
         res = wvcomp.get_virtance_vnc(virtance.id)
         vnc_password = res.get("vnc_password")
+        self.console_ticket = make_console_ticket(virtance.uuid, virtance.compute.hostname, res.get("vnc_port"))
         console_host = settings.NOVNC_URL
         console_port = settings.NOVNC_PORT
 
@@ -0,0 +1,165 @@
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+
+from floating_ip.models import FloatIP, FloatIPCounter
+from image.models import Image, SnapshotCounter
+from size.models import Size
+from virtance.models import Virtance, VirtanceCounter
+
+from .models import MeteringWatermark
+
+BACKUP_COST_RATIO = settings.BACKUP_COST_PERCENTAGE / 100
+METERING_CHUNK_SIZE = 1000
+METERING_BACKFILL_HOURS = 24 * 31
+
+
+class MeteringResource(object):
+    """
+    Hourly billed resource. Subclasses define owners() (objects to bill), new_counter(owner)
+    (the unsaved counter, its initial amount covers the first hour) and charges() (counter
+    fields that grow every hour, none for resources which only record usage periods).
+    """
+
+    name = None
+    counter_model = None
+    owner_field = None
+
+    def charges(self):
+        return {}
+
+    def missing_owners(self, month_start):
+        open_counters = self.counter_model.objects.filter(
+            **{self.owner_field: OuterRef("pk")}, started__gt=month_start, stopped=None
+        )
+        return self.owners().exclude(Exists(open_counters))
+
+
+class VirtanceResource(MeteringResource):
+    name = "virtance"
+    counter_model = VirtanceCounter
+    owner_field = "virtance"
+
+    def owners(self):
+        return Virtance.objects.filter(is_deleted=False).select_related("size")
+
+    def new_counter(self, virtance):
+        return VirtanceCounter(
+            virtance=virtance,
+            size=virtance.size,
+            amount=virtance.size.price,
+            backup_amount=virtance.size.price * Decimal(BACKUP_COST_RATIO) if virtance.is_backup_enabled else 0,
+        )
+
+    def charges(self):
+        price = Subquery(Size.objects.filter(id=OuterRef("size_id")).values("price")[:1])
+        backup_enabled = Exists(Virtance.objects.filter(id=OuterRef("virtance_id"), is_backup_enabled=True))
+        return {
+            "amount": F("amount") + price,
+            "backup_amount": Case(
+                When(backup_enabled, then=F("backup_amount") + price * Value(Decimal(BACKUP_COST_RATIO))),
+                default=F("backup_amount"),
+            ),
+        }
+
+
+class SnapshotResource(MeteringResource):
+    name = "snapshot"
+    counter_model = SnapshotCounter
+    owner_field = "image"
+
+    def owners(self):
+        return Image.objects.filter(type=Image.SNAPSHOT, is_deleted=False)
+
+    def new_counter(self, image):
+        return SnapshotCounter(image=image, amount=0.0)
+
+
+class FloatIPResource(MeteringResource):
+    name = "floating_ip"
+    counter_model = FloatIPCounter
+    owner_field = "floatip"
+
+    def owners(self):
+        return FloatIP.objects.filter(is_deleted=False, ipaddress__isnull=False).select_related("ipaddress")
+
+    def new_counter(self, floatip):
+        return FloatIPCounter(floatip=floatip, ipaddress=floatip.ipaddress.address, amount=0.0)
+
+
+METERING_RESOURCES = {resource.name: resource for resource in (VirtanceResource, SnapshotResource, FloatIPResource)}
+
+
+def month_start(hour):
+    return hour.replace(day=1, hour=0)
+
+
+def close_month(resource, first_day_month):
+    # Also closes counters left open from older months, e.g. after a long worker outage
+    last_day_prev_month = first_day_month - timezone.timedelta(microseconds=1)
+    counters = resource.counter_model.objects.filter(started__lt=first_day_month, stopped=None)
+    return counters.update(stopped=last_day_prev_month)
+
+
+def create_counters(resource, hour):
+    # Counters start now (auto_now_add) and their initial amount already covers this hour
+    counters = [resource.new_counter(owner) for owner in resource.missing_owners(month_start(hour))]
+    return len(resource.counter_model.objects.bulk_create(counters, batch_size=METERING_CHUNK_SIZE))
+
+
+def meter_hour(resource, hour):
+    updated = 0
+    charges = resource.charges()
+    if not charges:
+        return updated
+
+    # Counters open at that hour and not metered for it yet, so a retried run never bills twice.
+    # Counters started at or after the hour are skipped, their first hour is prepaid.
+    counter_ids = list(
+        resource.counter_model.objects.filter(started__gt=month_start(hour), started__lt=hour)
+        .filter(Q(stopped=None) | Q(stopped__gt=hour))
+        .filter(Q(metered=None) | Q(metered__lt=hour))
+        .values_list("id", flat=True)
+    )
+    for i in range(0, len(counter_ids), METERING_CHUNK_SIZE):
+        updated += resource.counter_model.objects.filter(id__in=counter_ids[i : i + METERING_CHUNK_SIZE]).update(
+            **charges, metered=hour, updated=timezone.now()
+        )
+    return updated
+
+
+def run_metering(name):
+    """
+    Meter every hour since the last recorded one (up to METERING_BACKFILL_HOURS),
+    closing the previous month's counters when an hour starts a new month.
+    """
+    started_at = time.monotonic()
+    resource = METERING_RESOURCES[name]()
+    current_hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+    report = {"resource": name, "hours": 0, "created": 0, "updated": 0, "closed": 0}
+
+    watermark, _ = MeteringWatermark.objects.get_or_create(
+        resource=name, defaults={"metered": current_hour - timezone.timedelta(hours=1)}
+    )
+    first_hour = max(watermark.metered, current_hour - timezone.timedelta(hours=METERING_BACKFILL_HOURS))
+    hour = first_hour + timezone.timedelta(hours=1)
+
+    while hour <= current_hour:
+        with transaction.atomic():
+            new_period = hour == month_start(hour)
+            if new_period is True:
+                report["closed"] += close_month(resource, hour)
+            if hour == current_hour:
+                report["created"] += create_counters(resource, hour)
+            if new_period is False:
+                report["updated"] += meter_hour(resource, hour)
+            MeteringWatermark.objects.filter(id=watermark.id).update(metered=hour)
+        report["hours"] += 1
+        hour += timezone.timedelta(hours=1)
+
+    report["elapsed"] = round(time.monotonic() - started_at, 3)
+    return report
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.18 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("billing", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MeteringWatermark",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("resource", models.CharField(max_length=40, unique=True)),
+                ("metered", models.DateTimeField()),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Metering Watermark",
+                "verbose_name_plural": "Metering Watermarks",
+                "ordering": ["-id"],
+            },
+        ),
+    ]
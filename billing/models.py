@@ -32,3 +32,17 @@ class Balance(models.Model):
 
     def __unicode__(self):
         return self.balance
+
+
+class MeteringWatermark(models.Model):
+    resource = models.CharField(max_length=40, unique=True)
+    metered = models.DateTimeField()
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Metering Watermark"
+        verbose_name_plural = "Metering Watermarks"
+        ordering = ["-id"]
+
+    def __unicode__(self):
+        return self.resource
@@ -1,5 +1,8 @@
+from functools import partial
+
 from django.conf import settings
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Sum
 from django.utils import timezone
 
 from account.models import User
@@ -10,6 +13,8 @@ from virtance.models import VirtanceCounter
 from webvirtcloud.celery import app
 from webvirtcloud.email import send_email
 
+INVOICE_CHUNK_SIZE = 500
+
 
 @app.task
 def email_send_invoice(recipient, amount, period):
@@ -19,78 +24,75 @@ def email_send_invoice(recipient, amount, period):
     send_email(subject, recipient, context, "email/invoice.html")
 
 
+def usage_by_user(model, user_field, fields, start_of_month, end_of_month):
+    usage = {}
+    counters = model.objects.filter(started__gte=start_of_month, stopped__lte=end_of_month)
+    totals = counters.values(user_field).annotate(**{field: Sum(field) for field in fields})
+    for row in totals:
+        usage[row[user_field]] = sum(row[field] or 0 for field in fields)
+    return usage
+
+
 @app.task
 def make_monthly_invoice():
     now = timezone.now()
-    first_day_of_month = now.replace(day=1, hour=0, minute=0, second=0)
+    first_day_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     prev_month = first_day_of_month - timezone.timedelta(days=1)
     start_of_month = prev_month.replace(day=1, hour=0, minute=0, second=0)
     end_of_month = prev_month.replace(hour=23, minute=59, second=59, microsecond=999999)
+    period = f"{prev_month.year}-{prev_month.month}"
+    created = 0
 
-    # Get all verified users
-    for user in User.objects.filter(is_email_verified=True):
-        invoice_exist = Invoice.objects.filter(user=user, create__gte=first_day_of_month).exists()
-
-        if invoice_exist is False:
-            total_usage = 0
-
-            virtances_usage = (
-                VirtanceCounter.objects.filter(
-                    virtance__user=user,
-                    started__gte=start_of_month,
-                    stopped__lte=end_of_month,
-                ).aggregate(total_amount=Sum("amount"))["total_amount"]
-                or 0
-            )
-            total_usage += virtances_usage
+    # Usage of all users with one GROUP BY query per counter type
+    usages = [
+        usage_by_user(
+            VirtanceCounter,
+            "virtance__user",
+            ["amount", "backup_amount", "license_amount"],
+            start_of_month,
+            end_of_month,
+        ),
+        usage_by_user(SnapshotCounter, "image__user", ["amount"], start_of_month, end_of_month),
+        usage_by_user(FloatIPCounter, "floatip__user", ["amount"], start_of_month, end_of_month),
+    ]
 
-            virtances_backup_usage = (
-                VirtanceCounter.objects.filter(
-                    virtance__user=user,
-                    started__gte=start_of_month,
-                    stopped__lte=end_of_month,
-                ).aggregate(total_amount=Sum("backup_amount"))["total_amount"]
-                or 0
-            )
-            total_usage += virtances_backup_usage
+    # Users invoiced by a previous (crashed or retried) run are skipped, so the task can be resumed
+    invoiced = Invoice.objects.filter(user=OuterRef("pk"), create__gte=first_day_of_month)
+    users = list(User.objects.filter(is_email_verified=True).exclude(Exists(invoiced)).values_list("id", "email"))
 
-            virtances_license_usage = (
-                VirtanceCounter.objects.filter(
-                    virtance__user=user,
-                    started__gte=start_of_month,
-                    stopped__lte=end_of_month,
-                ).aggregate(total_amount=Sum("license_amount"))["total_amount"]
-                or 0
-            )
-            total_usage += virtances_license_usage
+    for i in range(0, len(users), INVOICE_CHUNK_SIZE):
+        chunk = users[i : i + INVOICE_CHUNK_SIZE]
+        with transaction.atomic():
+            invoices = [
+                Invoice(user_id=user_id, amount=sum(usage.get(user_id, 0) for usage in usages)) for user_id, _ in chunk
+            ]
+            Invoice.objects.bulk_create(invoices)
 
-            snapshots_usage = (
-                SnapshotCounter.objects.filter(
-                    image__user=user,
-                    started__gte=start_of_month,
-                    stopped__lte=end_of_month,
-                ).aggregate(total_amount=Sum("amount"))["total_amount"]
-                or 0
+            # MySQL doesn't return primary keys from bulk insert, read them back by uuid
+            invoice_ids = dict(
+                Invoice.objects.filter(uuid__in=[inv.uuid for inv in invoices]).values_list("uuid", "id")
             )
-            total_usage += snapshots_usage
-
-            floating_ips_usage = (
-                FloatIPCounter.objects.filter(
-                    floatip__user=user,
-                    started__gte=start_of_month,
-                    stopped__lte=end_of_month,
-                ).aggregate(total_amount=Sum("amount"))["total_amount"]
-                or 0
+            Balance.objects.bulk_create(
+                [
+                    Balance(
+                        user_id=invoice.user_id,
+                        amount=invoice.amount,
+                        invoice_id=invoice_ids[invoice.uuid],
+                        description=f"Invoice for {now.year}-{now.month}",
+                    )
+                    for invoice in invoices
+                ]
             )
-            total_usage += floating_ips_usage
-
-            # Create invoice
-            invoice = Invoice.objects.create(user=user, amount=total_usage)
 
-            # Update user balance
-            Balance.objects.create(
-                user=user, amount=invoice.amount, invoice=invoice, description=f"Invoice for {now.year}-{now.month}"
-            )
+            # Send invoices to users only after the chunk is committed
+            for (_, email), invoice in zip(chunk, invoices):
+                transaction.on_commit(
+                    partial(
+                        email_send_invoice.apply_async,
+                        (email, f"{invoice.amount:.2f}", period),
+                        queue=settings.BILLING_EMAIL_QUEUE,
+                    )
+                )
+        created += len(invoices)
 
-            # Send invoice to user
-            email_send_invoice(user.email, invoice.amount, f"{prev_month.year}-{prev_month.month}")
+    return {"invoices": created}
@@ -1,54 +1,123 @@
 from django.conf import settings
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
 
 from virtance.models import Virtance
 from virtance.utils import virtance_error
 
-from .models import Compute
-from .webvirt import WebVirtCompute
+from .models import Compute, ComputeCapacity
+from .webvirt import fan_out
 
 CPU_USAGE_RATIO = settings.COMPUTE_CPU_RATIO_OVERCOMMIT
 MEMORY_USAGE_RATIO = settings.COMPUTE_MEMORY_PERCENTAGE_USAGE / 100
 STORAGE_USAGE_RATIO = settings.COMPUTE_STORAGE_PERCENTAGE_USAGE / 100
+PLACEMENT_STRATEGY = settings.COMPUTE_PLACEMENT_STRATEGY
+CAPACITY_MAX_AGE = int(settings.COMPUTE_CAPACITY_MAX_AGE)
+
+SPREAD = "spread"
+RANDOM = "random"
+BEST_FIT = "best_fit"
+
+
+async def host_resources(wvcomp):
+    host_res = await wvcomp.get_host_overview()
+    storage_res = await wvcomp.get_storage(settings.COMPUTE_VM_IMAGES_POOL)
+    return host_res, storage_res
+
+
+def refresh_compute_capacity(computes):
+    computes = list(computes)
+    resources = fan_out(computes, host_resources)
+
+    probed = timezone.now()
+    for compute in computes:
+        totals = {}
+        res = resources.get(compute.id)
+        if isinstance(res, tuple):
+            host_res, storage_res = res
+            if host_res.get("detail") is None and storage_res.get("detail") is None:
+                totals = {
+                    "cpu_total": host_res.get("host", {}).get("cpus", 0),
+                    "memory_total": host_res.get("host", {}).get("memory", 0),
+                    "storage_total": storage_res.get("storage", {}).get("size", {}).get("total", 0),
+                    "refreshed": timezone.now(),
+                }
+
+        # Usage is recounted under the row lock taken by reserve_compute_capacity(),
+        # so a reservation in flight is either fully counted or not started yet
+        with transaction.atomic():
+            ComputeCapacity.objects.get_or_create(compute=compute)
+            capacity = ComputeCapacity.objects.select_for_update().get(compute=compute)
+            used = Virtance.objects.filter(compute=compute, is_deleted=False).aggregate(
+                cpus=Sum("size__vcpu"), memory=Sum("size__memory"), storage=Sum("size__disk")
+            )
+            capacity.cpu_used = used.get("cpus") or 0
+            capacity.memory_used = used.get("memory") or 0
+            capacity.storage_used = used.get("storage") or 0
+            # Failed probes are recorded too, so placement does not keep waiting on dead hosts
+            capacity.probed = probed
+            for field, value in totals.items():
+                setattr(capacity, field, value)
+            capacity.save()
+
+
+def update_compute_usage(compute_id, vcpu=0, memory=0, disk=0):
+    ComputeCapacity.objects.filter(compute_id=compute_id).update(
+        cpu_used=F("cpu_used") + vcpu,
+        memory_used=F("memory_used") + memory,
+        storage_used=F("storage_used") + disk,
+        updated=timezone.now(),
+    )
+
+
+def reserve_compute_capacity(capacity_id, virtance):
+    size = virtance.size
+    with transaction.atomic():
+        capacity = ComputeCapacity.objects.select_for_update().get(id=capacity_id)
+        cpu_free = (capacity.cpu_total * CPU_USAGE_RATIO) - capacity.cpu_used > size.vcpu
+        memory_free = (capacity.memory_total * MEMORY_USAGE_RATIO) - capacity.memory_used > size.memory
+        storage_free = (capacity.storage_total * STORAGE_USAGE_RATIO) - capacity.storage_used > size.disk
+
+        if cpu_free is True and memory_free is True and storage_free is True:
+            capacity.cpu_used += size.vcpu
+            capacity.memory_used += size.memory
+            capacity.storage_used += size.disk
+            capacity.save()
+            virtance.compute_id = capacity.compute_id
+            virtance.save()
+            return True
+
+    return False
 
 
 def assign_free_compute(virtance_id):
     virtance = Virtance.objects.get(id=virtance_id)
     computes = Compute.objects.filter(
         region=virtance.region, is_active=True, is_deleted=False, arch=virtance.template.arch
-    ).order_by("?")
+    )
 
-    for compute in computes:
-        cpu_used = (
-            Virtance.objects.filter(compute=compute, is_deleted=False).aggregate(cpus=Sum("size__vcpu"))["cpus"] or 0
-        )
-        memory_used = (
-            Virtance.objects.filter(compute=compute, is_deleted=False).aggregate(memory=Sum("size__memory"))["memory"]
-            or 0
-        )
-        storage_used = (
-            Virtance.objects.filter(compute=compute, is_deleted=False).aggregate(storage=Sum("size__disk"))["storage"]
-            or 0
-        )
-
-        wvcomp = WebVirtCompute(compute.token, compute.hostname)
-        host_res = wvcomp.get_host_overview()
-        storage_res = wvcomp.get_storage(settings.COMPUTE_VM_IMAGES_POOL)
-
-        # Something checking for free resources :-)
-        if host_res is not None and storage_res is not None:
-            cpu_free = ((host_res.get("host", {}).get("cpus", 0) * CPU_USAGE_RATIO) - cpu_used) > virtance.size.vcpu
-            memory_free = (
-                (host_res.get("host", {}).get("memory", 0) * MEMORY_USAGE_RATIO) - memory_used
-            ) > virtance.size.memory
-            storage_free = (
-                (storage_res.get("storage", {}).get("size", {}).get("total", 0) * STORAGE_USAGE_RATIO) - storage_used
-            ) > virtance.size.disk
-
-            if cpu_free is True and memory_free is True and storage_free is True:
-                virtance.compute = compute
-                virtance.save()
-                return compute.id
+    # Totals are kept fresh by compute.tasks.compute_capacity_refresh, placement only probes computes
+    # never probed before; stale or failing computes are left out until the task refreshes them
+    fresh_after = timezone.now() - timezone.timedelta(seconds=CAPACITY_MAX_AGE)
+    unknown = computes.filter(Q(capacity__isnull=True) | Q(capacity__probed__isnull=True))
+    if unknown.exists():
+        refresh_compute_capacity(unknown)
+
+    # Memory is the scarcest resource, so strategies rank computes by memory left after overcommit ratio
+    capacities = ComputeCapacity.objects.filter(compute__in=computes, refreshed__gte=fresh_after).annotate(
+        memory_free=F("memory_total") * MEMORY_USAGE_RATIO - F("memory_used")
+    )
+    if PLACEMENT_STRATEGY == BEST_FIT:
+        capacities = capacities.order_by("memory_free")
+    elif PLACEMENT_STRATEGY == SPREAD:
+        capacities = capacities.order_by("-memory_free")
+    else:
+        capacities = capacities.order_by("?")
+
+    for capacity in capacities.filter(memory_free__gt=virtance.size.memory):
+        if reserve_compute_capacity(capacity.id, virtance):
+            return capacity.compute_id
 
     virtance_error(virtance.id, "No compute found", event="assign_free_compute")
     return None
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.18 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("compute", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ComputeCapacity",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("cpu_total", models.IntegerField(default=0)),
+                ("memory_total", models.BigIntegerField(default=0)),
+                ("storage_total", models.BigIntegerField(default=0)),
+                ("cpu_used", models.IntegerField(default=0)),
+                ("memory_used", models.BigIntegerField(default=0)),
+                ("storage_used", models.BigIntegerField(default=0)),
+                ("refreshed", models.DateTimeField(blank=True, null=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "compute",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="capacity", to="compute.compute"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Compute Capacity",
+                "verbose_name_plural": "Compute Capacities",
+                "ordering": ["-id"],
+            },
+        ),
+    ]
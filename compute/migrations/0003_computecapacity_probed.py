@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("compute", "0002_computecapacity"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="computecapacity",
+            name="probed",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
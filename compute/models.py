@@ -38,3 +38,24 @@ class Compute(models.Model):
 
     def __unicode__(self):
         return self.name
+
+
+class ComputeCapacity(models.Model):
+    compute = models.OneToOneField(Compute, models.CASCADE, related_name="capacity")
+    cpu_total = models.IntegerField(default=0)
+    memory_total = models.BigIntegerField(default=0)
+    storage_total = models.BigIntegerField(default=0)
+    cpu_used = models.IntegerField(default=0)
+    memory_used = models.BigIntegerField(default=0)
+    storage_used = models.BigIntegerField(default=0)
+    refreshed = models.DateTimeField(null=True, blank=True)
+    probed = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Compute Capacity"
+        verbose_name_plural = "Compute Capacities"
+        ordering = ["-id"]
+
+    def __unicode__(self):
+        return self.compute.name
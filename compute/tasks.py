@@ -0,0 +1,10 @@
+from webvirtcloud.celery import app
+
+from .helper import refresh_compute_capacity
+from .models import Compute
+
+
+@app.task
+def compute_capacity_refresh():
+    refresh_compute_capacity(Compute.objects.filter(is_active=True, is_deleted=False))
+    return True
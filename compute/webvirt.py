@@ -1,77 +1,159 @@
+import asyncio
+import os
+import threading
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from urllib.parse import urlencode
 
 import requests
 import urllib3
 from django.conf import settings
-from requests.exceptions import ConnectionError, ConnectTimeout
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, ReadTimeout
 
 urllib3.disable_warnings()
 
 COMPUTE_VERSION = settings.WEBVIRTCOMPUTE_VERSION
+COMPUTE_POOL_SIZE = int(settings.COMPUTE_HTTP_POOL_SIZE)
+COMPUTE_POOL_SHARED = settings.COMPUTE_HTTP_POOL_SHARED
+COMPUTE_CONNECT_TIMEOUT = float(settings.COMPUTE_CONNECT_TIMEOUT)
+COMPUTE_READ_TIMEOUT = float(settings.COMPUTE_READ_TIMEOUT)
+COMPUTE_ACTION_READ_TIMEOUT = float(settings.COMPUTE_ACTION_READ_TIMEOUT)
+COMPUTE_FANOUT_TIMEOUT = float(settings.COMPUTE_FANOUT_TIMEOUT)
+COMPUTE_FANOUT_CONCURRENCY = int(settings.COMPUTE_FANOUT_CONCURRENCY)
+
+# Sessions shared by all clients of the current process, keyed by (host, token)
+_sessions = {}
+_sessions_pid = os.getpid()
+_sessions_lock = threading.Lock()
+
+# Worker threads used by AsyncWebVirtCompute to drive the pooled sessions
+_executor = None
+_executor_pid = None
 
 
 def vm_name(virtance_id):
     return f"{settings.VM_NAME_PREFIX}{str(virtance_id)}"
 
 
+def make_session(token):
+    credentials = f"{token}:{token}"
+    session = requests.Session()
+    session.verify = False
+    session.headers.update(
+        {
+            "Accept": "application/json, */*",
+            "Content-Type": "application/json",
+            "Authorization": f"Basic {b64encode(credentials.encode()).decode()}",
+        }
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=COMPUTE_POOL_SIZE, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(host, token):
+    global _sessions_pid
+
+    with _sessions_lock:
+        # Connections must not be shared with a parent process (e.g. Celery prefork)
+        if _sessions_pid != os.getpid():
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+
+        session = _sessions.get((host, token))
+        if session is None:
+            session = make_session(token)
+            _sessions[(host, token)] = session
+        return session
+
+
+def get_executor():
+    global _executor, _executor_pid
+
+    with _sessions_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=COMPUTE_FANOUT_CONCURRENCY * 2, thread_name_prefix="webvirtcompute"
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def session_stats(session):
+    requests_count = 0
+    connections_count = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_count += pool.num_requests
+                connections_count += pool.num_connections
+    return {
+        "requests": requests_count,
+        "handshakes": connections_count,
+        "reused": max(requests_count - connections_count, 0),
+    }
+
+
+def pool_stats():
+    stats = {}
+    with _sessions_lock:
+        items = list(_sessions.items())
+    for (host, _), session in items:
+        stats[host] = session_stats(session)
+    return stats
+
+
 class WebVirtCompute(object):
-    def __init__(self, token, host, secure=True):
+    def __init__(self, token, host, secure=True, shared=COMPUTE_POOL_SHARED):
         self.port = settings.COMPUTE_PORT
         self.host = host
         self.token = token
         self.secure = secure
+        if shared:
+            self.session = get_session(host, token)
+        else:
+            self.session = make_session(token)
 
     def _url(self):
         return f"http{'s' if self.secure else ''}://{self.host}:{self.port}/"
 
-    def _headers(self):
-        credentials = f"{self.token}:{self.token}"
-        return {
-            "Accept": "application/json, */*",
-            "Content-Type": "application/json",
-            "Authorization": f"Basic {b64encode(credentials.encode()).decode()}",
-        }
-
-    def _make_get(self, query, stream=False):
-        url = self._url() + query
+    def _request(self, method, url, read_timeout, **kwargs):
+        url = self._url() + url
         try:
-            response = requests.get(url, headers=self._headers(), stream=stream, timeout=5, verify=False)
-            return response
+            return self.session.request(method, url, timeout=(COMPUTE_CONNECT_TIMEOUT, read_timeout), **kwargs)
         except ConnectTimeout:
             return {"detail": "Connection to compute timeout."}
+        except ReadTimeout:
+            return {"detail": "Compute response timeout."}
         except ConnectionError:
             return {"detail": "Failed to establish a new connection to compoute. Check the hostname or IP address."}
 
+    def _make_get(self, query, stream=False):
+        return self._request("GET", query, COMPUTE_READ_TIMEOUT, stream=stream)
+
     def _make_post(self, url, params):
-        url = self._url() + url
-        try:
-            response = requests.post(url, headers=self._headers(), json=params, verify=False)
-            return response
-        except ConnectTimeout:
-            return {"detail": "Connection to compute timeout."}
-        except ConnectionError:
-            return {"detail": "Failed to establish a new connection to compoute. Check the hostname or IP address ."}
+        return self._request("POST", url, COMPUTE_ACTION_READ_TIMEOUT, json=params)
 
     def _make_put(self, url, params):
-        url = self._url() + url
-        try:
-            response = requests.put(url, headers=self._headers(), json=params, verify=False)
-            return response
-        except ConnectTimeout:
-            return {"detail": "Connection to compute timeout."}
-        except ConnectionError:
-            return {"detail": "Failed to establish a new connection to compoute. Check the hostname or IP address."}
+        return self._request("PUT", url, COMPUTE_ACTION_READ_TIMEOUT, json=params)
 
     def _make_delete(self, url, params=None):
-        url = self._url() + url
-        try:
-            response = requests.delete(url, headers=self._headers(), json=params, verify=False)
-            return response
-        except ConnectTimeout:
-            return {"detail": "Connection to compute timeout."}
-        except ConnectionError:
-            return {"detail": "Failed to establish a new connection to compoute. Check the hostname or IP address."}
+        return self._request("DELETE", url, COMPUTE_ACTION_READ_TIMEOUT, json=params)
+
+    def stats(self):
+        return session_stats(self.session)
 
     def _process_response(self, response, json=True):
         if isinstance(response, dict):
@@ -422,3 +504,67 @@ class WebVirtCompute(object):
         response = self._make_delete(url, payload)
         body = self._process_response(response)
         return body
+
+
+class AsyncWebVirtCompute(object):
+    """
+    Asyncio counterpart of WebVirtCompute with the same method surface, e.g.
+    ``await AsyncWebVirtCompute(token, host).get_host_overview()``.
+    Calls run on a shared thread pool over the keep-alive sessions of WebVirtCompute.
+    """
+
+    def __init__(self, token, host, secure=True):
+        self.host = host
+        self.client = WebVirtCompute(token, host, secure=secure)
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), partial(getattr(self.client, method), *args, **kwargs))
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "client" or not callable(getattr(self.client, name, None)):
+            raise AttributeError(name)
+
+        async def method(*args, **kwargs):
+            return await self._call(name, *args, **kwargs)
+
+        return method
+
+
+async def gather_computes(
+    computes, method, *args, timeout=COMPUTE_FANOUT_TIMEOUT, concurrency=COMPUTE_FANOUT_CONCURRENCY, **kwargs
+):
+    """
+    Run `method` on every compute concurrently and return {compute.id: result}.
+    `method` is either an AsyncWebVirtCompute method name or a coroutine function
+    that takes the AsyncWebVirtCompute instance. Each host gets its own timeout
+    and at most `concurrency` hosts are queried at the same time.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(compute):
+        async with semaphore:
+            wvcomp = AsyncWebVirtCompute(compute.token, compute.hostname)
+            if callable(method):
+                coro = method(wvcomp, *args, **kwargs)
+            else:
+                coro = getattr(wvcomp, method)(*args, **kwargs)
+            try:
+                return await asyncio.wait_for(coro, timeout)
+            except asyncio.TimeoutError:
+                return {"detail": "Connection to compute timeout."}
+            except Exception as err:
+                return {"detail": f"Compute request failed: {err}"}
+
+    results = await asyncio.gather(*(call(compute) for compute in computes))
+    return {compute.id: res for compute, res in zip(computes, results)}
+
+
+def fan_out(computes, method, *args, **kwargs):
+    """
+    Blocking wrapper around gather_computes() for Celery tasks and views.
+    """
+    computes = list(computes)
+    if not computes:
+        return {}
+    return asyncio.run(gather_computes(computes, method, *args, **kwargs))
@@ -1,3 +1,5 @@
+import time
+
 from django.conf import settings
 
 from image.models import Image
@@ -12,6 +14,7 @@ from virtance.tasks import (
     restore_virtance,
     snapshot_virtance,
     image_delete,
+    virtance_ssh_ready,
 )
 from virtance.utils import check_ssh_connect, decrypt_data, encrypt_data, virtance_error
 from webvirtcloud.celery import app
@@ -241,33 +244,41 @@ def provision_dbaas(host, private_key, tasks, dbaas_vars=None):
 @app.task
 def create_dbaas(dbaas_id):
     dbaas = DBaaS.objects.get(id=dbaas_id)
-    private_key = decrypt_data(dbaas.private_key)
 
     if create_virtance(dbaas.virtance.id, send_email=False):
         ipv4_public = IPAddress.objects.get(virtance=dbaas.virtance, network__type=Network.PUBLIC, is_float=False)
-        ipv4_private = IPAddress.objects.get(virtance=dbaas.virtance, network__type=Network.PRIVATE, is_float=False)
-
-        if check_ssh_connect(ipv4_public.address, private_key=private_key):
-            dbaas_vars = {
-                "version": dbaas.dbms.version,
-                "admin_login": settings.DBAAS_ADMIN_LOGIN,
-                "admin_password": decrypt_data(dbaas.admin_secret),
-                "master_login": settings.DBAAS_MASTER_LOGIN,
-                "master_password": decrypt_data(dbaas.master_secret),
-                "default_db_name": settings.DBAAS_DEFAULT_DB_NAME,
-                "ipv4_public_address": ipv4_public.address,
-                "ipv4_private_address": ipv4_private.address,
-                "ipv4_private_gateway": ipv4_private.network.gateway,
-                "ipv4_dbaas_access_list": settings.DBAAS_IPV4_ACCESS_LIST,
-            }
-            error, task = provision_dbaas(ipv4_public.address, private_key, provision_tasks, dbaas_vars=dbaas_vars)
-            if error:
-                error_message = error
-                if task:
-                    error_message = f"Task: {task}. Error: {error}"
-                virtance_error(dbaas.virtance.id, error_message, event="dbaas_provision")
-            else:
-                dbaas.reset_event()
+        virtance_ssh_ready.delay(
+            dbaas.virtance.id, ipv4_public.address, dbaas.private_key, time.time(), link=setup_dbaas.si(dbaas_id)
+        )
+
+
+@app.task
+def setup_dbaas(dbaas_id):
+    dbaas = DBaaS.objects.get(id=dbaas_id)
+    private_key = decrypt_data(dbaas.private_key)
+    ipv4_public = IPAddress.objects.get(virtance=dbaas.virtance, network__type=Network.PUBLIC, is_float=False)
+    ipv4_private = IPAddress.objects.get(virtance=dbaas.virtance, network__type=Network.PRIVATE, is_float=False)
+
+    dbaas_vars = {
+        "version": dbaas.dbms.version,
+        "admin_login": settings.DBAAS_ADMIN_LOGIN,
+        "admin_password": decrypt_data(dbaas.admin_secret),
+        "master_login": settings.DBAAS_MASTER_LOGIN,
+        "master_password": decrypt_data(dbaas.master_secret),
+        "default_db_name": settings.DBAAS_DEFAULT_DB_NAME,
+        "ipv4_public_address": ipv4_public.address,
+        "ipv4_private_address": ipv4_private.address,
+        "ipv4_private_gateway": ipv4_private.network.gateway,
+        "ipv4_dbaas_access_list": settings.DBAAS_IPV4_ACCESS_LIST,
+    }
+    error, task = provision_dbaas(ipv4_public.address, private_key, provision_tasks, dbaas_vars=dbaas_vars)
+    if error:
+        error_message = error
+        if task:
+            error_message = f"Task: {task}. Error: {error}"
+        virtance_error(dbaas.virtance.id, error_message, event="dbaas_provision")
+    else:
+        dbaas.reset_event()
 
 
 @app.task
@@ -320,9 +331,12 @@ def delete_dbaas(dbaas_id):
 @app.task
 def action_dbaas(dbaas_id, action):
     dbaas = DBaaS.objects.get(id=dbaas_id)
+    action_virtance(dbaas.virtance.id, action, link=reset_event_dbaas.si(dbaas_id))
 
-    if not action_virtance(dbaas.virtance.id, action):
-        dbaas.reset_event()
+
+@app.task
+def reset_event_dbaas(dbaas_id):
+    DBaaS.objects.get(id=dbaas_id).reset_event()
 
 
 @app.task
@@ -0,0 +1,116 @@
+import bisect
+import hashlib
+import ipaddress
+import json
+from collections import defaultdict
+
+ALL_PORTS = (0, 65535)
+ACTION_ORDER = {"ACCEPT": 0, "DROP": 1}
+
+
+def parse_ports(ports):
+    """
+    "80" -> (80, 80), "80-110" -> (80, 110), 0 or "0" means every port.
+    """
+    ports = str(ports)
+    if ports in ("0", ""):
+        return ALL_PORTS
+    start, _, end = ports.partition("-")
+    return int(start), int(end or start)
+
+
+def format_ports(port_range):
+    if port_range == ALL_PORTS:
+        return "0"
+    start, end = port_range
+    return str(start) if start == end else f"{start}-{end}"
+
+
+def network_key(network):
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def collapse(addresses):
+    networks = defaultdict(list)
+    for address in addresses:
+        network = ipaddress.ip_network(address, strict=False)
+        networks[network.version].append(network)
+    # collapse_addresses() refuses mixed versions, collapse IPv4 and IPv6 separately
+    collapsed = [net for version in sorted(networks) for net in ipaddress.collapse_addresses(networks[version])]
+    return tuple(sorted(collapsed, key=network_key))
+
+
+def merge_ranges(port_ranges):
+    merged = []
+    for start, end in sorted(port_ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def covers(networks, starts, network):
+    """
+    True if `network` is inside one of the collapsed, sorted `networks`. Collapsed networks
+    do not overlap, so only the last one starting at or before `network` can contain it.
+    """
+    i = bisect.bisect_right(starts, network_key(network)[:2]) - 1
+    return i >= 0 and networks[i].version == network.version and network.subnet_of(networks[i])
+
+
+def shadows(rule, other):
+    action, protocol, port_range, networks = rule
+    if other[0] != action or other[1] not in (None, protocol):
+        return False
+    if not (other[2][0] <= port_range[0] and port_range[1] <= other[2][1]):
+        return False
+    starts = [network_key(network)[:2] for network in other[3]]
+    return all(covers(other[3], starts, network) for network in networks)
+
+
+def compile_direction(rules):
+    """
+    Compile the rules of one direction: networks of every rule are collapsed, port ranges
+    of rules with the same action, protocol and networks are merged, then rules fully
+    covered by a broader rule with the same action are dropped.
+    """
+    groups = defaultdict(list)
+    for rule in rules:
+        networks = collapse(rule["addresses"])
+        if not networks:
+            continue
+        groups[(rule["action"], rule["protocol"], networks)].append(parse_ports(rule["ports"]))
+
+    compiled = []
+    for (action, protocol, networks), port_ranges in groups.items():
+        for port_range in merge_ranges(port_ranges):
+            compiled.append((action, protocol, port_range, networks))
+
+    # Coverage is a strict partial order here (equal rules were merged above), so a rule
+    # covered by any other one can be dropped without losing the one covering it
+    kept = [rule for rule in compiled if not any(other is not rule and shadows(rule, other) for other in compiled)]
+
+    kept.sort(
+        key=lambda rule: (ACTION_ORDER.get(rule[0], 2), rule[1] or "", rule[2], [network_key(n) for n in rule[3]])
+    )
+    return [
+        {
+            "protocol": protocol,
+            "action": action,
+            "ports": format_ports(port_range),
+            "addresses": [str(network) for network in networks],
+        }
+        for action, protocol, port_range, networks in kept
+    ]
+
+
+def compile_rules(inbound_rules, outbound_rules):
+    """
+    Return the canonical (inbound, outbound, hash) of a rule set. Equal rule sets
+    compile to the same payload and hash whatever the order of rules and addresses.
+    """
+    inbound = compile_direction(inbound_rules)
+    outbound = compile_direction(outbound_rules)
+    digest = hashlib.sha256(json.dumps([inbound, outbound], sort_keys=True).encode()).hexdigest()
+    return inbound, outbound, digest
@@ -0,0 +1,55 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from firewall.compiler import compile_rules
+
+
+def random_rules(rules, cidrs, seed):
+    rand = random.Random(seed)
+    ruleset = []
+    for i in range(rules):
+        start = rand.randint(1, 65000)
+        ports = str(start) if i % 2 else f"{start}-{start + rand.randint(1, 500)}"
+        addresses = [
+            f"{rand.randint(1, 223)}.{rand.randint(0, 255)}.{rand.randint(0, 255)}.0/{rand.choice((22, 24, 26, 32))}"
+            for _ in range(cidrs // rules)
+        ]
+        protocol = rand.choice(("tcp", "udp"))
+        ruleset.append({"protocol": protocol, "action": "ACCEPT", "ports": ports, "addresses": addresses})
+    ruleset.append({"protocol": None, "action": "DROP", "ports": "0", "addresses": ["0.0.0.0/0"]})
+    return ruleset
+
+
+class Command(BaseCommand):
+    help = "Benchmark the firewall rule compiler on a generated rule set"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rules", type=int, default=20, help="Number of rules per direction")
+        parser.add_argument("--cidrs", type=int, default=10000, help="Number of CIDRs per direction")
+        parser.add_argument("--rounds", type=int, default=5, help="Number of compile rounds")
+        parser.add_argument("--seed", type=int, default=1, help="Random seed of the generated rule set")
+
+    def handle(self, *args, **kwargs):
+        inbound = random_rules(kwargs["rules"], kwargs["cidrs"], kwargs["seed"])
+        outbound = random_rules(kwargs["rules"], kwargs["cidrs"], kwargs["seed"] + 1)
+
+        timings = []
+        for _ in range(kwargs["rounds"]):
+            started = time.perf_counter()
+            compiled_in, compiled_out, rules_hash = compile_rules(inbound, outbound)
+            timings.append(time.perf_counter() - started)
+
+        rules_in = len(inbound) + len(outbound)
+        cidrs_in = sum(len(rule["addresses"]) for rule in inbound + outbound)
+        rules_out = len(compiled_in) + len(compiled_out)
+        cidrs_out = sum(len(rule["addresses"]) for rule in compiled_in + compiled_out)
+        timings.sort()
+        self.stdout.write(f"Input: {rules_in} rules, {cidrs_in} CIDRs")
+        self.stdout.write(f"Output: {rules_out} rules, {cidrs_out} CIDRs, hash {rules_hash[:12]}")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Compile: best {timings[0] * 1000:.1f}ms, median {timings[len(timings) // 2] * 1000:.1f}ms"
+            )
+        )
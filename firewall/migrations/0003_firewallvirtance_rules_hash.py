@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("firewall", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="firewallvirtance",
+            name="rules_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
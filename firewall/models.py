@@ -119,6 +119,7 @@ class Cidr(models.Model):
 class FirewallVirtance(models.Model):
     firewall = models.ForeignKey(Firewall, models.PROTECT)
     virtance = models.ForeignKey("virtance.Virtance", models.PROTECT)
+    rules_hash = models.CharField(max_length=64, blank=True, null=True)
     created = models.DateTimeField(auto_now_add=True)
 
     class Meta:
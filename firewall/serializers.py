@@ -1,12 +1,96 @@
 import ipaddress
 import re
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
 from rest_framework import serializers
 
 from virtance.models import Virtance
 
 from .models import Cidr, Firewall, FirewallVirtance, Rule
-from .tasks import firewall_attach, firewall_detach, firewall_update
+from .tasks import firewall_attach, firewall_detach, firewall_update_virtances
+
+FIREWALL_CACHE_KEY = "firewall_representation_{}_{}"
+FIREWALL_CACHE_TIMEOUT = int(settings.FIREWALL_CACHE_TIMEOUT)
+FIREWALL_PREFETCH = ("rule_set__cidr_set", "firewallvirtance_set")
+
+
+def firewall_cache_key(firewall):
+    return FIREWALL_CACHE_KEY.format(firewall.id, firewall.updated.timestamp())
+
+
+def split_cidr(cidr):
+    if "/" in cidr:
+        address, prefix = cidr.split("/")
+        return address, int(prefix)
+    return cidr, 32
+
+
+def sync_rules(firewall, direction, rules, addresses_key):
+    """
+    Replace the user rules of one direction with `rules` as a diff: unchanged rules are kept,
+    the rest is deleted and created. Returns True if anything has changed.
+    """
+    current = {}
+    stale_ids = []
+    for rule in Rule.objects.filter(firewall=firewall, direction=direction, is_system=False).prefetch_related(
+        "cidr_set"
+    ):
+        cidrs = frozenset((cidr.address, cidr.prefix) for cidr in rule.cidr_set.all())
+        key = (rule.protocol, str(rule.ports), cidrs)
+        # Duplicated rules are dropped, one of them is enough
+        if key in current:
+            stale_ids.append(rule.id)
+        else:
+            current[key] = rule.id
+
+    wanted = {}
+    for rule in rules:
+        ports = 0 if rule.get("protocol") == Rule.ICMP else rule.get("ports", 0)
+        cidrs = frozenset(split_cidr(cidr) for cidr in rule.get(addresses_key).get("addresses"))
+        wanted[(rule.get("protocol"), str(ports), cidrs)] = ports
+
+    stale_ids += [rule_id for key, rule_id in current.items() if key not in wanted]
+    new_keys = [key for key in wanted if key not in current]
+    if not stale_ids and not new_keys:
+        return False
+
+    with transaction.atomic():
+        Cidr.objects.filter(rule_id__in=stale_ids).delete()
+        Rule.objects.filter(id__in=stale_ids).delete()
+
+        # Rules are created one by one, MySQL does not return primary keys from bulk inserts
+        # and several rules may share the same protocol and ports
+        cidrs = []
+        for protocol, ports, addresses in new_keys:
+            rule = Rule.objects.create(
+                firewall=firewall,
+                direction=direction,
+                protocol=protocol,
+                action=Rule.ACCEPT,
+                ports=wanted[(protocol, ports, addresses)],
+            )
+            cidrs += [Cidr(rule=rule, address=address, prefix=prefix) for address, prefix in addresses]
+        Cidr.objects.bulk_create(cidrs)
+
+    return True
+
+
+def update_firewall_virtances(firewall):
+    virtance_ids = list(FirewallVirtance.objects.filter(firewall=firewall).values_list("virtance_id", flat=True))
+
+    # Saving bumps Firewall.updated, which also invalidates the cached representation
+    if virtance_ids:
+        firewall.event = Firewall.UPDATE
+    firewall.save()
+    if not virtance_ids:
+        return
+
+    Virtance.objects.filter(id__in=virtance_ids).update(event=Virtance.FIREWALL_ATTACH, updated=timezone.now())
+    firewall_update_virtances.delay(firewall.id, virtance_ids)
 
 
 class CidrField(serializers.Field):
@@ -76,6 +160,23 @@ class ListOfOutboundRulesSerializer(serializers.ListSerializer):
     child = OutboundRuleSerializer()
 
 
+class FirewallListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        firewalls = list(data.all() if isinstance(data, models.Manager) else data)
+        keys = {firewall.id: firewall_cache_key(firewall) for firewall in firewalls}
+        cached = cache.get_many(keys.values())
+
+        # Only firewalls changed since their last representation hit the database
+        missing = [firewall for firewall in firewalls if keys[firewall.id] not in cached]
+        prefetch_related_objects(missing, *FIREWALL_PREFETCH)
+        built = {keys[firewall.id]: self.child.build_representation(firewall) for firewall in missing}
+        if built:
+            cache.set_many(built, FIREWALL_CACHE_TIMEOUT)
+        cached.update(built)
+
+        return [cached[keys[firewall.id]] for firewall in firewalls]
+
+
 class FirewallSerializer(serializers.ModelSerializer):
     name = serializers.CharField(max_length=255, required=True)
     event = serializers.SerializerMethodField(read_only=True)
@@ -95,6 +196,7 @@ class FirewallSerializer(serializers.ModelSerializer):
             "inbound_rules",
             "outbound_rules",
         )
+        list_serializer_class = FirewallListSerializer
 
     def get_event(self, obj):
         if obj.event is None:
@@ -162,28 +264,37 @@ class FirewallSerializer(serializers.ModelSerializer):
 
         # Check virtance already assigned
         for v_id in virtance_ids:
-            if FirewallVirtance.objects.filter(firewall=self.instance, virance_id=v_id).exists():
+            if FirewallVirtance.objects.filter(firewall=self.instance, virtance_id=v_id).exists():
                 raise serializers.ValidationError(f"Virtance with ID {v_id} is already assigned firewall.")
 
         return attrs
 
     def to_representation(self, instance):
+        key = firewall_cache_key(instance)
+        data = cache.get(key)
+        if data is None:
+            data = self.build_representation(instance)
+            cache.set(key, data, FIREWALL_CACHE_TIMEOUT)
+        return data
+
+    def build_representation(self, instance):
         data = super().to_representation(instance)
+        prefetch_related_objects([instance], *FIREWALL_PREFETCH)
+        rules = [rule for rule in instance.rule_set.all() if not rule.is_system]
 
-        inbound_rules = Rule.objects.filter(firewall=instance, direction=Rule.INBOUND, is_system=False)
+        inbound_rules = [rule for rule in rules if rule.direction == Rule.INBOUND]
         for in_rule in inbound_rules:
             in_rule.sources = {}
-            in_rule.sources["addresses"] = [f"{i.address}/{i.prefix}" for i in Cidr.objects.filter(rule=in_rule)]
+            in_rule.sources["addresses"] = [f"{i.address}/{i.prefix}" for i in in_rule.cidr_set.all()]
         data["inbound_rules"] = InboundRuleSerializer(inbound_rules, many=True).data
 
-        outbound_rules = Rule.objects.filter(firewall=instance, direction=Rule.OUTBOUND, is_system=False)
+        outbound_rules = [rule for rule in rules if rule.direction == Rule.OUTBOUND]
         for out_rule in outbound_rules:
             out_rule.destinations = {}
-            out_rule.destinations["addresses"] = [f"{i.address}/{i.prefix}" for i in Cidr.objects.filter(rule=out_rule)]
+            out_rule.destinations["addresses"] = [f"{i.address}/{i.prefix}" for i in out_rule.cidr_set.all()]
         data["outbound_rules"] = OutboundRuleSerializer(outbound_rules, many=True).data
 
-        firewallvirtance = FirewallVirtance.objects.filter(firewall=instance)
-        data["virtance_ids"] = [fv.virtance.id for fv in firewallvirtance]
+        data["virtance_ids"] = [fv.virtance_id for fv in instance.firewallvirtance_set.all()]
 
         return data
 
@@ -196,77 +307,14 @@ class FirewallSerializer(serializers.ModelSerializer):
             instance.name = name
             instance.save()
 
-        # Inbound rules
+        changed = False
         if inbound_rules:
-            # Delete old inbound rules
-            for in_rule in Rule.objects.filter(firewall=instance, direction=Rule.INBOUND, is_system=False):
-                Cidr.objects.filter(rule=in_rule).delete()
-                in_rule.delete()
-
-            # Create new inbound rules
-            for in_rule in inbound_rules:
-                if in_rule.get("protocol") == Rule.ICMP:
-                    in_rule["ports"] = 0
-
-                rule = Rule.objects.create(
-                    firewall=instance,
-                    direction=Rule.INBOUND,
-                    protocol=in_rule.get("protocol"),
-                    action=Rule.ACCEPT,
-                    ports=in_rule.get("ports", 0),
-                )
-                for cidr in list(set(in_rule.get("sources").get("addresses"))):
-                    if "/" in cidr:
-                        address = cidr.split("/")[0]
-                        prefix = cidr.split("/")[1]
-                    else:
-                        address = cidr
-                        prefix = 32
-                    Cidr.objects.create(
-                        rule=rule,
-                        address=address,
-                        prefix=prefix,
-                    )
-
+            changed |= sync_rules(instance, Rule.INBOUND, inbound_rules, "sources")
         if outbound_rules:
-            # Delete old outbound rules
-            for out_rule in Rule.objects.filter(firewall=instance, direction=Rule.OUTBOUND, is_system=False):
-                Cidr.objects.filter(rule=out_rule).delete()
-                out_rule.delete()
+            changed |= sync_rules(instance, Rule.OUTBOUND, outbound_rules, "destinations")
 
-            # Create new outbound rules
-            for in_rule in inbound_rules:
-                if in_rule.get("protocol") == Rule.ICMP:
-                    in_rule["ports"] = 0
-
-                rule = Rule.objects.create(
-                    firewall=instance,
-                    direction=Rule.OUTBOUND,
-                    protocol=in_rule.get("protocol"),
-                    action=Rule.ACCEPT,
-                    ports=in_rule.get("ports", 0),
-                )
-                for cidr in list(set(in_rule.get("sources").get("addresses"))):
-                    if "/" in cidr:
-                        address = cidr.split("/")[0]
-                        prefix = cidr.split("/")[1]
-                    else:
-                        address = cidr
-                        prefix = 32
-                    Cidr.objects.create(
-                        rule=rule,
-                        address=address,
-                        prefix=prefix,
-                    )
-
-        # Update rules for virtances
-        for fw_to_virt in FirewallVirtance.objects.filter(firewall=instance):
-            instance.event = Firewall.UPDATE
-            instance.save()
-            virtance = Virtance.objects.get(id=fw_to_virt.virtance.id)
-            virtance.event = Virtance.FIREWALL_ATTACH
-            virtance.save()
-            firewall_update.delay(instance.id, virtance.id)
+        if changed:
+            update_firewall_virtances(instance)
 
         return instance
 
@@ -422,7 +470,7 @@ class FirewallSerializer(serializers.ModelSerializer):
 
         # Create Virtance links to firewall
         for virtance_id in list(set(virtance_ids)):
-            FirewallVirtance.create(
+            FirewallVirtance.objects.create(
                 firewall=firewall,
                 virtance_id=virtance_id,
             )
@@ -524,13 +572,7 @@ class FirewallAddRuleSerializer(serializers.Serializer):
                     )
 
         # Update rules for virtances
-        for fw_to_virt in FirewallVirtance.objects.filter(firewall=instance):
-            instance.event = Firewall.UPDATE
-            instance.save()
-            virtance = Virtance.objects.get(id=fw_to_virt.virtance.id)
-            virtance.event = Virtance.FIREWALL_ATTACH
-            virtance.save()
-            firewall_update.delay(instance.id, virtance.id)
+        update_firewall_virtances(instance)
 
         return validated_data
 
@@ -597,13 +639,7 @@ class FirewallDelRuleSerializer(serializers.Serializer):
                 rule.delete()
 
         # Update rules for virtances
-        for fw_to_virt in FirewallVirtance.objects.filter(firewall=instance):
-            instance.event = Firewall.UPDATE
-            instance.save()
-            virtance = Virtance.objects.get(id=fw_to_virt.virtance.id)
-            virtance.event = Virtance.FIREWALL_ATTACH
-            virtance.save()
-            firewall_update.delay(instance.id, virtance.id)
+        update_firewall_virtances(instance)
 
         return validated_data
 
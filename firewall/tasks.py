@@ -1,43 +1,62 @@
-from compute.webvirt import WebVirtCompute
+import asyncio
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+
+from compute.webvirt import WebVirtCompute, fan_out
 from network.models import IPAddress, Network
 from virtance.models import Virtance
 from virtance.utils import virtance_error
 from webvirtcloud.celery import app
 
-from .models import Cidr, Firewall, FirewallVirtance, Rule
+from .compiler import compile_rules
+from .models import Firewall, FirewallVirtance, Rule
 from .utils import firewall_error
 
+FIREWALL_APPLY_TIMEOUT = float(settings.FIREWALL_APPLY_TIMEOUT)
 
-@app.task
-def firewall_attach(firewall_id, virtance_id, virtance_reset_event=True):
+
+def firewall_rules(firewall):
+    """
+    Build the compiled inbound and outbound rule payloads of a firewall and their hash.
+    """
     inbound_rules = []
     outbound_rules = []
+
+    for rule in Rule.objects.filter(firewall=firewall).prefetch_related("cidr_set"):
+        payload = {
+            "protocol": rule.protocol,
+            "action": rule.action,
+            "ports": rule.ports,
+            "addresses": [f"{i.address}/{i.prefix}" for i in rule.cidr_set.all()],
+        }
+        if rule.direction == Rule.INBOUND:
+            inbound_rules.append(payload)
+        if rule.direction == Rule.OUTBOUND:
+            outbound_rules.append(payload)
+
+    return compile_rules(inbound_rules, outbound_rules)
+
+
+async def compute_firewall_update(wvcomp, firewall_id, targets, inbound_rules, outbound_rules):
+    async def update(virtance_id, ipv4_public, ipv4_private):
+        # Like firewall_update(), a failed detach (e.g. rules never applied) does not stop the attach
+        await wvcomp.firewall_detach(firewall_id, ipv4_public, ipv4_private)
+        return await wvcomp.firewall_attach(firewall_id, ipv4_public, ipv4_private, inbound_rules, outbound_rules)
+
+    host_targets = targets.get(wvcomp.host, [])
+    results = await asyncio.gather(*(update(*target) for target in host_targets))
+    return {target[0]: res for target, res in zip(host_targets, results)}
+
+
+@app.task
+def firewall_attach(firewall_id, virtance_id, virtance_reset_event=True):
     virtance = Virtance.objects.get(id=virtance_id)
     firewall = Firewall.objects.get(id=firewall_id)
-    firewall_rules = Rule.objects.filter(firewall=firewall)
     ipv4_public = IPAddress.objects.filter(virtance=virtance, network__type=Network.PUBLIC, is_float=False).first()
     ipv4_private = IPAddress.objects.filter(virtance=virtance, network__type=Network.PRIVATE).first()
-
-    for rule in firewall_rules:
-        cidrs = Cidr.objects.filter(rule=rule)
-        if rule.direction == Rule.INBOUND:
-            inbound_rules.append(
-                {
-                    "protocol": rule.protocol,
-                    "action": rule.action,
-                    "ports": rule.ports,
-                    "addresses": [f"{i.address}/{i.prefix}" for i in cidrs],
-                }
-            )
-        if rule.direction == Rule.OUTBOUND:
-            outbound_rules.append(
-                {
-                    "protocol": rule.protocol,
-                    "action": rule.action,
-                    "ports": rule.ports,
-                    "addresses": [f"{i.address}/{i.prefix}" for i in cidrs],
-                }
-            )
+    inbound_rules, outbound_rules, rules_hash = firewall_rules(firewall)
 
     wvcomp = WebVirtCompute(virtance.compute.token, virtance.compute.hostname)
     res = wvcomp.firewall_attach(firewall.id, ipv4_public.address, ipv4_private.address, inbound_rules, outbound_rules)
@@ -45,6 +64,7 @@ def firewall_attach(firewall_id, virtance_id, virtance_reset_event=True):
         firewall_error(firewall_id, res.get("detail"), "firewall_attach")
         virtance_error(virtance_id, res.get("detail"), "firewall_attach")
     else:
+        FirewallVirtance.objects.filter(firewall=firewall, virtance=virtance).update(rules_hash=rules_hash)
         if virtance_reset_event is True:
             virtance.reset_event()
         firewall.reset_event()
@@ -65,6 +85,8 @@ def firewall_detach(firewall_id, virtance_id, virtance_reset_event=True, unlink_
     else:
         if unlink_db is True:
             FirewallVirtance.objects.filter(firewall=firewall, virtance=virtance).delete()
+        else:
+            FirewallVirtance.objects.filter(firewall=firewall, virtance=virtance).update(rules_hash=None)
         if virtance_reset_event is True:
             virtance.reset_event()
         firewall.reset_event()
@@ -77,3 +99,77 @@ def firewall_update(firewall_id, virtance_id):
 
     # Attach firewall with new rules
     firewall_attach(firewall_id, virtance_id)
+
+
+@app.task
+def firewall_update_virtances(firewall_id, virtance_ids=None):
+    """
+    Re-apply the rules of a firewall on its virtances: the payload is built once and
+    every compute gets one batch with all of its virtances, computes run concurrently.
+    Virtances which already run the same compiled rule set are skipped. Virtances not
+    placed on a compute yet only get their event reset, they keep no rules hash so the
+    next update after placement applies the rules.
+    """
+    firewall = Firewall.objects.get(id=firewall_id)
+    inbound_rules, outbound_rules, rules_hash = firewall_rules(firewall)
+
+    links = FirewallVirtance.objects.filter(firewall=firewall).select_related("virtance__compute")
+    if virtance_ids is not None:
+        links = links.filter(virtance_id__in=virtance_ids)
+    unchanged = [link.virtance_id for link in links if link.rules_hash == rules_hash]
+    unplaced = [link.virtance_id for link in links if link.virtance.compute is None and link.rules_hash != rules_hash]
+    virtances = [link.virtance for link in links if link.virtance.compute is not None and link.rules_hash != rules_hash]
+
+    addresses = defaultdict(dict)
+    ipaddrs = IPAddress.objects.filter(virtance__in=virtances, is_float=False).values_list(
+        "virtance_id", "network__type", "address"
+    )
+    for virtance_id, network_type, address in ipaddrs:
+        addresses[virtance_id].setdefault(network_type, address)
+
+    targets = defaultdict(list)
+    for virtance in virtances:
+        ipv4_public = addresses[virtance.id].get(Network.PUBLIC)
+        ipv4_private = addresses[virtance.id].get(Network.PRIVATE)
+        targets[virtance.compute.hostname].append((virtance.id, ipv4_public, ipv4_private))
+
+    # Computes the virtances run on, a hostname may be reused by a retired compute
+    computes = list({virtance.compute_id: virtance.compute for virtance in virtances}.values())
+    results = fan_out(
+        computes,
+        compute_firewall_update,
+        firewall.id,
+        targets,
+        inbound_rules,
+        outbound_rules,
+        timeout=FIREWALL_APPLY_TIMEOUT,
+    )
+
+    updated = []
+    failed_hosts = {}
+    for compute in computes:
+        res = results.get(compute.id)
+        # Whole compute is unreachable or timed out, report the host once
+        if res is None or res.get("detail"):
+            detail = res.get("detail") if res else "Compute did not respond."
+            failed_hosts[compute.hostname] = detail
+            firewall_error(firewall.id, f"{compute.hostname}: {detail}", "firewall_update")
+            for virtance_id, _, _ in targets[compute.hostname]:
+                virtance_error(virtance_id, detail, "firewall_attach")
+            continue
+        for virtance_id, virtance_res in res.items():
+            if isinstance(virtance_res, dict) and virtance_res.get("detail"):
+                failed_hosts.setdefault(compute.hostname, virtance_res.get("detail"))
+                firewall_error(firewall.id, f"{compute.hostname}: {virtance_res.get('detail')}", "firewall_update")
+                virtance_error(virtance_id, virtance_res.get("detail"), "firewall_attach")
+            else:
+                updated.append(virtance_id)
+
+    FirewallVirtance.objects.filter(firewall=firewall, virtance_id__in=updated).update(rules_hash=rules_hash)
+    Virtance.objects.filter(id__in=updated + unchanged + unplaced, event=Virtance.FIREWALL_ATTACH).update(
+        event=None, updated=timezone.now()
+    )
+    if not failed_hosts:
+        firewall.reset_event()
+
+    return {"updated": len(updated), "unchanged": len(unchanged), "failed_hosts": failed_hosts}
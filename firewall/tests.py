@@ -0,0 +1,139 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from account.models import User
+from compute.models import Compute
+from image.models import Image
+from region.models import Region
+from size.models import Size
+from virtance.models import Virtance
+
+from .models import Firewall, FirewallVirtance, Rule
+from .serializers import FirewallSerializer, sync_rules, update_firewall_virtances
+from .tasks import firewall_update_virtances
+
+
+def inbound_rule(protocol, ports, *addresses):
+    return {"protocol": protocol, "ports": ports, "sources": {"addresses": list(addresses)}}
+
+
+class SyncRulesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("firewall@example.com", "password")
+        self.firewall = Firewall.objects.create(user=self.user, name="firewall")
+
+    def user_rules(self):
+        rules = Rule.objects.filter(firewall=self.firewall, direction=Rule.INBOUND, is_system=False)
+        return sorted(
+            (rule.protocol, str(rule.ports), sorted(f"{cidr.address}/{cidr.prefix}" for cidr in rule.cidr_set.all()))
+            for rule in rules
+        )
+
+    def test_duplicate_protocol_and_ports(self):
+        rules = [inbound_rule(Rule.TCP, 22, "10.0.0.0/8"), inbound_rule(Rule.TCP, 22, "192.168.0.0/16")]
+
+        self.assertTrue(sync_rules(self.firewall, Rule.INBOUND, rules, "sources"))
+        self.assertEqual(
+            self.user_rules(),
+            [(Rule.TCP, "22", ["10.0.0.0/8"]), (Rule.TCP, "22", ["192.168.0.0/16"])],
+        )
+
+    def test_resubmission_is_unchanged(self):
+        rules = [
+            inbound_rule(Rule.TCP, 22, "10.0.0.0/8"),
+            inbound_rule(Rule.TCP, 22, "192.168.0.0/16"),
+            inbound_rule(Rule.ICMP, 0, "0.0.0.0/0"),
+        ]
+
+        self.assertTrue(sync_rules(self.firewall, Rule.INBOUND, rules, "sources"))
+        with self.assertNumQueries(2):
+            self.assertFalse(sync_rules(self.firewall, Rule.INBOUND, rules, "sources"))
+
+    def test_diff(self):
+        sync_rules(self.firewall, Rule.INBOUND, [inbound_rule(Rule.TCP, 22, "10.0.0.0/8")], "sources")
+        kept = Rule.objects.get(firewall=self.firewall, is_system=False)
+
+        rules = [inbound_rule(Rule.TCP, 22, "10.0.0.0/8"), inbound_rule(Rule.TCP, "80-443", "0.0.0.0/0")]
+        self.assertTrue(sync_rules(self.firewall, Rule.INBOUND, rules, "sources"))
+        self.assertTrue(Rule.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(
+            self.user_rules(),
+            [(Rule.TCP, "22", ["10.0.0.0/8"]), (Rule.TCP, "80-443", ["0.0.0.0/0"])],
+        )
+
+
+class FirewallListTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("firewall@example.com", "password")
+        for i in range(5):
+            firewall = Firewall.objects.create(user=self.user, name=f"firewall-{i}")
+            sync_rules(firewall, Rule.INBOUND, [inbound_rule(Rule.TCP, 22, "10.0.0.0/8")], "sources")
+
+    def serialize(self, firewalls):
+        return FirewallSerializer(firewalls, many=True).data
+
+    def test_query_count(self):
+        with self.assertNumQueries(4):
+            cold = self.serialize(Firewall.objects.filter(user=self.user))
+
+        firewalls = list(Firewall.objects.filter(user=self.user))
+        with self.assertNumQueries(0):
+            warm = self.serialize(firewalls)
+        self.assertEqual(warm, cold)
+
+    def test_updated_invalidates_cache(self):
+        self.serialize(Firewall.objects.filter(user=self.user))
+
+        firewall = Firewall.objects.filter(user=self.user).first()
+        sync_rules(firewall, Rule.INBOUND, [inbound_rule(Rule.TCP, 443, "0.0.0.0/0")], "sources")
+        update_firewall_virtances(firewall)
+
+        with self.assertNumQueries(4):
+            data = self.serialize(Firewall.objects.filter(user=self.user))
+        inbound_rules = next(item for item in data if item["uuid"] == str(firewall.uuid))["inbound_rules"]
+        self.assertEqual(
+            inbound_rules, [{"protocol": Rule.TCP, "ports": "443", "sources": {"addresses": ["0.0.0.0/0"]}}]
+        )
+
+
+class FirewallUpdateVirtancesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("firewall@example.com", "password")
+        self.firewall = Firewall.objects.create(user=self.user, name="firewall")
+        self.region = Region.objects.create(name="Region", slug="region")
+        self.size = Size.objects.create(name="Size", slug="size", vcpu=1, disk=1, memory=1, transfer=1)
+        self.template = Image.objects.create(name="Template", type=Image.DISTRIBUTION, md5sum="", file_name="image")
+
+    def create_virtance(self, compute=None):
+        virtance = Virtance.objects.create(
+            user=self.user,
+            size=self.size,
+            region=self.region,
+            template=self.template,
+            compute=compute,
+            event=Virtance.FIREWALL_ATTACH,
+            name="virtance",
+            disk=1,
+        )
+        FirewallVirtance.objects.create(firewall=self.firewall, virtance=virtance)
+        return virtance
+
+    def create_compute(self, **kwargs):
+        return Compute.objects.create(name="compute", hostname="compute", token="token", region=self.region, **kwargs)
+
+    def test_routes_by_compute_and_resets_unplaced(self):
+        self.create_compute(is_active=False, is_deleted=True)
+        compute = self.create_compute()
+        placed = self.create_virtance(compute)
+        unplaced = self.create_virtance()
+
+        with mock.patch("firewall.tasks.fan_out", return_value={compute.id: {placed.id: {}}}) as fan_out:
+            result = firewall_update_virtances(self.firewall.id)
+
+        self.assertEqual(fan_out.call_args.args[0], [compute])
+        self.assertEqual(result, {"updated": 1, "unchanged": 0, "failed_hosts": {}})
+        self.assertEqual(set(Virtance.objects.values_list("event", flat=True)), {None})
+        self.assertIsNone(FirewallVirtance.objects.get(virtance=unplaced).rules_hash)
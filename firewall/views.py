@@ -26,7 +26,7 @@ class FirewallListAPI(APIView):
 
         if virtance_id and virtance_id.isdigit():
             firewallvirtance = FirewallVirtance.objects.filter(virtance_id=virtance_id).first()
-            queryset = queryset.filter(id=firewallvirtance.firewall.id) if firewallvirtance else []
+            queryset = queryset.filter(id=firewallvirtance.firewall_id) if firewallvirtance else []
 
         return queryset
 
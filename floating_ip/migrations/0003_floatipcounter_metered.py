@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("floating_ip", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="floatipcounter",
+            name="metered",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -54,6 +54,7 @@ class FloatIPCounter(models.Model):
     started = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     stopped = models.DateTimeField(blank=True, null=True)
+    metered = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         ordering = ["-id"]
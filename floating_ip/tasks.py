@@ -1,8 +1,8 @@
-from decimal import Decimal
 from ipaddress import IPv4Network
 
 from django.utils import timezone
 
+from billing.metering import run_metering
 from compute.webvirt import WebVirtCompute
 from network.models import IPAddress, Network
 from virtance.models import Virtance
@@ -159,35 +159,4 @@ def delete_floating_ip(floating_ip_id):
 
 @app.task
 def floating_ip_counter():
-    new_period = False
-    current_time = timezone.now()
-    current_day = current_time.day
-    current_hour = current_time.hour
-    first_day_current_month = current_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-    if current_day == 1 and current_hour == 0:
-        new_period = True
-
-    for floatip in FloatIP.objects.filter(is_deleted=False):
-        try:
-            FloatIPCounter.objects.get(started__gt=first_day_current_month, stopped=None, floatip=floatip)
-        except FloatIPCounter.DoesNotExist:
-            period_start = current_time - timezone.timedelta(hours=1)
-            if new_period is True:
-                period_start = first_day_current_month
-            FloatIPCounter.objects.create(
-                floatip=floatip, ipaddress=floatip.ipaddress.address, amount=0.0, started=period_start
-            )
-
-    if new_period is True:
-        prev_month = current_time - timezone.timedelta(days=1)
-        last_day_prev_month = prev_month.replace(hour=23, minute=59, second=59, microsecond=999999)
-        first_day_prev_month = prev_month.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-        floating_ip_counters = FloatIPCounter.objects.filter(started__gt=first_day_prev_month, stopped=None)
-        floating_ip_counters.update(stopped=last_day_prev_month)
-    else:
-        floating_ip_counters = FloatIPCounter.objects.filter(started__gt=first_day_current_month, stopped=None)
-        for floatip_count in floating_ip_counters:
-            floatip_count.amount += Decimal(0.0)
-            floatip_count.save()
+    return run_metering("floating_ip")
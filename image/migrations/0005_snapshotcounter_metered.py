@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image", "0004_alter_image_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snapshotcounter",
+            name="metered",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.18 on 2026-10-18 16:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("compute", "0002_computecapacity"),
+        ("image", "0005_snapshotcounter_metered"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageLocation",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("pool", models.CharField(blank=True, max_length=100, null=True)),
+                ("file_name", models.CharField(max_length=100)),
+                ("is_orphan", models.BooleanField(default=False, verbose_name="Orphan")),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "compute",
+                    models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to="compute.compute"),
+                ),
+                (
+                    "image",
+                    models.ForeignKey(
+                        blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to="image.image"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Image Location",
+                "verbose_name_plural": "Image Locations",
+                "ordering": ["-id"],
+            },
+        ),
+    ]
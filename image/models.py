@@ -107,6 +107,7 @@ class SnapshotCounter(models.Model):
     started = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     stopped = models.DateTimeField(blank=True, null=True)
+    metered = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         ordering = ["-id"]
@@ -121,6 +122,24 @@ class SnapshotCounter(models.Model):
         return self.started
 
 
+class ImageLocation(models.Model):
+    image = models.ForeignKey(Image, models.PROTECT, blank=True, null=True)
+    compute = models.ForeignKey("compute.Compute", models.PROTECT)
+    pool = models.CharField(max_length=100, blank=True, null=True)
+    file_name = models.CharField(max_length=100)
+    is_orphan = models.BooleanField("Orphan", default=False)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-id"]
+        verbose_name = "Image Location"
+        verbose_name_plural = "Image Locations"
+
+    def __unicode__(self):
+        return self.file_name
+
+
 class ImageError(models.Model):
     image = models.ForeignKey(Image, models.PROTECT)
     event = models.CharField(max_length=40, blank=True, null=True)
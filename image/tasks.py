@@ -1,14 +1,76 @@
-from decimal import Decimal
+import asyncio
+import re
 
+from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
+from billing.metering import run_metering
 from compute.models import Compute
-from compute.webvirt import WebVirtCompute
+from compute.webvirt import fan_out
 from webvirtcloud.celery import app
 
-from .models import Image, SnapshotCounter
+from .models import Image, ImageLocation
 from .utils import image_error
 
+IMAGE_INVENTORY_TIMEOUT = float(settings.IMAGE_INVENTORY_TIMEOUT)
+# Snapshots used to be named by a bare uuid4 hex, see virtance.tasks.snapshot_virtance
+ORPHAN_NAME = re.compile(r"^(backup-|snapshot-|[0-9a-f]{32}\b)")
+
+
+async def storage_inventory(wvcomp):
+    """
+    Return {pool: [volume names]} of a compute, or the error of its storage listing.
+    """
+    res = await wvcomp.get_storages()
+    if res.get("detail") is not None:
+        return res
+
+    names = [storage.get("name") for storage in res.get("storages")]
+    pools = await asyncio.gather(*(wvcomp.get_storage(name) for name in names))
+    inventory = {}
+    for name, res in zip(names, pools):
+        if res.get("detail") is None:
+            inventory[name] = [vol.get("name") for vol in res.get("storage").get("volumes")]
+    return inventory
+
+
+async def find_storage_volume(wvcomp, file_name):
+    inventory = await storage_inventory(wvcomp)
+    if inventory.get("detail") is not None:
+        return inventory
+
+    for pool, volumes in inventory.items():
+        if file_name in volumes:
+            return await wvcomp.delete_storage_volume(pool, file_name)
+    return None
+
+
+async def delete_located_volume(wvcomp, pools, file_name):
+    pool = pools.get(wvcomp.host)
+    if pool is None:
+        return await find_storage_volume(wvcomp, file_name)
+    return await wvcomp.delete_storage_volume(pool, file_name)
+
+
+def delete_region_volume(image, region):
+    """
+    Delete the volume of an image in a region. Indexed computes are asked directly,
+    the region is only swept when the image has no location there or it is stale.
+    """
+    locations = ImageLocation.objects.filter(image=image, compute__region=region, is_orphan=False).select_related(
+        "compute"
+    )
+    if locations:
+        computes = [location.compute for location in locations]
+        pools = {location.compute.hostname: location.pool for location in locations}
+        results = fan_out(computes, delete_located_volume, pools, image.file_name)
+        if any(res is not None and res.get("detail") is None for res in results.values()):
+            return results
+
+    computes = Compute.objects.filter(region=region, is_active=True, is_deleted=False)
+    return fan_out(computes, find_storage_volume, image.file_name)
+
 
 @app.task
 def image_delete(image_id):
@@ -18,24 +80,14 @@ def image_delete(image_id):
 
     if image.type == Image.SNAPSHOT or image.type == Image.BACKUP:
         for region in image.regions.all():
-            computes = Compute.objects.filter(region=region, is_active=True, is_deleted=False).order_by("?")
-            for compute in computes:
-                wvcomp = WebVirtCompute(compute.token, compute.hostname)
-                res = wvcomp.get_storages()
-                if res.get("detail") is None:
-                    for storage in res.get("storages"):
-                        res = wvcomp.get_storage(storage.get("name"))
-                        if res.get("detail") is None:
-                            storage = res.get("storage")
-                            for vol in storage.get("volumes"):
-                                if vol.get("name") == image.file_name:
-                                    res = wvcomp.delete_storage_volume(storage.get("name"), vol.get("name"))
-                                    if res.get("detail") is None:
-                                        image.regions.remove(region)
-                                        break
-                if res.get("detail"):
-                    image_error(image.id, f"Region: {region}, Error:{res.get('detail')}", f"delete_image_{image.type}")
-                    return False
+            results = delete_region_volume(image, region)
+            errors = [res.get("detail") for res in results.values() if res is not None and res.get("detail")]
+            if any(res is not None and res.get("detail") is None for res in results.values()):
+                image.regions.remove(region)
+                ImageLocation.objects.filter(image=image, compute__region=region).delete()
+            elif errors:
+                image_error(image.id, f"Region: {region}, Error:{errors[0]}", f"delete_image_{image.type}")
+                return False
 
         if image.regions.count() == 0:
             image.delete()
@@ -43,35 +95,69 @@ def image_delete(image_id):
     return True
 
 
+@app.task
+def image_location_sync():
+    """
+    Rebuild the image location index from a concurrent storage inventory of every compute.
+    Volumes of deleted images and backup/snapshot volumes without an image are flagged
+    as orphans and returned. Only locations of swept computes are replaced, unreachable
+    ones keep their previous locations.
+    """
+    started = timezone.now()
+    computes = list(Compute.objects.filter(is_active=True, is_deleted=False))
+    results = fan_out(computes, storage_inventory, timeout=IMAGE_INVENTORY_TIMEOUT)
+
+    # Images are read after the sweep, backups and snapshots finished meanwhile are not orphans
+    images = {}
+    for image_id, file_name, is_deleted in Image.objects.filter(type__in=[Image.SNAPSHOT, Image.BACKUP]).values_list(
+        "id", "file_name", "is_deleted"
+    ):
+        # A file name reused by a live image wins over deleted ones
+        if file_name not in images or not is_deleted:
+            images[file_name] = (image_id, is_deleted)
+    other_images = set(
+        Image.objects.exclude(type__in=[Image.SNAPSHOT, Image.BACKUP]).values_list("file_name", flat=True)
+    )
+
+    locations = []
+    swept = []
+    for compute in computes:
+        inventory = results.get(compute.id)
+        if inventory is None or inventory.get("detail") is not None:
+            continue
+        swept.append(compute.id)
+        for pool, volumes in inventory.items():
+            for name in volumes:
+                if name in images:
+                    image_id, is_deleted = images[name]
+                elif ORPHAN_NAME.match(name) and name not in other_images:
+                    image_id, is_deleted = None, True
+                else:
+                    continue
+                locations.append(
+                    ImageLocation(image_id=image_id, compute=compute, pool=pool, file_name=name, is_orphan=is_deleted)
+                )
+
+    with transaction.atomic():
+        # Locations written by snapshot and backup tasks while the sweep was running are kept
+        ImageLocation.objects.filter(compute_id__in=swept, updated__lt=started).delete()
+        kept = set(ImageLocation.objects.filter(compute_id__in=swept).values_list("compute_id", "file_name"))
+        ImageLocation.objects.bulk_create(
+            [location for location in locations if (location.compute_id, location.file_name) not in kept]
+        )
+
+    orphans = [
+        f"{location.compute.hostname}:{location.pool}/{location.file_name}"
+        for location in locations
+        if location.is_orphan
+    ]
+    return {
+        "indexed": len(locations) - len(orphans),
+        "orphans": orphans,
+        "failed_computes": len(computes) - len(swept),
+    }
+
+
 @app.task
 def snapshot_counter():
-    new_period = False
-    current_time = timezone.now()
-    current_day = current_time.day
-    current_hour = current_time.hour
-    first_day_current_month = current_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-    if current_day == 1 and current_hour == 0:
-        new_period = True
-
-    for image in Image.objects.filter(type=Image.SNAPSHOT, is_deleted=False):
-        try:
-            SnapshotCounter.objects.get(started__gt=first_day_current_month, stopped=None, image=image)
-        except SnapshotCounter.DoesNotExist:
-            period_start = current_time - timezone.timedelta(hours=1)
-            if new_period is True:
-                period_start = first_day_current_month
-            SnapshotCounter.objects.create(image=image, amount=0.0, started=period_start)
-
-    if new_period is True:
-        prev_month = current_time - timezone.timedelta(days=1)
-        last_day_prev_month = prev_month.replace(hour=23, minute=59, second=59, microsecond=999999)
-        first_day_prev_month = prev_month.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-        snapshot_counters = SnapshotCounter.objects.filter(started__gt=first_day_prev_month, stopped=None)
-        snapshot_counters.update(stopped=last_day_prev_month)
-    else:
-        snapshot_counters = SnapshotCounter.objects.filter(started__gt=first_day_current_month, stopped=None)
-        for snap_count in snapshot_counters:
-            snap_count.amount += Decimal(0.0)
-            snap_count.save()
+    return run_metering("snapshot")
@@ -1,5 +1,11 @@
-from .models import ImageError
+from .models import ImageError, ImageLocation
 
 
 def image_error(image_id, message, event=None):
     ImageError.objects.create(image_id=image_id, message=message, event=event)
+
+
+def image_location(image, compute, pool=None):
+    ImageLocation.objects.update_or_create(
+        image=image, compute=compute, defaults={"pool": pool, "file_name": image.file_name, "is_orphan": False}
+    )
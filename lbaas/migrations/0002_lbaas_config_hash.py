@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("lbaas", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lbaas",
+            name="config_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -51,6 +51,7 @@ class LBaaS(models.Model):
     sticky_sessions_cookie_name = models.CharField(max_length=100, default="sessionid")
     sticky_sessions_cookie_ttl = models.IntegerField(default=3600)
     redirect_http_to_https = models.BooleanField(default=False)
+    config_hash = models.CharField(max_length=64, blank=True, null=True)
     is_deleted = models.BooleanField("Deleted", default=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
@@ -10,7 +10,8 @@ from virtance.models import Virtance
 from virtance.utils import encrypt_data, make_ssh_private
 
 from .models import LBaaS, LBaaSForwadRule, LBaaSVirtance
-from .tasks import create_lbaas, reload_lbaas
+from .shared import shared_reload_lbaas
+from .tasks import create_lbaas
 
 
 class HeathCheckSerializer(serializers.Serializer):
@@ -399,7 +400,7 @@ class LBaaSUpdateSerializer(serializers.ModelSerializer):
         instance.event = LBaaS.RELOAD
         instance.save()
 
-        reload_lbaas.delay(instance.id)
+        shared_reload_lbaas(instance.id)
 
         return instance
 
@@ -442,7 +443,7 @@ class LBaaSAddVirtanceSerializer(serializers.ModelSerializer):
         instance.event = LBaaS.ADD_VIRTANCE
         instance.save()
 
-        reload_lbaas.delay(instance.id)
+        shared_reload_lbaas(instance.id)
 
         return validated_data
 
@@ -486,7 +487,7 @@ class LBaaSDelVirtanceSerializer(serializers.ModelSerializer):
         instance.event = LBaaS.REMOVE_VIRTANCE
         instance.save()
 
-        reload_lbaas.delay(instance.id)
+        shared_reload_lbaas(instance.id)
 
         return validated_data
 
@@ -585,7 +586,7 @@ class LBaaSAddRuleSerializer(serializers.ModelSerializer):
         instance.event = LBaaS.ADD_FORWARD_RULE
         instance.save()
 
-        reload_lbaas.delay(instance.id)
+        shared_reload_lbaas(instance.id)
 
         return validated_data
 
@@ -698,7 +699,7 @@ class LBaaSUpdateRuleSerializer(serializers.ModelSerializer):
         instance.event = LBaaS.UPDATE_FORWARD_RULE
         instance.save()
 
-        reload_lbaas.delay(instance.id)
+        shared_reload_lbaas(instance.id)
 
         return validated_data
 
@@ -771,6 +772,6 @@ class LBaaSDelRuleSerializer(serializers.ModelSerializer):
         instance.event = LBaaS.REMOVE_FORWARD_RULE
         instance.save()
 
-        reload_lbaas.delay(instance.id)
+        shared_reload_lbaas(instance.id)
 
         return validated_data
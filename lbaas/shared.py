@@ -1,6 +1,17 @@
 import importlib
 
+from django.conf import settings
+from django.core.cache import cache
+
+LBAAS_RELOAD_KEY = "lbaas_reload_{}"
+
 
 def shared_reload_lbaas(lbaas_id):
-    lbaas_tasks = importlib.import_module("lbaas.tasks")
-    lbaas_tasks.reload_lbaas(lbaas_id)
+    """
+    Coalesce reloads of a load balancer: the first change schedules reload_lbaas at the end
+    of the LBAAS_RELOAD_DEBOUNCE window, changes made within the window are pushed by that run.
+    """
+    debounce = int(settings.LBAAS_RELOAD_DEBOUNCE)
+    if cache.add(LBAAS_RELOAD_KEY.format(lbaas_id), True, debounce):
+        lbaas_tasks = importlib.import_module("lbaas.tasks")
+        lbaas_tasks.reload_lbaas.apply_async((lbaas_id,), countdown=debounce)
@@ -1,13 +1,25 @@
+import hashlib
+import os
+import time
+
 from django.conf import settings
+from jinja2 import Environment, FileSystemLoader
 
 from network.models import IPAddress, Network
 from virtance.provision import ansible_play
-from virtance.tasks import create_virtance, delete_virtance
+from virtance.tasks import create_virtance, delete_virtance, virtance_ssh_ready
 from virtance.utils import check_ssh_connect, decrypt_data, virtance_error
 from webvirtcloud.celery import app
 
 from .models import LBaaS, LBaaSForwadRule, LBaaSVirtance
 
+HAPROXY_TEMPLATE = "ansible/lbaas/haproxy.cfg.j2"
+HAPROXY_TEMPLATES = Environment(
+    loader=FileSystemLoader(os.path.join(settings.BASE_DIR.parent, "templates")),
+    trim_blocks=True,
+    keep_trailing_newline=True,
+)
+
 provision_tasks = [
     {
         "name": "Disable systemd-resolved service",
@@ -40,15 +52,16 @@ provision_tasks = [
         },
     },
     {
-        "name": "Template HAProxy configuration",
+        "name": "Copy HAProxy configuration",
         "action": {
-            "module": "template",
+            "module": "copy",
             "args": {
-                "src": "ansible/lbaas/haproxy.cfg.j2",
+                "content": "{{ haproxy_config }}",
                 "dest": "/etc/haproxy/haproxy.cfg",
                 "owner": "root",
                 "group": "root",
                 "mode": "0644",
+                "validate": "haproxy -c -f %s",
             },
         },
     },
@@ -115,28 +128,98 @@ provision_tasks = [
 
 reload_tasks = [
     {
-        "name": "Template HAProxy configuration",
+        "name": "Copy HAProxy configuration",
         "action": {
-            "module": "template",
+            "module": "copy",
             "args": {
-                "src": "ansible/lbaas/haproxy.cfg.j2",
+                "content": "{{ haproxy_config }}",
                 "dest": "/etc/haproxy/haproxy.cfg",
                 "owner": "root",
                 "group": "root",
                 "mode": "0644",
+                "validate": "haproxy -c -f %s",
             },
         },
     },
     {
-        "name": "Restart haproxy service",
+        "name": "Reload haproxy service",
         "action": {
             "module": "systemd",
-            "args": {"name": "haproxy", "state": "restarted", "enabled": "yes"},
+            "args": {"name": "haproxy", "state": "reloaded"},
         },
     },
 ]
 
 
+def get_lbaas_vars(lbaas, ipv4_public, ipv4_private):
+    health = {
+        "check_protocol": lbaas.check_protocol,
+        "check_port": lbaas.check_port,
+        "check_path": lbaas.check_path,
+        "check_interval_seconds": lbaas.check_interval_seconds,
+        "check_timeout_seconds": lbaas.check_timeout_seconds,
+        "check_unhealthy_threshold": lbaas.check_unhealthy_threshold,
+        "check_healthy_threshold": lbaas.check_healthy_threshold,
+    }
+
+    forwarding_rules = []
+    for rule in LBaaSForwadRule.objects.filter(lbaas=lbaas, is_deleted=False):
+        forwarding_rules.append(
+            {
+                "entry_port": rule.entry_port,
+                "entry_protocol": rule.entry_protocol,
+                "target_port": rule.target_port,
+                "target_protocol": rule.target_protocol,
+            }
+        )
+
+    sticky_sessions = {}
+    if lbaas.sticky_sessions:
+        sticky_sessions = {
+            "cookie_ttl": lbaas.sticky_sessions_cookie_ttl,
+            "cookie_name": lbaas.sticky_sessions_cookie_name,
+        }
+
+    virtances = []
+    lbaas_virtances = LBaaSVirtance.objects.filter(lbaas=lbaas, virtance__is_deleted=False, is_deleted=False)
+    private_addresses = dict(
+        IPAddress.objects.filter(
+            virtance_id__in=lbaas_virtances.values("virtance_id"), network__type=Network.PRIVATE, is_float=False
+        ).values_list("virtance_id", "address")
+    )
+    for virtance_id in lbaas_virtances.values_list("virtance_id", flat=True):
+        virtances.append(
+            {
+                "id": virtance_id,
+                "ipv4_address": private_addresses[virtance_id],
+            }
+        )
+
+    lbaas_vars = {
+        "health": health,
+        "virtances": virtances,
+        "sticky_sessions": sticky_sessions,
+        "forwarding_rules": forwarding_rules,
+        "redirect_to_https": lbaas.redirect_http_to_https,
+        "ipv4_public_address": ipv4_public.address,
+        "ipv4_private_address": ipv4_private.address,
+        "ipv4_private_gateway": ipv4_private.network.gateway,
+        "ipv4_lbaas_access_list": settings.LBAAS_IPV4_ACCESS_LIST,
+    }
+    lbaas_vars["haproxy_config"] = render_haproxy_config(lbaas_vars)
+    return lbaas_vars
+
+
+def render_haproxy_config(lbaas_vars):
+    # Same rendering options as the Ansible template module
+    template = HAPROXY_TEMPLATES.get_template(HAPROXY_TEMPLATE)
+    return template.render(**lbaas_vars)
+
+
+def config_hash(config):
+    return hashlib.sha256(config.encode()).hexdigest()
+
+
 def provision_lbaas(host, private_key, tasks, lbaas_vars=None):
     task = None
     error = None
@@ -160,140 +243,56 @@ def provision_lbaas(host, private_key, tasks, lbaas_vars=None):
 @app.task
 def create_lbaas(lbaas_id):
     lbaas = LBaaS.objects.get(id=lbaas_id)
-    private_key = decrypt_data(lbaas.private_key)
 
     if create_virtance(lbaas.virtance.id, send_email=False):
         ipv4_public = IPAddress.objects.get(virtance=lbaas.virtance, network__type=Network.PUBLIC, is_float=False)
-        ipv4_private = IPAddress.objects.get(virtance=lbaas.virtance, network__type=Network.PRIVATE, is_float=False)
-
-        if check_ssh_connect(ipv4_public.address, private_key=private_key):
-            health = {
-                "check_protocol": lbaas.check_protocol,
-                "check_port": lbaas.check_port,
-                "check_path": lbaas.check_path,
-                "check_interval_seconds": lbaas.check_interval_seconds,
-                "check_timeout_seconds": lbaas.check_timeout_seconds,
-                "check_unhealthy_threshold": lbaas.check_unhealthy_threshold,
-                "check_healthy_threshold": lbaas.check_healthy_threshold,
-            }
-
-            forwarding_rules = []
-            for rule in LBaaSForwadRule.objects.filter(lbaas=lbaas, is_deleted=False):
-                forwarding_rules.append(
-                    {
-                        "entry_port": rule.entry_port,
-                        "entry_protocol": rule.entry_protocol,
-                        "target_port": rule.target_port,
-                        "target_protocol": rule.target_protocol,
-                    }
-                )
-
-            sticky_sessions = {}
-            if lbaas.sticky_sessions:
-                sticky_sessions = {
-                    "cookie_ttl": lbaas.sticky_sessions_cookie_ttl,
-                    "cookie_name": lbaas.sticky_sessions_cookie_name,
-                }
-
-            virtances = []
-            for l_v in LBaaSVirtance.objects.filter(lbaas=lbaas, virtance__is_deleted=False, is_deleted=False):
-                ipv4_address = IPAddress.objects.get(
-                    virtance=l_v.virtance, network__type=Network.PRIVATE, is_float=False
-                ).address
-                virtances.append(
-                    {
-                        "id": l_v.virtance.id,
-                        "ipv4_address": ipv4_address,
-                    }
-                )
-
-            lbaas_vars = {
-                "health": health,
-                "virtances": virtances,
-                "sticky_sessions": sticky_sessions,
-                "forwarding_rules": forwarding_rules,
-                "redirect_to_https": lbaas.redirect_http_to_https,
-                "ipv4_public_address": ipv4_public.address,
-                "ipv4_private_address": ipv4_private.address,
-                "ipv4_private_gateway": ipv4_private.network.gateway,
-                "ipv4_lbaas_access_list": settings.LBAAS_IPV4_ACCESS_LIST,
-            }
-            error, task = provision_lbaas(ipv4_public.address, private_key, provision_tasks, lbaas_vars=lbaas_vars)
-            if error:
-                error_message = error
-                if task:
-                    error_message = f"Task: {task}. Error: {error}"
-                virtance_error(lbaas.virtance.id, error_message, event="lbaas_provision")
-            else:
-                lbaas.reset_event()
+        virtance_ssh_ready.delay(
+            lbaas.virtance.id, ipv4_public.address, lbaas.private_key, time.time(), link=setup_lbaas.si(lbaas_id)
+        )
 
 
 @app.task
-def reload_lbaas(lbaas_id):
+def setup_lbaas(lbaas_id):
     lbaas = LBaaS.objects.get(id=lbaas_id)
     private_key = decrypt_data(lbaas.private_key)
     ipv4_public = IPAddress.objects.get(virtance=lbaas.virtance, network__type=Network.PUBLIC, is_float=False)
     ipv4_private = IPAddress.objects.get(virtance=lbaas.virtance, network__type=Network.PRIVATE, is_float=False)
 
-    if check_ssh_connect(ipv4_private.address, private_key=private_key):
-        health = {
-            "check_protocol": lbaas.check_protocol,
-            "check_port": lbaas.check_port,
-            "check_path": lbaas.check_path,
-            "check_interval_seconds": lbaas.check_interval_seconds,
-            "check_timeout_seconds": lbaas.check_timeout_seconds,
-            "check_unhealthy_threshold": lbaas.check_unhealthy_threshold,
-            "check_healthy_threshold": lbaas.check_healthy_threshold,
-        }
+    variables = get_lbaas_vars(lbaas, ipv4_public, ipv4_private)
+    error, task = provision_lbaas(ipv4_public.address, private_key, provision_tasks, lbaas_vars=variables)
+    if error:
+        error_message = error
+        if task:
+            error_message = f"Task: {task}. Error: {error}"
+        virtance_error(lbaas.virtance.id, error_message, event="lbaas_provision")
+    else:
+        lbaas.config_hash = config_hash(variables["haproxy_config"])
+        lbaas.reset_event()
 
-        forwarding_rules = []
-        for rule in LBaaSForwadRule.objects.filter(lbaas=lbaas, is_deleted=False):
-            forwarding_rules.append(
-                {
-                    "entry_port": rule.entry_port,
-                    "entry_protocol": rule.entry_protocol,
-                    "target_port": rule.target_port,
-                    "target_protocol": rule.target_protocol,
-                }
-            )
-
-        sticky_sessions = {}
-        if lbaas.sticky_sessions:
-            sticky_sessions = {
-                "cookie_ttl": lbaas.sticky_sessions_cookie_ttl,
-                "cookie_name": lbaas.sticky_sessions_cookie_name,
-            }
 
-        virtances = []
-        for l_v in LBaaSVirtance.objects.filter(lbaas=lbaas, virtance__is_deleted=False, is_deleted=False):
-            ipv4_address = IPAddress.objects.get(
-                virtance=l_v.virtance, network__type=Network.PRIVATE, is_float=False
-            ).address
-            virtances.append(
-                {
-                    "id": l_v.virtance.id,
-                    "ipv4_address": ipv4_address,
-                }
-            )
-
-        lbaas_vars = {
-            "health": health,
-            "virtances": virtances,
-            "sticky_sessions": sticky_sessions,
-            "forwarding_rules": forwarding_rules,
-            "redirect_to_https": lbaas.redirect_http_to_https,
-            "ipv4_public_address": ipv4_public.address,
-            "ipv4_private_address": ipv4_private.address,
-            "ipv4_private_gateway": ipv4_private.network.gateway,
-            "ipv4_lbaas_access_list": settings.LBAAS_IPV4_ACCESS_LIST,
-        }
-        error, task = provision_lbaas(ipv4_private.address, private_key, reload_tasks, lbaas_vars=lbaas_vars)
+@app.task
+def reload_lbaas(lbaas_id, force=False):
+    lbaas = LBaaS.objects.get(id=lbaas_id)
+    ipv4_public = IPAddress.objects.get(virtance=lbaas.virtance, network__type=Network.PUBLIC, is_float=False)
+    ipv4_private = IPAddress.objects.get(virtance=lbaas.virtance, network__type=Network.PRIVATE, is_float=False)
+
+    variables = get_lbaas_vars(lbaas, ipv4_public, ipv4_private)
+    new_hash = config_hash(variables["haproxy_config"])
+    # Nothing changed since the last push, skip SSH and the Ansible play
+    if new_hash == lbaas.config_hash and force is False:
+        lbaas.reset_event()
+        return None
+
+    private_key = decrypt_data(lbaas.private_key)
+    if check_ssh_connect(ipv4_private.address, private_key=private_key):
+        error, task = provision_lbaas(ipv4_private.address, private_key, reload_tasks, lbaas_vars=variables)
         if error:
             error_message = error
             if task:
                 error_message = f"Task: {task}. Error: {error}"
             virtance_error(lbaas.virtance.id, error_message, event="lbaas_reload")
         else:
+            lbaas.config_hash = new_hash
             lbaas.reset_event()
 
 
@@ -0,0 +1,75 @@
+import asyncio
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+
+async def client(host, port, path, headers, deadline, latencies, errors):
+    request = f"GET {path} HTTP/1.1\r\nHost: {host}\r\n{headers}\r\n".encode()
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            if not status.startswith(b"HTTP/1.1 200"):
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run(url, concurrency, duration, headers):
+    parts = urlsplit(url)
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+    await asyncio.gather(
+        *[
+            client(parts.hostname, parts.port or 80, parts.path or "/", headers, deadline, latencies, errors)
+            for _ in range(concurrency)
+        ]
+    )
+    return latencies, errors
+
+
+class Command(BaseCommand):
+    help = "Load test the metadata daemon with keep-alive clients"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8090/metadata/v1.json", help="Metadata URL")
+        parser.add_argument("--concurrency", type=int, default=50, help="Number of concurrent connections")
+        parser.add_argument("--duration", type=int, default=10, help="Test duration in seconds")
+        parser.add_argument("--instance-id", default=None, help="Send X-Instance-ID instead of resolving by address")
+        parser.add_argument("--forwarded-for", default=None, help="Send X-Forwarded-For to resolve by this address")
+
+    def handle(self, *args, **kwargs):
+        headers = ""
+        if kwargs.get("instance_id"):
+            headers += f"X-Instance-ID: {kwargs['instance_id']}\r\n"
+        if kwargs.get("forwarded_for"):
+            headers += f"X-Forwarded-For: {kwargs['forwarded_for']}\r\n"
+        started = time.monotonic()
+        latencies, errors = asyncio.run(run(kwargs["url"], kwargs["concurrency"], kwargs["duration"], headers))
+        elapsed = time.monotonic() - started
+
+        if not latencies:
+            self.stdout.write(self.style.ERROR("No requests completed"))
+            return
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        self.stdout.write(f"Requests: {len(latencies)}, errors: {len(errors)}")
+        self.stdout.write(f"Latency: p50 {p50:.2f}ms, p99 {p99:.2f}ms")
+        self.stdout.write(self.style.SUCCESS(f"Throughput: {len(latencies) / elapsed:.0f} req/s"))
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from metadata.server import MetadataServer
+
+
+class Command(BaseCommand):
+    help = "Metadata daemon"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-vv",
+            "--verbose",
+            dest="verbose",
+            action="store_true",
+            help="Verbose mode",
+            default=False,
+        )
+
+        parser.add_argument(
+            "-H",
+            "--host",
+            dest="host",
+            action="store",
+            help="Listen host",
+            default=settings.METADATA_HOST,
+        )
+
+        parser.add_argument(
+            "-p",
+            "--port",
+            dest="port",
+            action="store",
+            type=int,
+            help="Listen port",
+            default=settings.METADATA_PORT,
+        )
+
+        parser.add_argument(
+            "-r",
+            "--region",
+            dest="region",
+            action="store",
+            help="Region slug to keep in memory (all regions by default)",
+            default=None,
+        )
+
+        parser.add_argument(
+            "-i",
+            "--refresh",
+            dest="refresh",
+            action="store",
+            type=int,
+            help="Seconds between reloads of the in-memory copy",
+            default=settings.METADATA_REFRESH_INTERVAL,
+        )
+
+        parser.add_argument(
+            "-P",
+            "--poll",
+            dest="poll",
+            action="store",
+            type=int,
+            help="Seconds between reloads of changed rows",
+            default=settings.METADATA_POLL_INTERVAL,
+        )
+
+    def handle(self, *args, **options):
+        if options["verbose"]:
+            logging.basicConfig(level=logging.INFO)
+        print(f"Starting metadata daemon on {options['host']}:{options['port']}...\n")
+        server = MetadataServer(
+            host=options["host"],
+            port=int(options["port"]),
+            region=options["region"],
+            refresh=int(options["refresh"]),
+            poll=int(options["poll"]),
+            verbose=options["verbose"],
+        )
+        try:
+            asyncio.run(server.serve())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import time
+from collections import defaultdict
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from keypair.models import KeyPairVirtance
+from network.models import IPAddress, Network
+from virtance.models import Virtance
+
+from .v1.utils import address_index, build_metadata_bulk, get_metadata
+
+TEXT_PLAIN = "text/plain; charset=utf-8"
+APPLICATION_JSON = "application/json"
+LOAD_CHUNK_SIZE = 1000
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+def listing(*items):
+    return lambda metadata: "\n".join(items)
+
+
+def value(*path):
+    def getter(metadata):
+        for key in path:
+            metadata = metadata[key]
+        return metadata
+
+    return getter
+
+
+def ipv4_value(interface, key, field):
+    return value("interfaces", interface, 0, key, field)
+
+
+def nameservers(metadata):
+    return "\n".join(metadata["dns"]["nameservers"]) or None
+
+
+# Same tree as metadata.v1.urls, every leaf is a slice of the metadata document
+METADATA_V1_TREE = {
+    "": listing("id", "hostname", "user-data", "vendor-data", "public-keys", "region", "interfaces/", "dns/"),
+    "id": lambda metadata: str(metadata["id"]),
+    "hostname": value("hostname"),
+    "user-data": value("user-data"),
+    "vendor-data": value("vendor-data"),
+    "public-keys": lambda metadata: "\n".join(metadata["public-keys"]),
+    "interfaces/": listing("public/", "private/"),
+    "interfaces/public/": listing("0/"),
+    "interfaces/public/0/": listing("mac", "type", "compute_ipv4/", "ipv4/"),
+    "interfaces/public/0/mac": value("interfaces", "public", 0, "mac"),
+    "interfaces/public/0/type": value("interfaces", "public", 0, "type"),
+    "interfaces/public/0/ipv4/": listing("address", "netmask", "gateway"),
+    "interfaces/public/0/ipv4/address": ipv4_value("public", "ipv4", "ip_address"),
+    "interfaces/public/0/ipv4/netmask": ipv4_value("public", "ipv4", "netmask"),
+    "interfaces/public/0/ipv4/gateway": ipv4_value("public", "ipv4", "gateway"),
+    "interfaces/public/0/compute_ipv4/": listing("address", "netmask", "gateway"),
+    "interfaces/public/0/compute_ipv4/address": ipv4_value("public", "compute_ipv4", "ip_address"),
+    "interfaces/public/0/compute_ipv4/netmask": ipv4_value("public", "compute_ipv4", "netmask"),
+    "interfaces/public/0/compute_ipv4/gateway": ipv4_value("public", "compute_ipv4", "gateway"),
+    "interfaces/private/": listing("0/"),
+    "interfaces/private/0/": listing("mac", "type", "ipv4/"),
+    "interfaces/private/0/mac": value("interfaces", "private", 0, "mac"),
+    "interfaces/private/0/type": value("interfaces", "private", 0, "type"),
+    "interfaces/private/0/ipv4/": listing("address", "netmask", "gateway"),
+    "interfaces/private/0/ipv4/address": ipv4_value("private", "ipv4", "ip_address"),
+    "interfaces/private/0/ipv4/netmask": ipv4_value("private", "ipv4", "netmask"),
+    "interfaces/private/0/ipv4/gateway": ipv4_value("private", "ipv4", "gateway"),
+    "dns/": listing("nameservers"),
+    "dns/nameservers": nameservers,
+}
+
+
+def render_metadata(metadata, path):
+    if path == "/metadata/v1.json":
+        return 200, APPLICATION_JSON, json.dumps(metadata)
+    if not path.startswith("/metadata/v1/"):
+        return 404, TEXT_PLAIN, "Not Found"
+
+    getter = METADATA_V1_TREE.get(path[len("/metadata/v1/") :])
+    try:
+        body = getter(metadata) if getter else None
+    except (KeyError, IndexError):
+        body = None
+    if body is None:
+        return 404, TEXT_PLAIN, "Not Found"
+    return 200, TEXT_PLAIN, body
+
+
+def resolve_addresses(addresses):
+    """
+    Owners of `addresses` with the rules of AddressIndex.lookup: compute network and
+    ambiguous addresses resolve to 0.
+    """
+    owners = defaultdict(set)
+    ipaddrs = IPAddress.objects.filter(address__in=addresses, virtance__is_deleted=False).exclude(
+        network__type=Network.COMPUTE
+    )
+    for address, virtance_id in ipaddrs.order_by().values_list("address", "virtance_id"):
+        owners[address].add(virtance_id)
+    return {address: next(iter(owners[address])) if len(owners[address]) == 1 else 0 for address in addresses}
+
+
+def load_region(region=None):
+    """
+    Build metadata documents and the address map of every virtance in a region (or all regions).
+    """
+    documents = {}
+    addresses = {}
+    try:
+        virtances = Virtance.objects.filter(is_deleted=False).select_related("region").order_by("id")
+        if region:
+            virtances = virtances.filter(region__slug=region)
+        virtances = list(virtances)
+
+        for i in range(0, len(virtances), LOAD_CHUNK_SIZE):
+            chunk = virtances[i : i + LOAD_CHUNK_SIZE]
+            documents.update(build_metadata_bulk(chunk))
+            ipaddrs = IPAddress.objects.filter(virtance_id__in=[virtance.id for virtance in chunk])
+            addresses.update(resolve_addresses(set(ipaddrs.values_list("address", flat=True))))
+    finally:
+        close_old_connections()
+    return documents, addresses
+
+
+def load_changes(since, region=None):
+    """
+    Documents and addresses changed since `since`. Documents of virtances deleted or moved
+    to another region are returned as None, removed rows are only dropped by a full reload.
+    """
+    try:
+        changed = list(IPAddress.objects.filter(updated__gte=since).values_list("virtance_id", "address"))
+        virtance_ids = {virtance_id for virtance_id, _ in changed if virtance_id}
+        virtance_ids.update(Virtance.objects.filter(updated__gte=since).values_list("id", flat=True))
+        virtance_ids.update(KeyPairVirtance.objects.filter(created__gte=since).values_list("virtance_id", flat=True))
+
+        virtances = Virtance.objects.filter(id__in=virtance_ids, is_deleted=False).select_related("region")
+        if region:
+            virtances = virtances.filter(region__slug=region)
+        documents = dict.fromkeys(virtance_ids)
+        documents.update(build_metadata_bulk(list(virtances)))
+        addresses = resolve_addresses({address for _, address in changed})
+    finally:
+        close_old_connections()
+    return documents, addresses
+
+
+def lookup_address(address):
+    try:
+        return address_index.get(address)
+    finally:
+        close_old_connections()
+
+
+def lookup_metadata(virtance_id):
+    try:
+        return get_metadata(virtance_id)
+    finally:
+        close_old_connections()
+
+
+class MetadataServer(object):
+    """
+    Asyncio HTTP/1.1 server for the metadata tree. Documents and the address map of the
+    region are kept in memory: rows changed since the last pass are reloaded every `poll`
+    seconds and the whole copy every `refresh` seconds, which also drops removed rows.
+    Callers and virtances unknown to the hot copy go through the address index and the
+    shared cache.
+    """
+
+    def __init__(self, host, port, region=None, refresh=30, poll=2, verbose=False):
+        self.host = host
+        self.port = port
+        self.region = region
+        self.refresh = refresh
+        self.poll = poll
+        self.verbose = verbose
+        self.documents = {}
+        self.addresses = {}
+        self.since = None
+        self.requests = 0
+
+    async def reload(self):
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        since = timezone.now()
+        self.documents, self.addresses = await loop.run_in_executor(None, load_region, self.region)
+        self.since = since
+        if self.verbose:
+            logging.info(
+                f"Loaded {len(self.documents)} virtances and {len(self.addresses)} addresses "
+                f"in {time.monotonic() - started:.2f}s, served {self.requests} requests"
+            )
+
+    async def apply_changes(self):
+        loop = asyncio.get_running_loop()
+        since = timezone.now()
+        documents, addresses = await loop.run_in_executor(None, load_changes, self.since, self.region)
+        self.since = since
+        for virtance_id, metadata in documents.items():
+            if metadata is None:
+                self.documents.pop(virtance_id, None)
+            else:
+                self.documents[virtance_id] = metadata
+        self.addresses.update(addresses)
+
+    async def reload_forever(self):
+        reloaded = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll)
+            try:
+                if time.monotonic() - reloaded >= self.refresh:
+                    await self.reload()
+                    reloaded = time.monotonic()
+                else:
+                    await self.apply_changes()
+            except Exception as err:
+                logging.error(f"Failed to reload metadata: {err}")
+
+    async def resolve(self, headers, peer):
+        loop = asyncio.get_running_loop()
+        x_instance_id = headers.get("x-instance-id")
+        x_forwarded_for = headers.get("x-forwarded-for")
+
+        if x_instance_id:
+            if not x_instance_id.isdigit():
+                return None
+            virtance_id = int(x_instance_id)
+        else:
+            address = x_forwarded_for.split(",")[0].strip() if x_forwarded_for else peer
+            virtance_id = self.addresses.get(address)
+            if virtance_id is None:
+                virtance_id = await loop.run_in_executor(None, lookup_address, address)
+            if not virtance_id:
+                return None
+
+        metadata = self.documents.get(virtance_id)
+        if metadata is None:
+            metadata = await loop.run_in_executor(None, lookup_metadata, virtance_id)
+        return metadata
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info("peername")[0]
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, val = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = val.strip()
+
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, TEXT_PLAIN, "Bad Request", keep_alive=False)
+                    break
+                if headers.get("content-length", "0").isdigit() and int(headers.get("content-length", "0")):
+                    await reader.readexactly(int(headers["content-length"]))
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                path = path.split("?", 1)[0]
+                self.requests += 1
+
+                if method not in ("GET", "HEAD"):
+                    status, content_type, body = 405, TEXT_PLAIN, "Method Not Allowed"
+                else:
+                    metadata = await self.resolve(headers, peer)
+                    if metadata is None:
+                        status, content_type, body = 404, TEXT_PLAIN, "Not Found"
+                    else:
+                        status, content_type, body = render_metadata(metadata, path)
+
+                await self.respond(writer, status, content_type, body, keep_alive, head=method == "HEAD")
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, content_type, body, keep_alive=True, head=False):
+        body = body.encode()
+        headers = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(headers.encode() if head else headers.encode() + body)
+        await writer.drain()
+
+    async def serve(self):
+        await self.reload()
+        server = await asyncio.start_server(self.handle, self.host, self.port, reuse_address=True)
+        asyncio.create_task(self.reload_forever())
+        async with server:
+            await server.serve_forever()
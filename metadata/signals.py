@@ -0,0 +1,52 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from keypair.models import KeyPair, KeyPairVirtance
+from network.models import IPAddress
+from virtance.models import Virtance
+
+from .v1.utils import address_index, invalidate_metadata
+
+
+@receiver(pre_save, sender=IPAddress)
+def ipaddress_pre_save(sender, instance, **kwargs):
+    # Remember previous owner and address, floating IPs move between virtances
+    instance._metadata_virtance_id = None
+    instance._metadata_address = None
+    if instance.pk:
+        previous = IPAddress.objects.filter(pk=instance.pk).values_list("virtance_id", "address").first()
+        if previous:
+            instance._metadata_virtance_id, instance._metadata_address = previous
+
+
+@receiver(post_save, sender=IPAddress)
+def ipaddress_post_save(sender, instance, **kwargs):
+    # Resolve the address again rather than pointing it at this row, another virtance may hold it too
+    address_index.warm(instance.address)
+    previous_address = getattr(instance, "_metadata_address", None)
+    if previous_address and previous_address != instance.address:
+        address_index.warm(previous_address)
+    invalidate_metadata(instance.virtance_id, getattr(instance, "_metadata_virtance_id", None))
+
+
+@receiver(post_delete, sender=IPAddress)
+def ipaddress_post_delete(sender, instance, **kwargs):
+    address_index.warm(instance.address)
+    invalidate_metadata(instance.virtance_id)
+
+
+@receiver(post_save, sender=KeyPairVirtance)
+@receiver(post_delete, sender=KeyPairVirtance)
+def keypair_virtance_changed(sender, instance, **kwargs):
+    invalidate_metadata(instance.virtance_id)
+
+
+@receiver(post_save, sender=KeyPair)
+@receiver(post_delete, sender=KeyPair)
+def keypair_changed(sender, instance, **kwargs):
+    invalidate_metadata(*KeyPairVirtance.objects.filter(keypair=instance).values_list("virtance_id", flat=True))
+
+
+@receiver(post_save, sender=Virtance)
+def virtance_changed(sender, instance, **kwargs):
+    invalidate_metadata(instance.id)
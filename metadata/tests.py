@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from account.models import User
+from image.models import Image
+from network.models import IPAddress, Network
+from region.models import Region
+from size.models import Size
+from virtance.models import Virtance
+
+from .v1.utils import METADATA_ADDRESS_KEY, address_index
+
+
+class AddressIndexTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        address_index.entries.clear()
+        self.user = User.objects.create_user("metadata@example.com", "password")
+        self.region = Region.objects.create(name="Region", slug="region")
+        self.size = Size.objects.create(name="Size", slug="size", vcpu=1, disk=1, memory=1, transfer=1)
+        self.template = Image.objects.create(name="Template", type=Image.DISTRIBUTION, md5sum="", file_name="image")
+        self.public = self.create_network(Network.PUBLIC, "10.0.0.0")
+        self.compute = self.create_network(Network.COMPUTE, "172.16.0.0")
+
+    def create_network(self, type, cidr):
+        return Network.objects.create(cidr=cidr, netmask="255.255.255.0", gateway=cidr, type=type, region=self.region)
+
+    def create_virtance(self, name, public_address, compute_address):
+        virtance = Virtance.objects.create(
+            user=self.user, size=self.size, region=self.region, template=self.template, name=name, disk=1
+        )
+        IPAddress.objects.create(network=self.public, virtance=virtance, address=public_address)
+        IPAddress.objects.create(network=self.compute, virtance=virtance, address=compute_address)
+        return virtance
+
+    def get_metadata(self, address):
+        return self.client.get("/metadata/v1.json", REMOTE_ADDR=address)
+
+    def test_shared_compute_address(self):
+        first = self.create_virtance("first", "10.0.0.10", "172.16.0.10")
+        second = self.create_virtance("second", "10.0.0.11", "172.16.0.10")
+
+        self.assertIsNone(address_index.get("172.16.0.10"))
+        self.assertEqual(self.get_metadata("172.16.0.10").status_code, 404)
+        self.assertEqual(self.get_metadata("10.0.0.10").json()["id"], first.id)
+        self.assertEqual(self.get_metadata("10.0.0.11").json()["id"], second.id)
+
+    def test_ambiguous_address(self):
+        self.create_virtance("first", "10.0.0.10", "172.16.0.10")
+        self.create_virtance("second", "10.0.0.10", "172.16.0.11")
+
+        self.assertIsNone(address_index.get("10.0.0.10"))
+        self.assertEqual(self.get_metadata("10.0.0.10").status_code, 404)
+
+    def test_reassigned_address(self):
+        first = self.create_virtance("first", "10.0.0.10", "172.16.0.10")
+        second = self.create_virtance("second", "10.0.0.11", "172.16.0.11")
+        self.assertEqual(address_index.get("10.0.0.10"), first.id)
+
+        ipaddr = IPAddress.objects.get(address="10.0.0.10")
+        ipaddr.virtance = second
+        ipaddr.save()
+
+        self.assertEqual(address_index.get("10.0.0.10"), second.id)
+
+    def test_signals_warm_address(self):
+        first = self.create_virtance("first", "10.0.0.10", "172.16.0.10")
+
+        self.assertEqual(cache.get(METADATA_ADDRESS_KEY.format("10.0.0.10")), first.id)
+        self.assertEqual(cache.get(METADATA_ADDRESS_KEY.format("172.16.0.10")), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(address_index.get("10.0.0.10"), first.id)
+
+    @mock.patch("metadata.v1.utils.METADATA_ADDRESS_MISS_TIMEOUT", 0)
+    def test_miss_expires(self):
+        first = self.create_virtance("first", "10.0.0.10", "172.16.0.10")
+        ipaddr = IPAddress.objects.create(network=self.public, address="10.0.0.12")
+        self.assertIsNone(address_index.get("10.0.0.12"))
+
+        # Bulk assignment does not send signals
+        IPAddress.objects.filter(pk=ipaddr.pk).update(virtance=first)
+        address_index.entries.clear()
+        self.assertEqual(address_index.get("10.0.0.12"), first.id)
@@ -1,22 +1,210 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
 from django.views.generic import View
 
-from network.models import IPAddress
+from keypair.models import KeyPairVirtance
+from lbaas.models import LBaaS
+from network.models import IPAddress, Network
 from virtance.models import Virtance
+from virtance.utils import decrypt_data, make_ssh_public
+
+METADATA_CACHE_KEY = "metadata_v1_{}"
+METADATA_CACHE_TIMEOUT = int(settings.METADATA_CACHE_TIMEOUT)
+METADATA_ADDRESS_KEY = "metadata_address_{}"
+METADATA_ADDRESS_MISS_TIMEOUT = int(settings.METADATA_ADDRESS_MISS_TIMEOUT)
+
+
+def metadata_ipv4(ipaddr):
+    if ipaddr is None:
+        return {"ip_address": None, "netmask": None, "gateway": None}
+    return {"ip_address": ipaddr.address, "netmask": ipaddr.network.netmask, "gateway": ipaddr.network.gateway}
+
+
+def metadata_document(virtance, ipaddrs, public_keys):
+    public = ipaddrs.get(Network.PUBLIC)
+    nameservers = [public.network.dns1, public.network.dns2] if public else []
+
+    return {
+        "id": virtance.id,
+        "hostname": virtance.name,
+        "user-data": virtance.user_data or "",
+        "vendor-data": "",
+        "public-keys": public_keys,
+        "region": virtance.region.slug,
+        "interfaces": {
+            "public": [
+                {
+                    "compute_ipv4": metadata_ipv4(ipaddrs.get(Network.COMPUTE)),
+                    "ipv4": metadata_ipv4(public),
+                    "mac": "00:00:00:00:00:00",
+                    "type": "public",
+                }
+            ],
+            "private": [
+                {
+                    "ipv4": metadata_ipv4(ipaddrs.get(Network.PRIVATE)),
+                    "mac": "00:00:00:00:00:00",
+                    "type": "private",
+                }
+            ],
+        },
+        "dns": {
+            "nameservers": nameservers,
+        },
+    }
+
+
+def build_metadata_bulk(virtances):
+    ipaddrs = defaultdict(dict)
+    public_keys = defaultdict(list)
+    virtance_ids = [virtance.id for virtance in virtances]
+
+    # Newest address of every network type, addresses are ordered by -id
+    for ipaddr in IPAddress.objects.filter(virtance_id__in=virtance_ids).select_related("network"):
+        ipaddrs[ipaddr.virtance_id].setdefault(ipaddr.network.type, ipaddr)
+
+    for kpv in KeyPairVirtance.objects.filter(virtance_id__in=virtance_ids).select_related("keypair"):
+        public_keys[kpv.virtance_id].append(kpv.keypair.public_key)
+
+    lbaas_ids = [virtance.id for virtance in virtances if virtance.type == Virtance.LBAAS]
+    for lbaas in LBaaS.objects.filter(virtance_id__in=lbaas_ids):
+        private_key = decrypt_data(lbaas.private_key)
+        public_keys[lbaas.virtance_id].append(make_ssh_public(private_key))
+
+    return {
+        virtance.id: metadata_document(virtance, ipaddrs[virtance.id], public_keys[virtance.id])
+        for virtance in virtances
+    }
+
+
+def build_metadata(virtance):
+    return build_metadata_bulk([virtance])[virtance.id]
+
+
+def get_metadata(virtance_id):
+    key = METADATA_CACHE_KEY.format(virtance_id)
+    metadata = cache.get(key)
+    if metadata is None:
+        try:
+            virtance = Virtance.objects.select_related("region").get(pk=virtance_id, is_deleted=False)
+        except Virtance.DoesNotExist:
+            return None
+        metadata = build_metadata(virtance)
+        cache.set(key, metadata, METADATA_CACHE_TIMEOUT)
+    return metadata
+
+
+def invalidate_metadata(*virtance_ids):
+    cache.delete_many([METADATA_CACHE_KEY.format(virtance_id) for virtance_id in virtance_ids if virtance_id])
+
+
+class AddressIndex(object):
+    """
+    Source address to virtance ID resolution: a per-process LRU with TTL in front
+    of the shared cache, which is kept warm by IPAddress signals. Unknown addresses
+    are remembered as 0 for a short while so scanners don't reach the database either.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "cache_hits": 0, "db_lookups": 0}
+
+    def get(self, address):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(address)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(address)
+                self.counters["hits"] += 1
+                return entry[0] or None
+            self.counters["misses"] += 1
+
+        virtance_id = self.resolve(address)
+        self.remember(address, virtance_id)
+        return virtance_id or None
+
+    def resolve(self, address):
+        """
+        Resolve an address through the shared cache, then the database.
+        """
+        virtance_id = cache.get(METADATA_ADDRESS_KEY.format(address))
+        if virtance_id is None:
+            self.counters["db_lookups"] += 1
+            virtance_id = self.lookup(address)
+            self.store(address, virtance_id)
+        else:
+            self.counters["cache_hits"] += 1
+        return virtance_id
+
+    def lookup(self, address):
+        """
+        Compute network addresses repeat across hypervisors and are never resolved, an address
+        owned by more than one virtance is ambiguous and resolves to nothing as well.
+        """
+        owners = list(
+            IPAddress.objects.filter(address=address, virtance__is_deleted=False)
+            .exclude(network__type=Network.COMPUTE)
+            .order_by()
+            .values_list("virtance_id", flat=True)
+            .distinct()[:2]
+        )
+        return owners[0] if len(owners) == 1 else 0
+
+    def store(self, address, virtance_id):
+        # Misses expire quickly, addresses assigned without signals (bulk updates) show up soon
+        timeout = METADATA_CACHE_TIMEOUT if virtance_id else METADATA_ADDRESS_MISS_TIMEOUT
+        cache.set(METADATA_ADDRESS_KEY.format(address), virtance_id, timeout)
+
+    def warm(self, address):
+        virtance_id = self.lookup(address)
+        self.store(address, virtance_id)
+        self.remember(address, virtance_id)
+
+    def remember(self, address, virtance_id):
+        with self.lock:
+            self.entries[address] = (virtance_id, time.monotonic() + self.ttl)
+            self.entries.move_to_end(address)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            size = len(self.entries)
+        lookups = counters["hits"] + counters["misses"]
+        return {
+            "pid": os.getpid(),
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0,
+            **counters,
+        }
+
+
+address_index = AddressIndex(int(settings.METADATA_ADDRESS_CACHE_SIZE), int(settings.METADATA_ADDRESS_CACHE_TTL))
 
 
 class MetadataMixin(View):
-    virtance = None
+    metadata = None
 
     def dispatch(self, request, *args, **kwargs):
+        virtance_id = None
         x_instance_id = request.META.get("HTTP_X_INSTANCE_ID")
         x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
 
         # Get by header ID
         if x_instance_id:
-            try:
-                self.virtance = Virtance.objects.get(pk=x_instance_id, is_deleted=False)
-            except Virtance.DoesNotExist:
-                pass
+            if x_instance_id.isdigit():
+                virtance_id = int(x_instance_id)
 
         # Get by IP address
         if not x_instance_id:
@@ -24,12 +212,17 @@ class MetadataMixin(View):
                 remote_address = x_forwarded_for.split(",")[0]
             else:
                 remote_address = request.META.get("REMOTE_ADDR")
+            virtance_id = address_index.get(remote_address)
 
-            try:
-                ip = IPAddress.objects.get(address=remote_address, virtance__is_deleted=False)
-                if ip.virtance:
-                    self.virtance = ip.virtance
-            except IPAddress.DoesNotExist:
-                pass
+        if virtance_id is not None:
+            self.metadata = get_metadata(virtance_id)
 
         return super(MetadataMixin, self).dispatch(request, *args, **kwargs)
+
+    def get_interface_ipv4(self, interface, key="ipv4"):
+        if self.metadata is None:
+            return None
+        ipv4 = self.metadata["interfaces"][interface][0][key]
+        if ipv4.get("ip_address") is None:
+            return None
+        return ipv4
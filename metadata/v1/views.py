@@ -1,10 +1,5 @@
 from django.http import HttpResponse, JsonResponse
 
-from keypair.models import KeyPairVirtance
-from lbaas.models import LBaaS
-from network.models import IPAddress, Network
-from virtance.utils import decrypt_data, make_ssh_public
-
 from .utils import MetadataMixin
 
 
@@ -13,79 +8,14 @@ class MetadataV1Json(MetadataMixin):
         """
         Retrieve an Metadata JSON for a Virtance
         """
-        user_data = ""
-        vendor_data = ""
-        nameservers = []
-        public_keys = []
-
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
-
-        if self.virtance.user_data:
-            user_data = self.virtance.user_data
-
-        for i in KeyPairVirtance.objects.filter(virtance=self.virtance):
-            public_keys.append(i.keypair.public_key)
-
-        if self.virtance.type == self.virtance.LBAAS:
-            lbaas = LBaaS.objects.get(virtance_id=self.virtance.id)
-            private_key = decrypt_data(lbaas.private_key)
-            public_keys.append(make_ssh_public(private_key))
-
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance)
-        interfaces = {
-            "public": [
-                {
-                    "compute_ipv4": {
-                        "ip_address": ipaddr.filter(network__type=Network.COMPUTE).first().address,
-                        "netmask": ipaddr.filter(network__type=Network.COMPUTE).first().network.netmask,
-                        "gateway": ipaddr.filter(network__type=Network.COMPUTE).first().network.gateway,
-                    },
-                    "ipv4": {
-                        "ip_address": ipaddr.filter(network__type=Network.PUBLIC).first().address,
-                        "netmask": ipaddr.filter(network__type=Network.PUBLIC).first().network.netmask,
-                        "gateway": ipaddr.filter(network__type=Network.PUBLIC).first().network.gateway,
-                    },
-                    "mac": "00:00:00:00:00:00",
-                    "type": "public",
-                }
-            ],
-            "private": [
-                {
-                    "ipv4": {
-                        "ip_address": ipaddr.filter(network__type=Network.PRIVATE).first().address,
-                        "netmask": ipaddr.filter(network__type=Network.PRIVATE).first().network.netmask,
-                        "gateway": ipaddr.filter(network__type=Network.PRIVATE).first().network.gateway,
-                    },
-                    "mac": "00:00:00:00:00:00",
-                    "type": "private",
-                }
-            ],
-        }
-
-        nameservers = [
-            ipaddr.filter(network__type=Network.PUBLIC).first().network.dns1,
-            ipaddr.filter(network__type=Network.PUBLIC).first().network.dns2,
-        ]
-
-        response = {
-            "id": self.virtance.id,
-            "hostname": self.virtance.name,
-            "user-data": user_data,
-            "vendor-data": vendor_data,
-            "public-keys": public_keys,
-            "region": self.virtance.region.slug,
-            "interfaces": interfaces,
-            "dns": {
-                "nameservers": nameservers,
-            },
-        }
-        return JsonResponse(response)
+        return JsonResponse(self.metadata)
 
 
 class MetadataIndex(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["id", "hostname", "user-data", "vendor-data", "public-keys", "region", "interfaces/", "dns/"]
         response = "\n".join(data)
@@ -94,49 +24,42 @@ class MetadataIndex(MetadataMixin):
 
 class MetadataID(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(self.virtance.id)
+        return HttpResponse(self.metadata["id"])
 
 
 class MetadataHostname(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(self.virtance.name)
+        return HttpResponse(self.metadata["hostname"])
 
 
 class MetadataUserData(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
-        user_data = self.virtance.user_data if self.virtance.user_data else ""
-        return HttpResponse(user_data)
+        return HttpResponse(self.metadata["user-data"])
 
 
 class MetadataVendorData(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
-        vendor_data = ""
-        return HttpResponse(vendor_data)
+        return HttpResponse(self.metadata["vendor-data"])
 
 
 class MetadataPublicKeys(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        public_Keys = ""
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
-        for i in KeyPairVirtance.objects.filter(virtance=self.virtance):
-            if public_Keys:
-                public_Keys += "\n"
-            public_Keys += i.keypair.public_key
-        return HttpResponse(public_Keys)
+        return HttpResponse("\n".join(self.metadata["public-keys"]))
 
 
 class MetadataInterfaces(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["public/", "private/"]
         response = "\n".join(data)
@@ -145,7 +68,7 @@ class MetadataInterfaces(MetadataMixin):
 
 class MetadataInterfacesPublic(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["0/"]
         response = "\n".join(data)
@@ -154,7 +77,7 @@ class MetadataInterfacesPublic(MetadataMixin):
 
 class MetadataInterfacesPublicData(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["mac", "type", "compute_ipv4/", "ipv4/"]
         response = "\n".join(data)
@@ -163,7 +86,7 @@ class MetadataInterfacesPublicData(MetadataMixin):
 
 class MetadataInterfacesPublicMAC(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         mac = "00:00:00:00:00:00"
         return HttpResponse(mac)
@@ -171,14 +94,14 @@ class MetadataInterfacesPublicMAC(MetadataMixin):
 
 class MetadataInterfacesPublicType(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         return HttpResponse("public")
 
 
 class MetadataInterfacesPublicIPv4(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["address", "netmask", "gateway"]
         response = "\n".join(data)
@@ -187,31 +110,31 @@ class MetadataInterfacesPublicIPv4(MetadataMixin):
 
 class MetadataInterfacesPublicIPv4Address(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.PUBLIC).first()
-        if self.virtance is None or ipaddr is None:
+        ipv4 = self.get_interface_ipv4("public", "ipv4")
+        if ipv4 is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(ipaddr.address)
+        return HttpResponse(ipv4["ip_address"])
 
 
 class MetadataInterfacesPublicIPv4Netmask(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.PUBLIC).first()
-        if self.virtance is None or ipaddr is None:
+        ipv4 = self.get_interface_ipv4("public", "ipv4")
+        if ipv4 is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(ipaddr.network.netmask)
+        return HttpResponse(ipv4["netmask"])
 
 
 class MetadataInterfacesPublicIPv4Gateway(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.PUBLIC).first()
-        if self.virtance is None or ipaddr is None:
+        ipv4 = self.get_interface_ipv4("public", "ipv4")
+        if ipv4 is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(ipaddr.network.gateway)
+        return HttpResponse(ipv4["gateway"])
 
 
 class MetadataInterfacesPublicComputeIPv4(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["address", "netmask", "gateway"]
         response = "\n".join(data)
@@ -220,31 +143,31 @@ class MetadataInterfacesPublicComputeIPv4(MetadataMixin):
 
 class MetadataInterfacesPublicComputeIPv4Address(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.COMPUTE).first()
-        if self.virtance is None or ipaddr is None:
+        ipv4 = self.get_interface_ipv4("public", "compute_ipv4")
+        if ipv4 is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(ipaddr.address)
+        return HttpResponse(ipv4["ip_address"])
 
 
 class MetadataInterfacesPublicComputeIPv4Netmask(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.COMPUTE).first()
-        if self.virtance is None or ipaddr is None:
+        ipv4 = self.get_interface_ipv4("public", "compute_ipv4")
+        if ipv4 is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(ipaddr.network.netmask)
+        return HttpResponse(ipv4["netmask"])
 
 
 class MetadataInterfacesPublicComputeIPv4Gateway(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.COMPUTE).first()
-        if self.virtance is None or ipaddr is None:
+        ipv4 = self.get_interface_ipv4("public", "compute_ipv4")
+        if ipv4 is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(ipaddr.network.gateway)
+        return HttpResponse(ipv4["gateway"])
 
 
 class MetadataInterfacesPrivate(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["0/"]
         response = "\n".join(data)
@@ -253,7 +176,7 @@ class MetadataInterfacesPrivate(MetadataMixin):
 
 class MetadataInterfacesPrivateData(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["mac", "type", "ipv4/"]
         response = "\n".join(data)
@@ -262,7 +185,7 @@ class MetadataInterfacesPrivateData(MetadataMixin):
 
 class MetadataInterfacesPrivateMAC(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         mac = "00:00:00:00:00:00"
         return HttpResponse(mac)
@@ -270,14 +193,14 @@ class MetadataInterfacesPrivateMAC(MetadataMixin):
 
 class MetadataInterfacesPrivateType(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         return HttpResponse("private")
 
 
 class MetadataInterfacesPrivateIPv4(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["address", "netmask", "gateway"]
         response = "\n".join(data)
@@ -286,31 +209,31 @@ class MetadataInterfacesPrivateIPv4(MetadataMixin):
 
 class MetadataInterfacesPrivateIPv4Address(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.PRIVATE).first()
-        if self.virtance is None or ipaddr is None:
+        ipv4 = self.get_interface_ipv4("private", "ipv4")
+        if ipv4 is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(ipaddr.address)
+        return HttpResponse(ipv4["ip_address"])
 
 
 class MetadataInterfacesPrivateIPv4Netmask(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.PRIVATE).first()
-        if self.virtance is None or ipaddr is None:
+        ipv4 = self.get_interface_ipv4("private", "ipv4")
+        if ipv4 is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(ipaddr.network.netmask)
+        return HttpResponse(ipv4["netmask"])
 
 
 class MetadataInterfacesPrivateIPv4Gateway(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.PRIVATE).first()
-        if self.virtance is None or ipaddr is None:
+        ipv4 = self.get_interface_ipv4("private", "ipv4")
+        if ipv4 is None:
             return HttpResponse("Not Found", status=404)
-        return HttpResponse(ipaddr.network.gateway)
+        return HttpResponse(ipv4["gateway"])
 
 
 class MetadataDNS(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        if self.virtance is None:
+        if self.metadata is None:
             return HttpResponse("Not Found", status=404)
         data = ["nameservers"]
         response = "\n".join(data)
@@ -319,8 +242,7 @@ class MetadataDNS(MetadataMixin):
 
 class MetadataDNSNameservers(MetadataMixin):
     def get(self, request, *args, **kwargs):
-        ipaddr = IPAddress.objects.filter(virtance=self.virtance, network__type=Network.PUBLIC).first()
-        if self.virtance is None or ipaddr is None:
+        if self.metadata is None or not self.metadata["dns"]["nameservers"]:
             return HttpResponse("Not Found", status=404)
-        response = "\n".join([ipaddr.network.dns1, ipaddr.network.dns2])
+        response = "\n".join(self.metadata["dns"]["nameservers"])
         return HttpResponse(response)
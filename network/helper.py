@@ -1,73 +1,145 @@
+import math
 import random
+import re
 from ipaddress import IPv4Network, IPv6Network, ip_address
+from itertools import islice
+
+from django.db import transaction
 
 from virtance.models import Virtance
 
 from .models import IPAddress, Network
 
 # First is a gateway and 2 lasts are reserved for broadcast and system needs
-SUBNET_V4_RANGE = slice(2, -2)
+SUBNET_V4_RESERVED_HEAD = 2
+SUBNET_V4_RESERVED_TAIL = 2
 
+# IPv6 addresses are handed out on a 16 address step
+SUBNET_V6_STEP = 16
+# Number of IPv6 slots checked against database in one query
+SUBNET_V6_PROBE_BATCH = 32
 
-def assign_free_ipv4_compute(virtance_id):
+# Any byte of the bitmap with at least one free address
+FREE_BYTE = re.compile(rb"[^\xff]")
+
+
+def ipv4_bitmap(subnet, addresses):
+    size = subnet.num_addresses
+    base = int(subnet.network_address)
+    bitmap = bytearray(-(-size // 8))
+    reserved = list(range(min(SUBNET_V4_RESERVED_HEAD, size)))
+    reserved += list(range(max(size - SUBNET_V4_RESERVED_TAIL, 0), len(bitmap) * 8))
+    for offset in reserved:
+        bitmap[offset >> 3] |= 1 << (offset & 7)
+    for address in addresses:
+        offset = int(ip_address(address)) - base
+        if 0 <= offset < size:
+            bitmap[offset >> 3] |= 1 << (offset & 7)
+    return bitmap
+
+
+def find_free_offset(bitmap, start=0):
+    start_byte = (start >> 3) % len(bitmap) if bitmap else 0
+    match = FREE_BYTE.search(bitmap, start_byte) or FREE_BYTE.search(bitmap, 0, start_byte)
+    if match is None:
+        return None
+    byte = match.start()
+    value = bitmap[byte]
+    return (byte << 3) + ((~value & (value + 1)).bit_length() - 1)
+
+
+def used_ipv4_addresses(network, virtance):
+    ipaddrs = IPAddress.objects.filter(network=network)
+    if network.type == Network.COMPUTE:
+        # Compute network addresses are unique only within one compute
+        ipaddrs = ipaddrs.filter(virtance__compute=virtance.compute, virtance__is_deleted=False)
+    return ipaddrs.values_list("address", flat=True)
+
+
+def allocate_ipv4(network, virtance, is_float=False):
+    subnet = IPv4Network(f"{network.cidr}/{network.netmask}")
+    bitmap = ipv4_bitmap(subnet, used_ipv4_addresses(network, virtance))
+    offset = find_free_offset(bitmap, random.randrange(subnet.num_addresses))
+    if offset is None:
+        return None
+    address = str(subnet.network_address + offset)
+    return IPAddress.objects.create(network=network, address=address, virtance=virtance, is_float=is_float)
+
+
+def assign_free_ipv4_addresses(virtance_id, types, is_float=False):
+    assigned = {}
     virtance = Virtance.objects.get(id=virtance_id)
-    virtances = Virtance.objects.filter(compute=virtance.compute, is_deleted=False)
-    network = Network.objects.get(
-        region=virtance.region, version=Network.IPv4, type=Network.COMPUTE, is_active=True, is_deleted=False
-    )
-    assigned_ipv4_compute = IPAddress.objects.filter(network=network, virtance__in=virtances)
-    ipaddrs = list(IPv4Network(f"{network.cidr}/{network.netmask}"))[SUBNET_V4_RANGE]
-    for ipaddr in random.sample(ipaddrs, k=len(ipaddrs)):
-        if str(ipaddr) not in [ip.address for ip in assigned_ipv4_compute]:
-            ipaddr = IPAddress.objects.create(network=network, address=str(ipaddr), virtance=virtance)
-            return ipaddr.id
-    return None
+
+    with transaction.atomic():
+        # Network rows are locked so concurrent workers can't hand out the same address
+        networks = Network.objects.select_for_update().filter(
+            region=virtance.region, version=Network.IPv4, type__in=types, is_active=True, is_deleted=False
+        )
+        networks = list(networks.order_by("id"))
+        for net_type in types:
+            for net in [net for net in networks if net.type == net_type]:
+                ipaddr = allocate_ipv4(net, virtance, is_float=is_float)
+                if ipaddr is not None:
+                    assigned[net_type] = ipaddr.id
+                    break
+
+    return assigned
+
+
+def assign_free_ipv4_compute(virtance_id):
+    return assign_free_ipv4_addresses(virtance_id, [Network.COMPUTE]).get(Network.COMPUTE)
 
 
 def assign_free_ipv4_public(virtance_id, is_float=False):
-    virtance = Virtance.objects.get(id=virtance_id)
-    networks = Network.objects.filter(
-        region=virtance.region, version=Network.IPv4, type=Network.PUBLIC, is_active=True, is_deleted=False
-    )
-    for net in networks:
-        ipaddrs = list(IPv4Network(f"{net.cidr}/{net.netmask}"))[SUBNET_V4_RANGE]
-        for ipaddr in random.sample(ipaddrs, k=len(ipaddrs)):
-            if not IPAddress.objects.filter(network=net, address=str(ipaddr)).exists():
-                ipaddr = IPAddress.objects.create(
-                    network=net, address=str(ipaddr), virtance=virtance, is_float=is_float
-                )
-                return ipaddr.id
-    return None
+    return assign_free_ipv4_addresses(virtance_id, [Network.PUBLIC], is_float=is_float).get(Network.PUBLIC)
 
 
 def assign_free_ipv4_private(virtance_id):
-    virtance = Virtance.objects.get(id=virtance_id)
-    networks = Network.objects.filter(
-        region=virtance.region, version=Network.IPv4, type=Network.PRIVATE, is_active=True, is_deleted=False
-    )
-    for net in networks:
-        ipaddrs = list(IPv4Network(f"{net.cidr}/{net.netmask}"))[SUBNET_V4_RANGE]
-        for ipaddr in random.sample(ipaddrs, k=len(ipaddrs)):
-            if not IPAddress.objects.filter(network=net, address=str(ipaddr)).exists():
-                ipaddr = IPAddress.objects.create(network=net, address=str(ipaddr), virtance=virtance)
-                return ipaddr.id
-    return None
+    return assign_free_ipv4_addresses(virtance_id, [Network.PRIVATE]).get(Network.PRIVATE)
+
+
+def ipv6_slots(subnet, step=SUBNET_V6_STEP, seed=None):
+    # Walks every slot of the subnet exactly once in a scattered order: slot = offset + i * stride (mod count)
+    count = subnet.num_addresses // step - 1
+    if count <= 0:
+        return
+
+    rnd = random.Random(seed)
+    offset = rnd.randrange(count)
+    stride = rnd.randrange(1, count) if count > 1 else 1
+    while math.gcd(stride, count) != 1:
+        stride += 1
+
+    # First slot is the network address itself
+    base = int(subnet.network_address) + step
+    for i in range(count):
+        yield base + ((offset + i * stride) % count) * step
+
+
+def allocate_ipv6(network, virtance, step=SUBNET_V6_STEP):
+    slots = ipv6_slots(IPv6Network(f"{network.cidr}/{network.netmask}"), step)
+    while True:
+        batch = [str(ip_address(slot)) for slot in islice(slots, SUBNET_V6_PROBE_BATCH)]
+        if not batch:
+            return None
+        # Probe by address only, filtering on network would let the planner scan the network's addresses
+        ipaddrs = IPAddress.objects.filter(address__in=batch).order_by().values_list("address", "network_id")
+        used = {address for address, network_id in ipaddrs if network_id == network.id}
+        for address in batch:
+            if address not in used:
+                return IPAddress.objects.create(network=network, address=address, virtance=virtance)
 
 
 def assign_free_ipv6_public(virtance_id):
     virtance = Virtance.objects.get(id=virtance_id)
-    networks = Network.objects.filter(
-        region=virtance.region, version=Network.IPv6, type=Network.PUBLIC, is_active=True, is_deleted=False
-    )
-    for net in networks:
-        step = 16
-        nums = 2**step
-        subnet = IPv6Network(f"{net.cidr}/{net.netmask}")
-        start = int(subnet.network_address) + step
-        end = int(subnet.broadcast_address) + 1
-        limit = nums if nums < end else end - 1  # Check if limit is greater than end
-        for i in random.sample(range(start, end, step), k=limit):
-            if not IPAddress.objects.filter(network=net, address=str(ip_address(i))).exists():
-                ipaddr = IPAddress.objects.create(network=net, address=str(ip_address(i)), virtance=virtance)
+
+    with transaction.atomic():
+        networks = Network.objects.select_for_update().filter(
+            region=virtance.region, version=Network.IPv6, type=Network.PUBLIC, is_active=True, is_deleted=False
+        )
+        for net in networks.order_by("id"):
+            ipaddr = allocate_ipv6(net, virtance)
+            if ipaddr is not None:
                 return ipaddr.id
+
     return None
@@ -0,0 +1,64 @@
+import time
+from ipaddress import IPv6Network
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from network.helper import allocate_ipv6
+from network.models import Network
+from region.models import Region
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the IPv6 allocator on a temporary network, all changes are rolled back"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subnet", default="2001:db8::/48", help="IPv6 subnet to allocate from")
+        parser.add_argument("--count", type=int, default=100000, help="Number of addresses to allocate")
+        parser.add_argument("--region", default=None, help="Region slug of the temporary network")
+
+    def handle(self, *args, **kwargs):
+        subnet = IPv6Network(kwargs.get("subnet"))
+        count = kwargs.get("count")
+        region = Region.objects.filter(slug=kwargs.get("region")) if kwargs.get("region") else Region.objects.all()
+        region = region.first()
+        if region is None:
+            raise CommandError("Region not found.")
+
+        allocated = 0
+        counter = QueryCounter()
+        with transaction.atomic():
+            # Inactive, so real allocations never pick the temporary network
+            network = Network.objects.create(
+                cidr=str(subnet.network_address),
+                netmask=str(subnet.prefixlen),
+                gateway=str(subnet.network_address + 1),
+                version=Network.IPv6,
+                type=Network.PUBLIC,
+                region=region,
+                is_active=False,
+            )
+            started = time.perf_counter()
+            with connection.execute_wrapper(counter):
+                for _ in range(count):
+                    if allocate_ipv6(network, None) is None:
+                        self.stdout.write(
+                            self.style.ERROR(f"Subnet {subnet} is exhausted after {allocated} allocations")
+                        )
+                        break
+                    allocated += 1
+            elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"Allocated: {allocated} addresses in {subnet}")
+        self.stdout.write(f"Queries: {counter.count} ({counter.count / max(allocated, 1):.3f} per allocation)")
+        self.stdout.write(self.style.SUCCESS(f"Elapsed: {elapsed:.3f}s, {allocated / elapsed:.0f} allocations/s"))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="ipaddress",
+            name="address",
+            field=models.GenericIPAddressField(db_index=True),
+        ),
+    ]
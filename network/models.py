@@ -55,7 +55,7 @@ class Network(models.Model):
 class IPAddress(models.Model):
     network = models.ForeignKey(Network, models.PROTECT)
     virtance = models.ForeignKey("virtance.Virtance", models.PROTECT, null=True, blank=True)
-    address = models.GenericIPAddressField()
+    address = models.GenericIPAddressField(db_index=True)
     is_float = models.BooleanField(default=False)
     updated = models.DateTimeField(auto_now=True)
     created = models.DateTimeField(auto_now_add=True)
@@ -1,7 +1,5 @@
 from rest_framework import serializers
 
-from size.models import Size
-
 from .models import Region
 
 
@@ -18,4 +16,5 @@ class RegionSerializer(serializers.ModelSerializer):
         return [obj.name for obj in obj.features.all()]
 
     def get_sizes(self, obj):
-        return [size.slug for size in Size.objects.filter(is_deleted=False) if obj in size.regions.all()]
+        # Reverse side of Size.regions, which is named "regions" as well
+        return [size.slug for size in obj.regions.all() if size.is_deleted is False]
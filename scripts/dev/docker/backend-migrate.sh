@@ -2,5 +2,6 @@
 set -e
 
 docker-compose exec backend python3 manage.py migrate
+docker-compose exec backend python3 manage.py createcachetable
 
 exit 0
\ No newline at end of file
@@ -2,5 +2,6 @@
 set -e
 
 .venv/bin/python3 manage.py migrate
+.venv/bin/python3 manage.py createcachetable
 
 exit 0
\ No newline at end of file
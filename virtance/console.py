@@ -0,0 +1,334 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import struct
+import time
+from http import cookies
+
+import numpy
+from django.db import close_old_connections
+
+from compute.webvirt import WebVirtCompute
+
+from .models import Virtance
+from .utils import read_console_ticket
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_OPCODE_CONTINUATION = 0x0
+WS_OPCODE_TEXT = 0x1
+WS_OPCODE_BINARY = 0x2
+WS_OPCODE_CLOSE = 0x8
+WS_OPCODE_PING = 0x9
+WS_OPCODE_PONG = 0xA
+WS_MAX_PAYLOAD = 16 * 1024 * 1024
+VNC_READ_SIZE = 64 * 1024
+
+
+def get_console_connection(uuid):
+    """
+    Resolve the VNC endpoint of a virtance through the database and its compute daemon.
+    """
+    try:
+        virtance = Virtance.objects.filter(uuid=uuid, is_deleted=False).select_related("compute").first()
+        if virtance is None or virtance.compute is None:
+            logging.error(f"Fail to retrieve console connection info for UUID {uuid}: compute not found")
+            return None
+
+        wvcomp = WebVirtCompute(virtance.compute.token, virtance.compute.hostname)
+        res = wvcomp.get_virtance_vnc(virtance.id)
+        if res.get("detail") is not None:
+            logging.error(f"Fail to retrieve console connection info for UUID {uuid}: {res.get('detail')}")
+            return None
+
+        return virtance.compute.hostname, res.get("vnc_port")
+    finally:
+        close_old_connections()
+
+
+class ConsoleRoutes(object):
+    """
+    Short lived uuid -> (host, port) cache, so reconnects and page reloads skip the DB and compute lookup.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.routes = {}
+        self.pending = {}
+
+    async def resolve(self, uuid):
+        route = self.routes.get(uuid)
+        if route is not None and route[1] > time.monotonic():
+            return route[0]
+
+        # Concurrent connections for the same console share one lookup
+        future = self.pending.get(uuid)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self.pending[uuid] = loop.run_in_executor(None, get_console_connection, uuid)
+        try:
+            target = await future
+        finally:
+            self.pending.pop(uuid, None)
+
+        if target is not None:
+            self.routes[uuid] = (target, time.monotonic() + self.ttl)
+        return target
+
+
+class ConsoleSession(object):
+    def __init__(self, uuid, peer, host, port):
+        self.uuid = uuid
+        self.peer = peer
+        self.host = host
+        self.port = port
+        self.started = time.monotonic()
+        self.last_activity = self.started
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def to_dict(self):
+        # No uuid here: the uuid cookie alone opens a console and this is served on /stats
+        return {
+            "peer": self.peer,
+            "target": f"{self.host}:{self.port}",
+            "duration": round(time.monotonic() - self.started, 1),
+            "idle": round(time.monotonic() - self.last_activity, 1),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+def unmask(payload, mask):
+    if len(payload) < 64:
+        return bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    data = numpy.frombuffer(payload, dtype=numpy.uint8)
+    key = numpy.resize(numpy.frombuffer(mask, dtype=numpy.uint8), len(data))
+    return numpy.bitwise_xor(data, key).tobytes()
+
+
+def frame_header(opcode, length):
+    if length < 126:
+        return struct.pack("!BB", 0x80 | opcode, length)
+    if length < 65536:
+        return struct.pack("!BBH", 0x80 | opcode, 126, length)
+    return struct.pack("!BBQ", 0x80 | opcode, 127, length)
+
+
+async def read_frame(reader):
+    head = await reader.readexactly(2)
+    opcode = head[0] & 0x0F
+    length = head[1] & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", await reader.readexactly(8))
+    if length > WS_MAX_PAYLOAD:
+        raise ConnectionError("Websocket frame is too large")
+    mask = await reader.readexactly(4) if head[1] & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        payload = unmask(payload, mask)
+    return opcode, payload
+
+
+class ConsoleProxy(object):
+    """
+    Single process websocket to VNC proxy. Every console is a pair of relay
+    coroutines, sessions are capped by `max_connections` and closed after
+    `idle_timeout` seconds without traffic in either direction. Consoles are
+    opened by signed tickets only, unless `uuid_fallback` allows the uuid
+    cookie of older clients, which costs a DB and compute lookup.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        max_connections,
+        idle_timeout,
+        route_ttl,
+        ticket_ttl,
+        uuid_fallback=False,
+        ssl=None,
+        verbose=False,
+    ):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.routes = ConsoleRoutes(route_ttl)
+        self.ticket_ttl = ticket_ttl
+        self.uuid_fallback = uuid_fallback
+        self.ssl = ssl
+        self.verbose = verbose
+        self.sessions = set()
+        self.used_tickets = {}
+
+    def stats(self):
+        return {
+            "connections": len(self.sessions),
+            "max_connections": self.max_connections,
+            "sessions": [session.to_dict() for session in self.sessions],
+        }
+
+    async def read_request(self, reader):
+        request_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        parts = request_line.decode("latin-1").split()
+        path = parts[1] if len(parts) == 3 else None
+        return path, headers
+
+    async def reply(self, writer, status, body, content_type="text/plain"):
+        body = body.encode()
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+    def redeem(self, ticket):
+        """
+        Return the payload of a valid ticket the first time this process sees it. Nonces are
+        kept for the ticket lifetime only, the signed expiry refuses the ticket afterwards.
+        """
+        payload = read_console_ticket(ticket)
+        if payload is None:
+            return None
+
+        # Every nonce lives for ticket_ttl, so they expire in insertion order
+        now = time.monotonic()
+        while self.used_tickets and next(iter(self.used_tickets.values())) <= now:
+            del self.used_tickets[next(iter(self.used_tickets))]
+        if payload["nonce"] in self.used_tickets:
+            return None
+        self.used_tickets[payload["nonce"]] = now + self.ticket_ttl
+        return payload
+
+    async def target(self, headers):
+        cookie = cookies.SimpleCookie()
+        cookie.load(headers.get("cookie", ""))
+        if "ticket" in cookie:
+            ticket = self.redeem(cookie.get("ticket").value)
+            if ticket is not None:
+                return ticket["uuid"], (ticket["host"], ticket["port"])
+        if not self.uuid_fallback or "uuid" not in cookie:
+            return None, None
+        uuid = cookie.get("uuid").value
+        return uuid, await self.routes.resolve(uuid)
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info("peername")[0]
+        try:
+            path, headers = await asyncio.wait_for(self.read_request(reader), timeout=10)
+
+            if headers.get("upgrade", "").lower() != "websocket":
+                if path == "/stats" and peer in ("127.0.0.1", "::1"):
+                    await self.reply(writer, "200 OK", json.dumps(self.stats()), "application/json")
+                else:
+                    await self.reply(writer, "400 Bad Request", "Websocket upgrade required")
+                return
+
+            if len(self.sessions) >= self.max_connections:
+                await self.reply(writer, "503 Service Unavailable", "Too many console connections")
+                return
+
+            uuid, target = await self.target(headers)
+            if target is None:
+                await self.reply(writer, "404 Not Found", "Console not found")
+                return
+
+            host, port = target
+            vnc_reader, vnc_writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=10)
+        except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError) as err:
+            logging.error(f"Fail to open console for {peer}: {err}")
+            writer.close()
+            return
+
+        accept = base64.b64encode(hashlib.sha1(headers.get("sec-websocket-key", "").encode() + WS_GUID).digest())
+        response = (
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept.decode()}\r\n"
+        )
+        if "binary" in headers.get("sec-websocket-protocol", ""):
+            response += "Sec-WebSocket-Protocol: binary\r\n"
+        writer.write(f"{response}\r\n".encode())
+
+        session = ConsoleSession(uuid, peer, host, port)
+        self.sessions.add(session)
+        if self.verbose:
+            logging.info(f"Console {uuid} opened from {peer} to {host}:{port}")
+
+        relays = [
+            asyncio.create_task(self.client_to_vnc(session, reader, writer, vnc_writer)),
+            asyncio.create_task(self.vnc_to_client(session, vnc_reader, writer)),
+            asyncio.create_task(self.watchdog(session)),
+        ]
+        try:
+            await asyncio.wait(relays, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for relay in relays:
+                relay.cancel()
+            self.sessions.discard(session)
+            vnc_writer.close()
+            writer.close()
+            if self.verbose:
+                logging.info(f"Console {uuid} closed: {session.to_dict()}")
+
+    async def client_to_vnc(self, session, reader, writer, vnc_writer):
+        try:
+            while True:
+                opcode, payload = await read_frame(reader)
+                session.touch()
+                if opcode in (WS_OPCODE_BINARY, WS_OPCODE_TEXT, WS_OPCODE_CONTINUATION):
+                    if opcode == WS_OPCODE_TEXT:
+                        payload = base64.b64decode(payload)
+                    session.bytes_in += len(payload)
+                    vnc_writer.write(payload)
+                    await vnc_writer.drain()
+                elif opcode == WS_OPCODE_PING:
+                    writer.writelines([frame_header(WS_OPCODE_PONG, len(payload)), payload])
+                    await writer.drain()
+                elif opcode == WS_OPCODE_CLOSE:
+                    writer.write(frame_header(WS_OPCODE_CLOSE, 0))
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+
+    async def vnc_to_client(self, session, vnc_reader, writer):
+        try:
+            while True:
+                data = await vnc_reader.read(VNC_READ_SIZE)
+                if not data:
+                    return
+                session.touch()
+                session.bytes_out += len(data)
+                writer.writelines([frame_header(WS_OPCODE_BINARY, len(data)), data])
+                await writer.drain()
+        except ConnectionError:
+            return
+
+    async def watchdog(self, session):
+        while True:
+            idle = time.monotonic() - session.last_activity
+            if idle >= self.idle_timeout:
+                if self.verbose:
+                    logging.info(f"Console {session.uuid} idle for {int(idle)}s, closing")
+                return
+            await asyncio.sleep(self.idle_timeout - idle)
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port, ssl=self.ssl, reuse_address=True)
+        async with server:
+            await server.serve_forever()
@@ -1,5 +1,7 @@
+import asyncio
 import logging
 import os
+import ssl
 from http import cookies
 
 import django
@@ -7,44 +9,37 @@ from django.conf import settings
 from django.core.management.base import BaseCommand
 from websockify import ProxyRequestHandler, WebSocketProxy
 
+from virtance.utils import read_console_ticket
+
 DIR_PATH = os.path.dirname(os.path.abspath(__file__))
 CERT_PATH = os.path.join(DIR_PATH, "cert.pem")
 
 
 def get_console_connection(uuid):
     django.setup()
-    from compute.webvirt import WebVirtCompute
-    from virtance.models import Virtance
-
-    virtance = Virtance.objects.filter(uuid=uuid, is_deleted=False).first()
-
-    if virtance is None or virtance.compute is None:
-        logging.error(f"Fail to retrieve console connection info for UUID {uuid}: compute not found")
-        raise
-
-    wvcomp = WebVirtCompute(virtance.compute.token, virtance.compute.hostname)
-    res = wvcomp.get_virtance_vnc(virtance.id)
+    from virtance.console import get_console_connection as console_connection
 
-    if res.get("detail") is not None:
-        logging.error(f"Fail to retrieve console connection info for UUID {uuid}: {res.get('detail')}")
+    target = console_connection(uuid)
+    if target is None:
         raise
 
-    port = res.get("vnc_port")
-    host = virtance.compute.hostname
-
-    return host, port
+    return target
 
 
 class CompatibilityMixIn(object):
     def _new_client(self, daemon, socket_factory):
         cookie = cookies.SimpleCookie()
         cookie.load(self.headers.get("cookie"))
-        if "uuid" not in cookie:
-            print("UUID not found\n")
+        # Every connection is a forked process, tickets are only checked by signature and expiry
+        ticket = read_console_ticket(cookie.get("ticket").value) if "ticket" in cookie else None
+        if ticket is not None:
+            console_host, console_port = ticket["host"], ticket["port"]
+        elif self.server.uuid_fallback and "uuid" in cookie:
+            console_host, console_port = get_console_connection(cookie.get("uuid").value)
+        else:
+            print("Console ticket not found\n")
             return False
 
-        console_host, console_port = get_console_connection(cookie.get("uuid").value)
-
         cnx_debug_msg = "Connection Info:\n"
         cnx_debug_msg += f"       - VNC host: {console_host}\n"
         cnx_debug_msg += f"       - VNC port: {console_port}"
@@ -124,8 +119,82 @@ class Command(BaseCommand):
             default=settings.WEBSOCKET_CERT or CERT_PATH,
         )
 
+        parser.add_argument(
+            "-m",
+            "--mode",
+            dest="mode",
+            action="store",
+            choices=["fork", "asyncio"],
+            help="Proxy mode: websockify process per connection or single asyncio process",
+            default=settings.WEBSOCKET_MODE,
+        )
+
+        parser.add_argument(
+            "--ssl-only",
+            dest="ssl_only",
+            action="store_true",
+            help="Serve TLS with the certificate file (asyncio mode)",
+            default=False,
+        )
+
+        parser.add_argument(
+            "--max-connections",
+            dest="max_connections",
+            action="store",
+            type=int,
+            help="Maximum concurrent consoles (asyncio mode)",
+            default=settings.WEBSOCKET_MAX_CONNECTIONS,
+        )
+
+        parser.add_argument(
+            "--idle-timeout",
+            dest="idle_timeout",
+            action="store",
+            type=int,
+            help="Close consoles without traffic after this many seconds (asyncio mode)",
+            default=settings.WEBSOCKET_IDLE_TIMEOUT,
+        )
+
+        parser.add_argument(
+            "--uuid-fallback",
+            dest="uuid_fallback",
+            action="store_true",
+            help="Accept the uuid cookie of clients without a ticket (DB and compute lookup per connection)",
+            default=settings.WEBSOCKET_UUID_FALLBACK,
+        )
+
+    def handle_asyncio(self, options):
+        from virtance.console import ConsoleProxy
+
+        if options["verbose"]:
+            logging.basicConfig(level=logging.INFO)
+
+        ssl_context = None
+        if options["ssl_only"]:
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(options["cert"])
+
+        proxy = ConsoleProxy(
+            host=options["host"],
+            port=int(options["port"]),
+            max_connections=int(options["max_connections"]),
+            idle_timeout=int(options["idle_timeout"]),
+            route_ttl=int(settings.WEBSOCKET_ROUTE_CACHE_TTL),
+            ticket_ttl=int(settings.NOVNC_TICKET_TTL),
+            uuid_fallback=options["uuid_fallback"],
+            ssl=ssl_context,
+            verbose=options["verbose"],
+        )
+        try:
+            asyncio.run(proxy.serve())
+        except KeyboardInterrupt:
+            pass
+
     def handle(self, *args, **options):
-        print("Starting noVNC daemon...\n")
+        print(f"Starting noVNC daemon in {options['mode']} mode...\n")
+        if options["mode"] == "asyncio":
+            return self.handle_asyncio(options)
+
         server = WebSocketProxy(
             RequestHandlerClass=NovaProxyRequestHandler,
             listen_host=options["host"],
@@ -144,4 +213,5 @@ class Command(BaseCommand):
             wrap_mode="exit",
             wrap_cmd=None,
         )
+        server.uuid_fallback = options["uuid_fallback"]
         server.start_server()
@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import json
+import time
+
+import numpy
+from django.core.cache import cache
+
+from compute.webvirt import AsyncWebVirtCompute, vm_name
+
+METRICS_STEP = 300
+METRICS_WINDOW = 86400
+METRICS_CACHE_KEY = "virtance:metrics:{domain}:{query}:{step}"
+METRICS_MAX_POINTS = 5000
+METRICS_FORMATS = ("pairs", "columnar")
+# Chart range -> (window, step) in seconds, each range keeps a few hundred points per series
+METRICS_RANGES = {
+    "1h": (3600, 60),
+    "6h": (21600, 120),
+    "24h": (86400, 300),
+    "7d": (604800, 1800),
+    "30d": (2592000, 7200),
+}
+
+
+def cpu_queries(domain):
+    vcpu = f"(libvirt_domain_info_vcpu_num{{domain='{domain}'}}*1000000000)"
+    return {
+        "user": f"(irate(libvirt_domain_info_cpu_time_user{{domain='{domain}'}}[5m])*100)/{vcpu}",
+        "sys": f"(irate(libvirt_domain_info_cpu_time_system{{domain='{domain}'}}[5m])*100)/{vcpu}",
+        "total": f"(irate(libvirt_domain_info_cpu_time{{domain='{domain}'}}[5m])*100)/{vcpu}",
+    }
+
+
+def mem_queries(domain):
+    return {
+        "mem": (
+            f"(((avg_over_time(libvirt_domain_info_memory_actual{{domain='{domain}'}}[5m]))-"
+            f"(avg_over_time(libvirt_domain_info_memory_unused{{domain='{domain}'}}[5m])))/"
+            f"(avg_over_time(libvirt_domain_info_memory_actual{{domain='{domain}'}}[5m])))*100"
+        )
+    }
+
+
+def net_queries(domain):
+    return {
+        "rx": f"(irate(libvirt_domain_info_net_rx_bytes{{domain='{domain}'}}[5m])*8)/1048576",
+        "tx": f"(irate(libvirt_domain_info_net_tx_bytes{{domain='{domain}'}}[5m])*8)/1048576",
+    }
+
+
+def disk_queries(domain):
+    return {
+        "read": f"irate(libvirt_domain_info_block_read_bytes{{dev='vda',domain='{domain}'}}[5m])/1048576",
+        "write": f"irate(libvirt_domain_info_block_write_bytes{{dev='vda',domain='{domain}'}}[5m])/1048576",
+    }
+
+
+def series_values(result, index=0):
+    try:
+        return result[index]["values"]
+    except (KeyError, IndexError, TypeError):
+        return []
+
+
+def clamp_values(values, series, upper):
+    """
+    Cap the parsed `series` of a [[ts, "value"], ...] list at `upper` in one vectorized pass.
+    Only the capped points of `values` are rewritten, the others keep their original string.
+    """
+    over = numpy.flatnonzero(series > upper)
+    if len(over):
+        capped = str(float(upper))
+        for i in over.tolist():
+            values[i][1] = capped
+        series[over] = upper
+    return series
+
+
+def metrics_params(query_params):
+    """
+    Validate the range, format and points query parameters of the metrics endpoints.
+    """
+    metrics_range = query_params.get("range", "24h")
+    if metrics_range not in METRICS_RANGES:
+        raise ValueError(f"Range must be one of: {', '.join(METRICS_RANGES)}.")
+
+    metrics_format = query_params.get("format", "pairs")
+    if metrics_format not in METRICS_FORMATS:
+        raise ValueError(f"Format must be one of: {', '.join(METRICS_FORMATS)}.")
+
+    points = query_params.get("points")
+    if points is not None:
+        if not points.isdigit() or not 2 <= int(points) <= METRICS_MAX_POINTS:
+            raise ValueError(f"Points must be a number between 2 and {METRICS_MAX_POINTS}.")
+        points = int(points)
+
+    window, step = METRICS_RANGES[metrics_range]
+    return {"window": window, "step": step, "format": metrics_format, "points": points}
+
+
+def downsample(points, limit):
+    """
+    Min/max bucketing: split the series into limit/2 buckets and keep the lowest and
+    the highest point of each one, so spikes survive. Returns sorted indexes to keep.
+    """
+    buckets = max(limit // 2, 1)
+    bucket = numpy.arange(len(points)) * buckets // len(points)
+    order = numpy.lexsort((numpy.where(numpy.isnan(points), -numpy.inf, points), bucket))
+    ordered = bucket[order]
+    firsts = numpy.flatnonzero(numpy.r_[True, ordered[1:] != ordered[:-1]])
+    lasts = numpy.r_[firsts[1:], len(order)] - 1
+    return numpy.unique(numpy.concatenate([order[firsts], order[lasts]]))
+
+
+def format_series(values, metrics_format="pairs", points=None, upper=None):
+    """
+    Shape a [[ts, "value"], ...] series for the response: optionally capped at `upper`,
+    downsampled to about `points` points and returned as pairs or as columnar arrays.
+    """
+    sliced = points is not None and len(values) > points
+    if metrics_format == "pairs" and not sliced and upper is None:
+        return values
+
+    series = numpy.array([val[1] for val in values], dtype=numpy.float64)
+    if upper is not None:
+        series = clamp_values(values, series, upper)
+    if metrics_format == "pairs" and not sliced:
+        return values
+
+    timestamps = numpy.array([val[0] for val in values], dtype=numpy.float64)
+    if sliced:
+        keep = downsample(series, points)
+        if metrics_format == "pairs":
+            return [values[i] for i in keep]
+        timestamps, series = timestamps[keep], series[keep]
+
+    return {
+        "timestamps": timestamps.astype(numpy.int64).tolist(),
+        "values": [None if val != val else val for val in series.tolist()],
+    }
+
+
+def merge_result(cached, tail, start):
+    """
+    Merge the freshly fetched tail into the cached series. Points before `start` are
+    dropped and points of the tail replace cached ones with the same timestamp.
+    """
+    merged = {}
+    for series in cached + tail:
+        key = json.dumps(series.get("metric", {}), sort_keys=True)
+        values = merged.setdefault(key, {"metric": series.get("metric", {}), "values": {}})["values"]
+        for ts, val in series.get("values", []):
+            if ts >= start:
+                values[ts] = val
+    return [
+        {"metric": series["metric"], "values": [[ts, series["values"][ts]] for ts in sorted(series["values"])]}
+        for series in merged.values()
+    ]
+
+
+class MetricsGateway(object):
+    """
+    Fetch all series of a chart panel from the compute daemon in one concurrent batch.
+    Results are cached per (domain, query, step) over a window aligned to the step, so a
+    refresh only asks the compute for the points after the previously cached window.
+    """
+
+    def __init__(self, virtance, window=METRICS_WINDOW, step=METRICS_STEP):
+        self.domain = vm_name(virtance.id)
+        self.wvcomp = AsyncWebVirtCompute(virtance.compute.token, virtance.compute.hostname)
+        self.window = window
+        self.step = step
+
+    def cache_key(self, query):
+        digest = hashlib.md5(query.encode()).hexdigest()
+        return METRICS_CACHE_KEY.format(domain=self.domain, query=digest, step=self.step)
+
+    async def fetch_query(self, query, start, end):
+        res = await self.wvcomp.get_metrics(query, start, end, f"{self.step}s")
+        try:
+            return res["data"]["result"]
+        except (KeyError, TypeError):
+            return None
+
+    async def fetch_all(self, queries, start, end):
+        entries = cache.get_many([self.cache_key(query) for query in queries.values()])
+        plan = {}
+        for name, query in queries.items():
+            entry = entries.get(self.cache_key(query))
+            if entry is not None and entry["end"] == end:
+                plan[name] = (entry, None)
+            elif entry is not None and entry["start"] <= start <= entry["end"]:
+                # Refetch from the last cached point, it may have been scraped partially
+                plan[name] = (entry, entry["end"])
+            else:
+                plan[name] = (None, start)
+
+        fetch = {name: since for name, (_, since) in plan.items() if since is not None}
+        results = await asyncio.gather(*(self.fetch_query(queries[name], since, end) for name, since in fetch.items()))
+        fetched = dict(zip(fetch, results))
+
+        data = {}
+        updates = {}
+        for name, (entry, since) in plan.items():
+            cached = entry["result"] if entry is not None else []
+            if since is None:
+                data[name] = merge_result(cached, [], start)
+                continue
+            tail = fetched[name]
+            if tail is None:
+                data[name] = merge_result(cached, [], start) if entry is not None else []
+                continue
+            data[name] = merge_result(cached, tail, start)
+            updates[self.cache_key(queries[name])] = {"start": start, "end": end, "result": data[name]}
+
+        if updates:
+            cache.set_many(updates, timeout=self.window)
+        return data
+
+    def fetch(self, queries):
+        """
+        Return {name: prometheus result list} for every query in `queries`.
+        """
+        end = int(time.time()) // self.step * self.step
+        start = end - self.window
+        return asyncio.run(self.fetch_all(queries, start, end))
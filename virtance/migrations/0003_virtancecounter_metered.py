@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("virtance", "0002_virtance_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="virtancecounter",
+            name="metered",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("virtance", "0003_virtancecounter_metered"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="virtance",
+            name="status_synced",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
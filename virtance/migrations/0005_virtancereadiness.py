@@ -0,0 +1,35 @@
+# Generated by Django 4.2.18 on 2026-10-18 15:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("image", "0005_snapshotcounter_metered"),
+        ("virtance", "0004_virtance_status_synced"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VirtanceReadiness",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("elapsed", models.FloatField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "template",
+                    models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to="image.image"),
+                ),
+                (
+                    "virtance",
+                    models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to="virtance.virtance"),
+                ),
+            ],
+            options={
+                "verbose_name": "Virtance Readiness",
+                "verbose_name_plural": "Virtance Readiness",
+                "ordering": ["-id"],
+            },
+        ),
+    ]
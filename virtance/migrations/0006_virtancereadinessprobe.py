@@ -0,0 +1,35 @@
+# Generated by Django 4.2.18 on 2026-10-18 17:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("virtance", "0005_virtancereadiness"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VirtanceReadinessProbe",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("host", models.GenericIPAddressField()),
+                ("private_key", models.TextField()),
+                ("link", models.JSONField(blank=True, null=True)),
+                ("attempt", models.IntegerField(default=0)),
+                ("started", models.DateTimeField()),
+                ("next_probe", models.DateTimeField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "virtance",
+                    models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to="virtance.virtance"),
+                ),
+            ],
+            options={
+                "verbose_name": "Virtance Readiness Probe",
+                "verbose_name_plural": "Virtance Readiness Probes",
+                "ordering": ["next_probe"],
+            },
+        ),
+    ]
@@ -84,6 +84,7 @@ class Virtance(models.Model):
     name = models.CharField(max_length=100)
     disk = models.BigIntegerField()
     status = models.CharField(max_length=100, choices=STATUS_CHOICES, default=PENDING)
+    status_synced = models.DateTimeField(null=True, blank=True)
     user_data = models.TextField(blank=True, null=True)
     is_locked = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
@@ -153,6 +154,7 @@ class VirtanceCounter(models.Model):
     started = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
     stopped = models.DateTimeField(blank=True, null=True)
+    metered = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         ordering = ["-id"]
@@ -182,6 +184,40 @@ class VirtanceError(models.Model):
         return self.event
 
 
+class VirtanceReadiness(models.Model):
+    virtance = models.ForeignKey(Virtance, models.PROTECT)
+    template = models.ForeignKey("image.Image", models.PROTECT)
+    elapsed = models.FloatField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-id"]
+        verbose_name = "Virtance Readiness"
+        verbose_name_plural = "Virtance Readiness"
+
+    def __unicode__(self):
+        return self.elapsed
+
+
+class VirtanceReadinessProbe(models.Model):
+    virtance = models.ForeignKey(Virtance, models.PROTECT)
+    host = models.GenericIPAddressField()
+    private_key = models.TextField()
+    link = models.JSONField(blank=True, null=True)
+    attempt = models.IntegerField(default=0)
+    started = models.DateTimeField()
+    next_probe = models.DateTimeField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["next_probe"]
+        verbose_name = "Virtance Readiness Probe"
+        verbose_name_plural = "Virtance Readiness Probes"
+
+    def __unicode__(self):
+        return self.host
+
+
 class VirtanceHistory(models.Model):
     virtance = models.ForeignKey(Virtance, models.PROTECT)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, models.PROTECT)
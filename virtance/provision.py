@@ -1,8 +1,7 @@
-import importlib
 import os
-import shutil
+import tempfile
+import threading
 
-import ansible.constants as C
 from ansible import context
 from ansible.executor.task_queue_manager import TaskQueueManager
 from ansible.inventory.manager import InventoryManager
@@ -12,6 +11,22 @@ from ansible.playbook.play import Play
 from ansible.plugins.callback import CallbackBase
 from ansible.plugins.loader import init_plugin_loader
 from ansible.vars.manager import VariableManager
+from django.conf import settings
+
+ANSIBLE_FORKS = int(settings.ANSIBLE_FORKS)
+
+# Plugins are loaded once per worker process, later plays reuse them
+_plugins_pid = None
+_plugins_lock = threading.Lock()
+
+
+def load_plugins():
+    global _plugins_pid
+
+    with _plugins_lock:
+        if _plugins_pid != os.getpid():
+            init_plugin_loader()
+            _plugins_pid = os.getpid()
 
 
 # Create a callback plugin so we can return as a result
@@ -33,25 +48,20 @@ class ResultsCollectorCallback(CallbackBase):
 
 
 def ansible_play(user="root", password=None, private_key=None, port=22, hosts=[], tasks={}, extra_vars=None):
-    # Load all the plugins (builtin and custom)
-    init_plugin_loader()
-
-    # Update TMPDIR for ansible
-    importlib.reload(C)
+    load_plugins()
 
-    # Create a temporary file for the private key
+    # Every run gets its own private key file, concurrent plays never share it
     key_file_path = None
     if private_key:
-        key_file_path = os.path.join(C.DEFAULT_LOCAL_TMP, "tmp-id-rsa-priv.pem")
-        with open(key_file_path, "w") as key_file:
+        key_fd, key_file_path = tempfile.mkstemp(prefix="ansible-key-", suffix=".pem")
+        with os.fdopen(key_fd, "w") as key_file:
             key_file.write(private_key)
-        os.chmod(key_file_path, 0o600)
 
     # Set the default connection type to 'smart'
     context.CLIARGS = ImmutableDict(
         connection="smart",
         module_path=[""],
-        forks=10,
+        forks=ANSIBLE_FORKS,
         become=None,
         become_method=None,
         become_user=None,
@@ -83,21 +93,20 @@ def ansible_play(user="root", password=None, private_key=None, port=22, hosts=[]
         variable_manager=variable_manager,
         loader=loader,
         passwords=passwords,
+        forks=ANSIBLE_FORKS,
         stdout_callback=results_callback,
     )
 
     play_source = dict(name="Ansible Play", hosts=hosts, port=port, gather_facts="no", tasks=tasks)
     play = Play().load(play_source, variable_manager=variable_manager, loader=loader)
 
-    if hosts:
-        try:
+    try:
+        if hosts:
             tqm.run(play)
-        finally:
-            tqm.cleanup()
-            if loader:
-                loader.cleanup_all_tmp_files()
-
-    # Remove ansible tmpdir
-    shutil.rmtree(C.DEFAULT_LOCAL_TMP, True)
+    finally:
+        tqm.cleanup()
+        loader.cleanup_all_tmp_files()
+        if key_file_path:
+            os.remove(key_file_path)
 
     return results_callback
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from functools import partial
+
+from .utils import check_ssh_auth
+
+SSH_BANNER = b"SSH-"
+
+
+async def ssh_banner(host, port=22, timeout=5):
+    """
+    Cheap check that sshd accepts connections: open a socket and read the server banner.
+    """
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        banner = await asyncio.wait_for(reader.readline(), timeout)
+        return banner.startswith(SSH_BANNER)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+async def probe_ssh(host, password=None, private_key=None, port=22, timeout=5):
+    if not await ssh_banner(host, port=port, timeout=timeout):
+        return False
+    # Full key authentication only once the banner shows up, paramiko is blocking
+    loop = asyncio.get_running_loop()
+    auth = partial(check_ssh_auth, host, password=password, private_key=private_key, port=port, timeout=timeout)
+    return await loop.run_in_executor(None, auth)
+
+
+async def wait_ssh(host, password=None, private_key=None, port=22, timeout=180, delay=1, max_delay=16):
+    """
+    Probe a host with exponential backoff until SSH is ready.
+    Returns the seconds it took or None after `timeout`.
+    """
+    started = time.monotonic()
+    while True:
+        if await probe_ssh(host, password=password, private_key=private_key, port=port):
+            return time.monotonic() - started
+        remaining = timeout - (time.monotonic() - started)
+        if remaining <= 0:
+            return None
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+async def probe_hosts(targets, concurrency=32):
+    """
+    Probe many (host, private_key) targets at once, at most `concurrency` in flight.
+    Returns a list of booleans in the order of `targets`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(host, private_key):
+        async with semaphore:
+            return await probe_ssh(host, private_key=private_key)
+
+    return await asyncio.gather(*(probe(host, private_key) for host, private_key in targets))
@@ -1,9 +1,12 @@
 import re
+from collections import defaultdict
 
-from django.db.models import Q
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Manager, Q, QuerySet
+from django.utils import timezone
 from rest_framework import serializers
 
-from compute.webvirt import WebVirtCompute
 from image.models import Image
 from image.serializers import ImageSerializer
 from keypair.models import KeyPair, KeyPairVirtance
@@ -25,8 +28,34 @@ from .tasks import (
     resize_virtance,
     restore_virtance,
     snapshot_virtance,
+    virtance_status_refresh,
 )
-from .utils import virtance_error
+from .utils import get_action_progress
+
+
+class VirtanceListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        virtances = data.all() if isinstance(data, Manager) else data
+        if isinstance(virtances, QuerySet):
+            virtances = virtances.select_related("size", "region", "template").prefetch_related(
+                "size__regions", "template__regions", "region__features", "region__regions"
+            )
+        virtances = list(virtances)
+        virtance_ids = [virtance.id for virtance in virtances]
+
+        # Addresses and backup/snapshot ids of the whole page, looked up by child serializers
+        self.virtance_networks = defaultdict(list)
+        for ip in IPAddress.objects.filter(virtance_id__in=virtance_ids, is_float=False).select_related("network"):
+            self.virtance_networks[ip.virtance_id].append(ip)
+
+        self.virtance_images = defaultdict(list)
+        images = Image.objects.filter(
+            source_id__in=virtance_ids, type__in=[Image.BACKUP, Image.SNAPSHOT], is_deleted=False
+        ).values_list("source_id", "type", "id")
+        for source_id, image_type, image_id in images:
+            self.virtance_images[(source_id, image_type)].append(image_id)
+
+        return super().to_representation(virtances)
 
 
 class VirtanceSerializer(serializers.ModelSerializer):
@@ -36,6 +65,7 @@ class VirtanceSerializer(serializers.ModelSerializer):
     vcpu = serializers.IntegerField(source="size.vcpu")
     locked = serializers.BooleanField(source="is_locked")
     created_at = serializers.DateTimeField(source="created")
+    status_synced_at = serializers.DateTimeField(source="status_synced")
     recovery_mode = serializers.BooleanField(source="is_recovery_mode")
     backups_enabled = serializers.BooleanField(source="is_backup_enabled")
     disk = serializers.SerializerMethodField()
@@ -61,6 +91,7 @@ class VirtanceSerializer(serializers.ModelSerializer):
             "region",
             "locked",
             "status",
+            "status_synced_at",
             "networks",
             "features",
             "created_at",
@@ -69,20 +100,15 @@ class VirtanceSerializer(serializers.ModelSerializer):
             "recovery_mode",
             "backups_enabled",
         )
+        list_serializer_class = VirtanceListSerializer
 
     def get_status(self, obj):
-        if not hasattr(self.root, "many"):
-            obj.pending()
-            if obj.event is None:
-                if obj.compute is not None:
-                    wvcomp = WebVirtCompute(obj.compute.token, obj.compute.hostname)
-                    res = wvcomp.status_virtance(obj.id)
-                    if res.get("detail"):
-                        virtance_error(obj.id, res.get("detail"), event="status")
-                    if res.get("status") == "running":
-                        obj.active()
-                    if res.get("status") == "shutoff":
-                        obj.inactive()
+        if not hasattr(self.root, "many") and obj.event is None and obj.compute_id is not None:
+            # Status is synced in background, only ask for a refresh when it's getting old
+            stale_time = timezone.now() - timezone.timedelta(seconds=int(settings.VIRTANCE_STATUS_MAX_AGE))
+            if obj.status_synced is None or obj.status_synced < stale_time:
+                if cache.add(f"virtance_status_refresh_{obj.id}", True, int(settings.VIRTANCE_STATUS_MAX_AGE)):
+                    virtance_status_refresh.delay(obj.id)
         return obj.status
 
     def get_disk(self, obj):
@@ -91,7 +117,10 @@ class VirtanceSerializer(serializers.ModelSerializer):
     def get_event(self, obj):
         if obj.event is None:
             return None
-        return {"name": obj.event, "description": next((i[1] for i in obj.EVENT_CHOICES if i[0] == obj.event))}
+        event = {"name": obj.event, "description": next((i[1] for i in obj.EVENT_CHOICES if i[0] == obj.event))}
+        if not hasattr(self.root, "many") and obj.event in (Virtance.SHUTDOWN, Virtance.REBOOT):
+            event["progress"] = get_action_progress(obj.id)
+        return event
 
     def get_memory(self, obj):
         return obj.size.memory // 1048576
@@ -99,16 +128,27 @@ class VirtanceSerializer(serializers.ModelSerializer):
     def get_features(self, obj):
         return []
 
+    def get_image_ids(self, obj, image_type):
+        virtance_images = getattr(self.root, "virtance_images", None)
+        if virtance_images is not None:
+            return virtance_images[(obj.id, image_type)]
+        return list(Image.objects.filter(source=obj, type=image_type, is_deleted=False).values_list("id", flat=True))
+
     def get_backup_ids(self, obj):
-        return [image.id for image in Image.objects.filter(virtance=obj, type=Image.BACKUP, is_deleted=False)]
+        return self.get_image_ids(obj, Image.BACKUP)
 
     def get_snapshot_ids(self, obj):
-        return [image.id for image in Image.objects.filter(virtance=obj, type=Image.SNAPSHOT, is_deleted=False)]
+        return self.get_image_ids(obj, Image.SNAPSHOT)
 
     def get_networks(self, obj):
         v4 = []
         v6 = []
-        for ip in IPAddress.objects.filter(virtance=obj, is_float=False):
+        virtance_networks = getattr(self.root, "virtance_networks", None)
+        if virtance_networks is not None:
+            ipaddrs = virtance_networks[obj.id]
+        else:
+            ipaddrs = IPAddress.objects.filter(virtance=obj, is_float=False).select_related("network")
+        for ip in ipaddrs:
             if ip.network.version == ip.network.IPv6:
                 v6.append(
                     {
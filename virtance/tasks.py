@@ -1,15 +1,20 @@
+import asyncio
 import time
+from collections import defaultdict
 from decimal import Decimal
 from uuid import uuid4
 
+from celery import signature
 from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Count, Exists, F, OuterRef
 from django.utils import timezone
 from passlib.hash import sha512_crypt
 
-from compute.helper import assign_free_compute
+from billing.metering import run_metering
+from compute.helper import assign_free_compute, update_compute_usage
 from compute.models import Compute
-from compute.webvirt import WebVirtCompute, vm_name
+from compute.webvirt import WebVirtCompute, fan_out, vm_name
 from dbaas.models import DBaaS
 from firewall.models import FirewallVirtance
 from firewall.tasks import firewall_detach
@@ -17,29 +22,47 @@ from floating_ip.models import FloatIP
 from floating_ip.tasks import unassign_floating_ip
 from image.models import Image, SnapshotCounter
 from image.tasks import image_delete
+from image.utils import image_location
 from keypair.models import KeyPairVirtance
 from lbaas.models import LBaaS, LBaaSVirtance
 from lbaas.shared import shared_reload_lbaas
-from network.helper import (
-    assign_free_ipv4_compute,
-    assign_free_ipv4_private,
-    assign_free_ipv4_public,
-)
+from network.helper import assign_free_ipv4_addresses
 from network.models import IPAddress, Network
 from size.models import Size
 from webvirtcloud.celery import app
 from webvirtcloud.email import send_email
 
-from .models import Virtance, VirtanceCounter
-from .utils import decrypt_data, make_ssh_public, virtance_error
+from .models import Virtance, VirtanceCounter, VirtanceReadiness, VirtanceReadinessProbe
+from .readiness import probe_hosts
+from .utils import decrypt_data, get_action_progress, make_ssh_public, set_action_progress, virtance_error
 
 BACKUP_COST_RATIO = settings.BACKUP_COST_PERCENTAGE / 100
+VIRTANCE_STATUS_SYNC_TIMEOUT = float(settings.VIRTANCE_STATUS_SYNC_TIMEOUT)
+VIRTANCE_SHUTDOWN_TIMEOUT = int(settings.VIRTANCE_SHUTDOWN_TIMEOUT)
+VIRTANCE_SHUTDOWN_POLL_INTERVAL = int(settings.VIRTANCE_SHUTDOWN_POLL_INTERVAL)
+VIRTANCE_SSH_READY_TIMEOUT = int(settings.VIRTANCE_SSH_READY_TIMEOUT)
+VIRTANCE_SSH_READY_MAX_DELAY = int(settings.VIRTANCE_SSH_READY_MAX_DELAY)
+VIRTANCE_SSH_READY_CONCURRENCY = int(settings.VIRTANCE_SSH_READY_CONCURRENCY)
+SSH_READY_SWEEP_KEY = "virtance_ssh_ready_sweep"
+
+STATUS_SYNC_CHUNK_SIZE = 1000
+
+# Hypervisor domain state to virtance status, any other state is reported as pending
+DOMAIN_STATUS = {"running": Virtance.ACTIVE, "shutoff": Virtance.INACTIVE}
 
 
 def wvcomp_conn(compute):
     return WebVirtCompute(compute.token, compute.hostname)
 
 
+async def compute_domain_statuses(wvcomp, virtance_ids):
+    host_ids = virtance_ids.get(wvcomp.host, [])
+    results = await asyncio.gather(
+        *(wvcomp.status_virtance(virtance_id) for virtance_id in host_ids), return_exceptions=True
+    )
+    return dict(zip(host_ids, results))
+
+
 @app.task
 def email_virtance_created(recipient, hostname, ipaddr, region, distro):
     subject = "WebVirtCloud virtance created"
@@ -72,26 +95,25 @@ def create_virtance(virtance_id, password=None, send_email=True):
             compute = Compute.objects.get(id=compute_id)
             virtance.compute = compute
 
-    try:
-        ipv4_compute = IPAddress.objects.get(virtance=virtance, network__type=Network.COMPUTE)
-    except IPAddress.DoesNotExist:
-        ipv4_compute_id = assign_free_ipv4_compute(virtance_id)
-        if ipv4_compute_id is not None:
-            ipv4_compute = IPAddress.objects.get(id=ipv4_compute_id)
-
-    try:
-        ipv4_public = IPAddress.objects.get(virtance=virtance, is_float=False, network__type=Network.PUBLIC)
-    except IPAddress.DoesNotExist:
-        ipv4_public_id = assign_free_ipv4_public(virtance_id)
-        if ipv4_public_id is not None:
-            ipv4_public = IPAddress.objects.get(id=ipv4_public_id)
-
-    try:
-        ipv4_private = IPAddress.objects.get(virtance=virtance, network__type=Network.PRIVATE)
-    except IPAddress.DoesNotExist:
-        ipv4_private_id = assign_free_ipv4_private(virtance_id)
-        if ipv4_private_id is not None:
-            ipv4_private = IPAddress.objects.get(id=ipv4_private_id)
+    ipv4_compute = IPAddress.objects.filter(virtance=virtance, network__type=Network.COMPUTE).first()
+    ipv4_public = IPAddress.objects.filter(virtance=virtance, is_float=False, network__type=Network.PUBLIC).first()
+    ipv4_private = IPAddress.objects.filter(virtance=virtance, network__type=Network.PRIVATE).first()
+
+    missing = [
+        net_type
+        for net_type, ipaddr in (
+            (Network.COMPUTE, ipv4_compute),
+            (Network.PUBLIC, ipv4_public),
+            (Network.PRIVATE, ipv4_private),
+        )
+        if ipaddr is None
+    ]
+    if missing:
+        assigned = assign_free_ipv4_addresses(virtance_id, missing)
+        ipaddrs = IPAddress.objects.in_bulk(assigned.values())
+        ipv4_compute = ipv4_compute or ipaddrs.get(assigned.get(Network.COMPUTE))
+        ipv4_public = ipv4_public or ipaddrs.get(assigned.get(Network.PUBLIC))
+        ipv4_private = ipv4_private or ipaddrs.get(assigned.get(Network.PRIVATE))
 
     for kpv in KeyPairVirtance.objects.filter(virtance_id=virtance_id):
         keypairs.append(kpv.keypair.public_key)
@@ -254,47 +276,153 @@ def rebuild_virtance(virtance_id):
 
 
 @app.task
-def action_virtance(virtance_id, action):
-    error = None
-    reboot = False
-    if action == "reboot":
-        reboot = True
-        action = "shutdown"
+def action_virtance(virtance_id, action, link=None):
+    """
+    Run a power action. Shutdown and reboot only send the ACPI shutdown here, the rest
+    is done by shutdown_virtance_wait. `link` is a task signature applied once the
+    action has completed without error.
+    """
     virtance = Virtance.objects.get(pk=virtance_id)
     wvcomp = wvcomp_conn(virtance.compute)
+
+    if action in ("shutdown", "reboot"):
+        res = wvcomp.action_virtance(virtance.id, "shutdown")
+        error = res.get("detail")
+        if error is None:
+            deadline = time.time() + VIRTANCE_SHUTDOWN_TIMEOUT
+            set_action_progress(virtance.id, action=action, step="shutdown", polls=0, error=None)
+            shutdown_virtance_wait.apply_async(
+                (virtance.id, action == "reboot", deadline, link), countdown=VIRTANCE_SHUTDOWN_POLL_INTERVAL
+            )
+        return error
+
     res = wvcomp.action_virtance(virtance.id, action)
     error = res.get("detail")
     if error is None:
-        if action == "shutdown":
-            timeout = 60
-            while wvcomp.status_virtance(virtance.id).get("status") != "shutoff":
-                timeout -= 1
-                time.sleep(1)
-                if timeout == 0:
-                    action = "power_off"
-                    res = wvcomp.action_virtance(virtance.id, action)
-                    error = res.get("detail")
-                    if error is None:
-                        virtance.inactive()
-            else:
-                virtance.inactive()
         if action == "power_on":
             virtance.active()
         if action == "power_off":
             virtance.inactive()
         if action == "power_cyrcle":
             virtance.active()
-        if reboot is True:
-            action = "power_on"
-            res = wvcomp.action_virtance(virtance.id, action)
-            error = res.get("detail")
-            if error is None:
-                virtance.active()
-    if error is None:
         virtance.reset_event()
+        if link is not None:
+            signature(link).delay()
     return error
 
 
+@app.task
+def shutdown_virtance_wait(virtance_id, reboot, deadline, link=None):
+    """
+    One poll of a graceful shutdown: reschedules itself until the domain is off, forces
+    a power off after VIRTANCE_SHUTDOWN_TIMEOUT and powers the virtance back on for a reboot.
+    """
+    virtance = Virtance.objects.get(pk=virtance_id)
+    wvcomp = wvcomp_conn(virtance.compute)
+    progress = get_action_progress(virtance.id) or {}
+
+    if wvcomp.status_virtance(virtance.id).get("status") != "shutoff":
+        if time.time() < deadline:
+            set_action_progress(virtance.id, polls=progress.get("polls", 0) + 1)
+            shutdown_virtance_wait.apply_async(
+                (virtance.id, reboot, deadline, link), countdown=VIRTANCE_SHUTDOWN_POLL_INTERVAL
+            )
+            return None
+
+        # Guest ignored the ACPI shutdown
+        set_action_progress(virtance.id, step="power_off")
+        error = wvcomp.action_virtance(virtance.id, "power_off").get("detail")
+        if error is not None:
+            set_action_progress(virtance.id, step="error", error=error)
+            return error
+    virtance.inactive()
+
+    if reboot is True:
+        set_action_progress(virtance.id, step="power_on")
+        error = wvcomp.action_virtance(virtance.id, "power_on").get("detail")
+        if error is not None:
+            set_action_progress(virtance.id, step="error", error=error)
+            return error
+        virtance.active()
+
+    virtance.reset_event()
+    set_action_progress(virtance.id, step="done")
+    if link is not None:
+        signature(link).delay()
+    return None
+
+
+def schedule_ssh_ready_sweep(countdown=0):
+    # Skip if a sweep is already due no later than this one, duplicates are harmless but wasteful
+    eta = time.time() + countdown
+    scheduled = cache.get(SSH_READY_SWEEP_KEY)
+    if scheduled is not None and time.time() <= scheduled <= eta:
+        return
+    cache.set(SSH_READY_SWEEP_KEY, eta, countdown + VIRTANCE_SSH_READY_MAX_DELAY)
+    virtance_ssh_ready_sweep.apply_async(countdown=countdown)
+
+
+@app.task
+def virtance_ssh_ready(virtance_id, host, private_key, started, link=None):
+    """
+    Register a freshly booted virtance for the SSH readiness sweep. `private_key` is
+    encrypted, `link` is applied once SSH is ready.
+    """
+    started = timezone.now() - timezone.timedelta(seconds=time.time() - started)
+    VirtanceReadinessProbe.objects.create(
+        virtance_id=virtance_id,
+        host=host,
+        private_key=private_key,
+        link=dict(link) if link is not None else None,
+        started=started,
+        next_probe=timezone.now(),
+    )
+    schedule_ssh_ready_sweep()
+
+
+@app.task
+def virtance_ssh_ready_sweep():
+    """
+    Probe every due readiness probe concurrently, with exponential backoff per host.
+    A probe row is removed by whoever wins the delete, so a duplicated sweep never
+    applies the link twice.
+    """
+    now = timezone.now()
+    probes = list(VirtanceReadinessProbe.objects.filter(next_probe__lte=now).select_related("virtance"))
+    targets = [(probe.host, decrypt_data(probe.private_key)) for probe in probes]
+    results = asyncio.run(probe_hosts(targets, concurrency=VIRTANCE_SSH_READY_CONCURRENCY)) if targets else []
+
+    ready = 0
+    for probe, is_ready in zip(probes, results):
+        elapsed = (timezone.now() - probe.started).total_seconds()
+        if is_ready or elapsed >= VIRTANCE_SSH_READY_TIMEOUT:
+            deleted, _ = VirtanceReadinessProbe.objects.filter(pk=probe.pk).delete()
+            if not deleted:
+                continue
+            if is_ready:
+                ready += 1
+                VirtanceReadiness.objects.create(
+                    virtance=probe.virtance, template=probe.virtance.template, elapsed=elapsed
+                )
+                if probe.link is not None:
+                    signature(probe.link).delay()
+            else:
+                error = f"SSH on {probe.host} is not ready after {VIRTANCE_SSH_READY_TIMEOUT}s."
+                virtance_error(probe.virtance.id, error, event="ssh_ready")
+            continue
+
+        delay = min(2**probe.attempt, VIRTANCE_SSH_READY_MAX_DELAY)
+        VirtanceReadinessProbe.objects.filter(pk=probe.pk).update(
+            attempt=probe.attempt + 1, next_probe=now + timezone.timedelta(seconds=delay)
+        )
+
+    pending = VirtanceReadinessProbe.objects.first()
+    if pending is not None:
+        schedule_ssh_ready_sweep(max((pending.next_probe - timezone.now()).total_seconds(), 1))
+
+    return {"probed": len(probes), "ready": ready}
+
+
 @app.task
 def resize_virtance(virtance_id, size_id):
     virtance = Virtance.objects.get(pk=virtance_id)
@@ -309,6 +437,12 @@ def resize_virtance(virtance_id, size_id):
         virtance.reset_event()
         virtance.size = size
         virtance.save()
+        update_compute_usage(
+            virtance.compute_id,
+            vcpu=size.vcpu - old_size.vcpu,
+            memory=size.memory - old_size.memory,
+            disk=size.disk - old_size.disk,
+        )
 
         current_time = timezone.now()
         first_day_month = current_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
@@ -341,7 +475,7 @@ def resize_virtance(virtance_id, size_id):
 def snapshot_virtance(virtance_id, display_name):
     virtance = Virtance.objects.get(pk=virtance_id)
     wvcomp = wvcomp_conn(virtance.compute)
-    res = wvcomp.snapshot_virtance(virtance.id, uuid4().hex)
+    res = wvcomp.snapshot_virtance(virtance.id, f"snapshot-{uuid4().hex}")
     error = res.get("detail")
     if error is None:
         image = Image.objects.create(
@@ -360,6 +494,7 @@ def snapshot_virtance(virtance_id, display_name):
         )
         SnapshotCounter.objects.create(image=image, amount=0.0)
         image.regions.add(virtance.region)
+        image_location(image, virtance.compute, res.get("pool"))
         image.reset_event()
         virtance.reset_event()
     else:
@@ -389,6 +524,7 @@ def backup_virtance(virtance_id, backup=False):
             is_active=True,
         )
         image.regions.add(virtance.region)
+        image_location(image, virtance.compute, res.get("pool"))
         image.reset_event()
         virtance.reset_event()
     else:
@@ -486,8 +622,9 @@ def delete_virtance(virtance_id):
         unassign_floating_ip(floatip.id, virtance_reset_event=False)
 
     # Check if virtance has attached  and delete them if so
-    if LBaaSVirtance.objects.filter(lbaas__is_deleted=False, virtance=virtance, is_deleted=False).exists():
-        lbaas_virtance = LBaaSVirtance.objects.filter(virtance=virtance, is_deleted=False).filter()
+    for lbaas_virtance in LBaaSVirtance.objects.filter(
+        lbaas__is_deleted=False, virtance=virtance, is_deleted=False
+    ).select_related("lbaas"):
         lbaas_virtance.is_deleted = True
         lbaas_virtance.save()
         lbass = lbaas_virtance.lbaas
@@ -502,6 +639,9 @@ def delete_virtance(virtance_id):
         ipaddresse = IPAddress.objects.filter(virtance=virtance, is_float=False)
         ipaddresse.delete()
         virtance.delete()
+        update_compute_usage(
+            virtance.compute_id, vcpu=-virtance.size.vcpu, memory=-virtance.size.memory, disk=-virtance.size.disk
+        )
 
         current_time = timezone.now()
         first_day_month = current_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
@@ -525,46 +665,64 @@ def delete_virtance(virtance_id):
 
 
 @app.task
-def virtance_counter():
-    new_period = False
-    current_time = timezone.now()
-    current_day = current_time.day
-    current_hour = current_time.hour
-    first_day_current_month = current_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+def virtance_status_refresh(virtance_id):
+    virtance = Virtance.objects.get(pk=virtance_id)
+    if virtance.compute is None or virtance.event is not None:
+        return None
 
-    if current_day == 1 and current_hour == 0:
-        new_period = True
+    res = wvcomp_conn(virtance.compute).status_virtance(virtance.id)
+    if res.get("detail"):
+        virtance_error(virtance.id, res.get("detail"), event="status")
+    status = DOMAIN_STATUS.get(res.get("status"), Virtance.PENDING)
+    Virtance.objects.filter(pk=virtance.id, event=None).update(status=status, status_synced=timezone.now())
+    return status
 
-    for virtance in Virtance.objects.filter(is_deleted=False):
-        try:
-            VirtanceCounter.objects.get(started__gt=first_day_current_month, stopped=None, virtance=virtance)
-        except VirtanceCounter.DoesNotExist:
-            period_start = current_time - timezone.timedelta(hours=1)
-            if new_period is True:
-                period_start = first_day_current_month
-            VirtanceCounter.objects.create(
-                virtance=virtance,
-                size=virtance.size,
-                amount=virtance.size.price,
-                backup_amount=virtance.size.price * Decimal(BACKUP_COST_RATIO) if virtance.is_backup_enabled else 0,
-                started=period_start,
-            )
 
-    if new_period is True:
-        prev_month = current_time - timezone.timedelta(days=1)
-        last_day_prev_month = prev_month.replace(hour=23, minute=59, second=59, microsecond=999999)
-        first_day_prev_month = prev_month.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+@app.task
+def virtance_status_sync():
+    synced = 0
+    virtance_ids = defaultdict(list)
+    virtances = list(
+        Virtance.objects.filter(
+            is_deleted=False, event=None, compute__is_active=True, compute__is_deleted=False
+        ).values_list("id", "status", "compute_id", "compute__hostname")
+    )
+    for virtance_id, _, _, hostname in virtances:
+        virtance_ids[hostname].append(virtance_id)
+
+    computes = Compute.objects.filter(hostname__in=virtance_ids.keys(), is_active=True, is_deleted=False)
+    results = fan_out(computes, compute_domain_statuses, virtance_ids, timeout=VIRTANCE_STATUS_SYNC_TIMEOUT)
+
+    changed = defaultdict(list)
+    unchanged = []
+    for virtance_id, current_status, compute_id, _ in virtances:
+        statuses = results.get(compute_id)
+        # Whole compute is unreachable, keep last known status
+        if statuses is None or statuses.get("detail"):
+            continue
+        res = statuses.get(virtance_id)
+        # A failed or timed out lookup of a single virtance keeps its last known status too
+        if not isinstance(res, dict) or res.get("detail") or res.get("status") is None:
+            continue
+        status = DOMAIN_STATUS.get(res.get("status"), Virtance.PENDING)
+        if status != current_status:
+            changed[status].append(virtance_id)
+        else:
+            unchanged.append(virtance_id)
 
-        virtance_counters = VirtanceCounter.objects.filter(started__gt=first_day_prev_month, stopped=None)
-        virtance_counters.update(stopped=last_day_prev_month)
-    else:
-        virtance_counters = VirtanceCounter.objects.filter(started__gt=first_day_current_month, stopped=None)
-        for virt_count in virtance_counters:
-            virt_count.amount += virt_count.size.price
-            virt_count.backup_amount += (
-                virt_count.size.price * Decimal(BACKUP_COST_RATIO) if virt_count.virtance.is_backup_enabled else 0
-            )
-            virt_count.save()
+    # Virtances which got an event in the meantime are left to the running action
+    now = timezone.now()
+    for status, ids in changed.items():
+        synced += Virtance.objects.filter(id__in=ids, event=None).update(status=status, status_synced=now)
+    for i in range(0, len(unchanged), STATUS_SYNC_CHUNK_SIZE):
+        Virtance.objects.filter(id__in=unchanged[i : i + STATUS_SYNC_CHUNK_SIZE], event=None).update(status_synced=now)
+
+    return {"changed": synced, "unchanged": len(unchanged)}
+
+
+@app.task
+def virtance_counter():
+    return run_metering("virtance")
 
 
 @app.task
@@ -0,0 +1,57 @@
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from account.models import User
+from image.models import Image
+from network.models import IPAddress, Network
+from region.models import Region
+from size.models import Size
+
+from .models import Virtance
+
+
+class VirtanceListTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("virtance@example.com", "password")
+        self.user.is_email_verified = True
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.region = Region.objects.create(name="Region", slug="region")
+        self.size = Size.objects.create(name="Size", slug="size", vcpu=1, disk=1, memory=1, transfer=1)
+        self.size.regions.add(self.region)
+        self.template = Image.objects.create(name="Template", type=Image.DISTRIBUTION, md5sum="", file_name="image")
+        self.template.regions.add(self.region)
+        self.public = Network.objects.create(
+            cidr="10.0.0.0", netmask="255.255.255.0", gateway="10.0.0.1", type=Network.PUBLIC, region=self.region
+        )
+
+    def create_virtances(self, count):
+        for i in range(count):
+            virtance = Virtance.objects.create(
+                user=self.user, size=self.size, region=self.region, template=self.template, name=f"virtance-{i}", disk=1
+            )
+            IPAddress.objects.create(network=self.public, virtance=virtance, address=f"10.0.0.{virtance.id}")
+            for image_type in (Image.BACKUP, Image.SNAPSHOT):
+                Image.objects.create(
+                    user=self.user, source=virtance, type=image_type, name=image_type, md5sum="", file_name=image_type
+                )
+
+    def assert_list_queries(self, count):
+        # Virtances with size, region and template, four prefetched relations, addresses and images
+        with self.assertNumQueries(7):
+            response = self.client.get("/api/v1/virtances/")
+        virtances = response.json()["virtances"]
+        self.assertEqual(len(virtances), count)
+        for virtance in virtances:
+            self.assertEqual(len(virtance["networks"]["v4"]), 1)
+            self.assertEqual(len(virtance["backup_ids"]), 1)
+            self.assertEqual(len(virtance["snapshot_ids"]), 1)
+
+    def test_query_count(self):
+        self.create_virtances(3)
+        self.assert_list_queries(3)
+
+        self.create_virtances(6)
+        self.assert_list_queries(9)
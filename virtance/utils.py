@@ -1,5 +1,5 @@
-import socket
-import time
+import asyncio
+import secrets
 from base64 import b64decode, b64encode, urlsafe_b64decode
 from io import StringIO
 from random import choice
@@ -8,12 +8,18 @@ from string import ascii_letters, digits
 import paramiko
 from cryptography.fernet import Fernet
 from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
 from paramiko import RSAKey
 
 from .models import VirtanceError, VirtanceHistory
 
 NOVNC_PASSWD_PREFIX = settings.NOVNC_PASSWD_PREFIX_LENGHT
 NOVNC_PASSWD_SUFFIX = settings.NOVNC_PASSWD_SUFFIX_LENGHT
+NOVNC_TICKET_SALT = "virtance.console.ticket"
+ACTION_PROGRESS_KEY = "virtance_action_progress_{}"
+ACTION_PROGRESS_TIMEOUT = 3600
 
 
 def is_valid_fernet_key(key):
@@ -63,7 +69,7 @@ def decrypt_data(data, key=None):
     return decrypted_data.decode()
 
 
-def check_ssh_auth(hostname, password=None, private_key=None, username="root"):
+def check_ssh_auth(hostname, password=None, private_key=None, username="root", port=22, timeout=None):
     pkey = None
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -74,9 +80,13 @@ def check_ssh_auth(hostname, password=None, private_key=None, username="root"):
         try:
             ssh.connect(
                 hostname=hostname,
+                port=port,
                 username=username,
                 password=password,
                 pkey=pkey,
+                timeout=timeout,
+                banner_timeout=timeout,
+                auth_timeout=timeout,
                 allow_agent=False,
                 look_for_keys=False,
             )
@@ -91,27 +101,43 @@ def check_ssh_auth(hostname, password=None, private_key=None, username="root"):
 
 
 def check_ssh_connect(host, password=None, private_key=None, port=22, timeout=180):
-    elapsed_time = 0
-    while elapsed_time < timeout:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            if check_ssh_auth(host, password=password, private_key=private_key):
-                return True
-        except socket.error:
-            time.sleep(1)
-            elapsed_time += 1
-
-        finally:
-            sock.close()
+    from .readiness import wait_ssh
 
-    return False
+    elapsed = asyncio.run(wait_ssh(host, password=password, private_key=private_key, port=port, timeout=timeout))
+    return elapsed is not None
 
 
 def make_vnc_hash(vnc_password, prefix_length=NOVNC_PASSWD_PREFIX, suffix_length=NOVNC_PASSWD_SUFFIX):
     return b64encode((f"{make_passwd(prefix_length)}{vnc_password}{make_passwd(suffix_length)}").encode())
 
 
+def make_console_ticket(uuid, host, port):
+    payload = {"uuid": str(uuid), "host": host, "port": port, "nonce": secrets.token_urlsafe(12)}
+    return signing.dumps(payload, salt=NOVNC_TICKET_SALT)
+
+
+def read_console_ticket(ticket, max_age=None):
+    """
+    Return the payload of a console ticket, or None if it is forged or older than NOVNC_TICKET_TTL.
+    Only the signature is checked, so proxies validate tickets without a database or cache.
+    """
+    try:
+        return signing.loads(ticket, salt=NOVNC_TICKET_SALT, max_age=max_age or int(settings.NOVNC_TICKET_TTL))
+    except signing.BadSignature:
+        return None
+
+
+def get_action_progress(virtance_id):
+    return cache.get(ACTION_PROGRESS_KEY.format(virtance_id))
+
+
+def set_action_progress(virtance_id, **progress):
+    state = get_action_progress(virtance_id) or {}
+    state.update(progress, updated=timezone.now().isoformat())
+    cache.set(ACTION_PROGRESS_KEY.format(virtance_id), state, ACTION_PROGRESS_TIMEOUT)
+    return state
+
+
 def virtance_history(virtance_id, user_id, event, message=None):
     VirtanceHistory.objects.create(virtance_id=virtance_id, user_id=user_id, message=message, event=event)
 
@@ -1,9 +1,6 @@
-import time
-
 from django.conf import settings
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
-from django.utils import timezone
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -17,6 +14,16 @@ from image.serializers import ImageSerializer
 from lbaas.models import LBaaSVirtance
 from webvirtcloud.views import error_message_response
 
+from .metrics import (
+    MetricsGateway,
+    cpu_queries,
+    disk_queries,
+    format_series,
+    mem_queries,
+    metrics_params,
+    net_queries,
+    series_values,
+)
 from .models import Virtance, VirtanceHistory
 from .serializers import (
     CreateVirtanceSerializer,
@@ -25,7 +32,7 @@ from .serializers import (
     VirtanceSerializer,
 )
 from .tasks import delete_virtance
-from .utils import make_vnc_hash, virtance_history
+from .utils import make_console_ticket, make_vnc_hash, virtance_history
 
 
 class VirtanceListAPI(APIView):
@@ -402,191 +409,120 @@ class VirtanceConsoleAPI(APIView):
             }
         )
         response.set_cookie("uuid", virtance.uuid, secure=True, httponly=True, domain=settings.SESSION_COOKIE_DOMAIN)
+        response.set_cookie(
+            "ticket",
+            make_console_ticket(virtance.uuid, virtance.compute.hostname, res.get("vnc_port")),
+            max_age=int(settings.NOVNC_TICKET_TTL),
+            secure=True,
+            httponly=True,
+            domain=settings.SESSION_COOKIE_DOMAIN,
+        )
         return response
 
 
-class VirtanceMetricsCpuAPI(APIView):
+class VirtanceMetricsAPI(APIView):
+    queries = None
+
     def get_object(self):
         return get_object_or_404(
             Virtance, pk=self.kwargs.get("id"), type=Virtance.VIRTANCE, user=self.request.user, is_deleted=False
         )
 
-    def get(self, request, *args, **kwargs):
-        """
-        Retrieve The Virtance CPU Metrics
-        ---
-        """
-        virtance = self.get_object()
-        vname = f"{settings.VM_NAME_PREFIX}{str(virtance.id)}"
-        today = timezone.now()
-        timestamp_today = time.mktime(today.timetuple())
-        timestamp_yesterday = time.mktime((today - timezone.timedelta(days=1)).timetuple())
-
-        cpu_usr_query = (
-            f"(irate(libvirt_domain_info_cpu_time_user{{domain='{vname}'}}[5m])*100)/"
-            f"(libvirt_domain_info_vcpu_num{{domain='{vname}'}}*1000000000)"
-        )
-        cpu_sys_query = (
-            f"(irate(libvirt_domain_info_cpu_time_system{{domain='{vname}'}}[5m])*100)/"
-            f"(libvirt_domain_info_vcpu_num{{domain='{vname}'}}*1000000000)"
-        )
-        cpu_total_query = (
-            f"(irate(libvirt_domain_info_cpu_time{{domain='{vname}'}}[5m])*100)/"
-            f"(libvirt_domain_info_vcpu_num{{domain='{vname}'}}*1000000000)"
-        )
+    def get_metrics(self, virtance, params):
+        gateway = MetricsGateway(virtance, window=params["window"], step=params["step"])
+        return gateway.fetch(self.queries(gateway.domain))
 
-        wvcomp = WebVirtCompute(virtance.compute.token, virtance.compute.hostname)
-        cpu_usr_res = wvcomp.get_metrics(cpu_usr_query, timestamp_yesterday, timestamp_today, "5m")
-        cpu_sys_res = wvcomp.get_metrics(cpu_sys_query, timestamp_yesterday, timestamp_today, "5m")
-        cpu_total_res = wvcomp.get_metrics(cpu_total_query, timestamp_yesterday, timestamp_today, "5m")
+    def series(self, values, params, upper=None):
+        return format_series(values, params["format"], params["points"], upper=upper)
 
+    def get(self, request, *args, **kwargs):
         try:
-            user_value = cpu_usr_res["data"]["result"][0]["values"]
-            for i, val in enumerate(user_value):
-                if float(val[1]) > 100:
-                    user_value[i][1] = str(100.0)
-        except (KeyError, IndexError):
-            user_value = []
+            params = metrics_params(request.query_params)
+        except ValueError as err:
+            return error_message_response(str(err))
+        virtance = self.get_object()
+        res = self.get_metrics(virtance, params)
+        return Response({"metrics": self.get_data(res, params)})
 
-        try:
-            sys_value = cpu_sys_res["data"]["result"][0]["values"]
-            for i, val in enumerate(sys_value):
-                if float(val[1]) > 100:
-                    sys_value[i][1] = str(100.0)
-        except (KeyError, IndexError):
-            sys_value = []
 
-        try:
-            total_value = cpu_total_res["data"]["result"][0]["values"]
-            for i, val in enumerate(total_value):
-                if float(val[1]) > 100:
-                    total_value[i][1] = str(100.0)
-        except (KeyError, IndexError):
-            total_value = []
+class VirtanceMetricsCpuAPI(VirtanceMetricsAPI):
+    queries = staticmethod(cpu_queries)
 
-        data = {"sys": sys_value, "user": user_value, "total": total_value}
-        return Response({"metrics": {"name": "CPU", "unit": "%", "data": data}})
+    def get(self, request, *args, **kwargs):
+        """
+        Retrieve The Virtance CPU Metrics
+        ---
+        """
+        return super().get(request, *args, **kwargs)
 
+    def get_data(self, res, params):
+        data = {
+            "sys": self.series(series_values(res["sys"]), params, upper=100),
+            "user": self.series(series_values(res["user"]), params, upper=100),
+            "total": self.series(series_values(res["total"]), params, upper=100),
+        }
+        return {"name": "CPU", "unit": "%", "data": data}
 
-class VirtanceMetricsMemAPI(APIView):
-    def get_object(self):
-        return get_object_or_404(
-            Virtance, pk=self.kwargs.get("id"), type=Virtance.VIRTANCE, user=self.request.user, is_deleted=False
-        )
+
+class VirtanceMetricsMemAPI(VirtanceMetricsAPI):
+    queries = staticmethod(mem_queries)
 
     def get(self, request, *args, **kwargs):
         """
         Retrieve The Virtance Memory Metrics
         ---
         """
-        virtance = self.get_object()
-        vname = f"{settings.VM_NAME_PREFIX}{str(virtance.id)}"
-        today = timezone.now()
-        timestamp_today = time.mktime(today.timetuple())
-        timestamp_yesterday = time.mktime((today - timezone.timedelta(days=1)).timetuple())
-
-        mem_query = (
-            f"(((avg_over_time(libvirt_domain_info_memory_actual{{domain='{vname}'}}[5m]))-"
-            f"(avg_over_time(libvirt_domain_info_memory_unused{{domain='{vname}'}}[5m])))/"
-            f"(avg_over_time(libvirt_domain_info_memory_actual{{domain='{vname}'}}[5m])))*100"
-        )
+        return super().get(request, *args, **kwargs)
 
-        wvcomp = WebVirtCompute(virtance.compute.token, virtance.compute.hostname)
-        mem_res = wvcomp.get_metrics(mem_query, timestamp_yesterday, timestamp_today, "5m")
+    def get_data(self, res, params):
+        data = self.series(series_values(res["mem"]), params)
+        return {"name": "Memory", "unit": "%", "data": data}
 
-        try:
-            mem_value = mem_res["data"]["result"][0]["values"]
-        except (KeyError, IndexError):
-            mem_value = []
-
-        data = mem_value
-        return Response({"metrics": {"name": "Memory", "unit": "%", "data": data}})
 
-
-class VirtanceMetricsNetAPI(APIView):
-    def get_object(self):
-        return get_object_or_404(
-            Virtance, pk=self.kwargs.get("id"), type=Virtance.VIRTANCE, user=self.request.user, is_deleted=False
-        )
+class VirtanceMetricsNetAPI(VirtanceMetricsAPI):
+    queries = staticmethod(net_queries)
 
     def get(self, request, *args, **kwargs):
         """
         Retrieve The Virtance Network Metrics
         ---
         """
-        in_val = {}
-        out_val = {}
-        net_devs = [0, 1]
-        virtance = self.get_object()
-        vname = f"{settings.VM_NAME_PREFIX}{str(virtance.id)}"
-        today = timezone.now()
-        timestamp_today = time.mktime(today.timetuple())
-        timestamp_yesterday = time.mktime((today - timezone.timedelta(days=1)).timetuple())
+        return super().get(request, *args, **kwargs)
 
-        rx_query = f"(irate(libvirt_domain_info_net_rx_bytes{{domain='{vname}'}}[5m])*8)/1048576"
-        tx_query = f"(irate(libvirt_domain_info_net_tx_bytes{{domain='{vname}'}}[5m])*8)/1048576"
-
-        wvcomp = WebVirtCompute(virtance.compute.token, virtance.compute.hostname)
-        in_res = wvcomp.get_metrics(rx_query, timestamp_yesterday, timestamp_today, "5m")
-        out_res = wvcomp.get_metrics(tx_query, timestamp_yesterday, timestamp_today, "5m")
-
-        for dev in net_devs:
-            try:
-                in_val[dev] = in_res["data"]["result"][dev]["values"]
-            except (KeyError, IndexError):
-                in_val[dev] = []
-
-            try:
-                out_val[dev] = out_res["data"]["result"][dev]["values"]
-            except (KeyError, IndexError):
-                out_val[dev] = []
-
-        return Response(
+    def get_data(self, res, params):
+        return [
             {
-                "metrics": [
-                    {"name": "Pubic Network", "unit": "Mbps", "data": {"inbound": in_val[0], "outbound": in_val[0]}},
-                    {
-                        "name": "Private Network",
-                        "unit": "Mbps",
-                        "data": {"inbound": out_val[1], "outbound": out_val[1]},
-                    },
-                ]
-            }
-        )
+                "name": "Pubic Network",
+                "unit": "Mbps",
+                "data": {
+                    "inbound": self.series(series_values(res["rx"], 0), params),
+                    "outbound": self.series(series_values(res["tx"], 0), params),
+                },
+            },
+            {
+                "name": "Private Network",
+                "unit": "Mbps",
+                "data": {
+                    "inbound": self.series(series_values(res["rx"], 1), params),
+                    "outbound": self.series(series_values(res["tx"], 1), params),
+                },
+            },
+        ]
 
 
-class VirtanceMetricsDiskAPI(APIView):
-    def get_object(self):
-        return get_object_or_404(
-            Virtance, pk=self.kwargs.get("id"), type=Virtance.VIRTANCE, user=self.request.user, is_deleted=False
-        )
+class VirtanceMetricsDiskAPI(VirtanceMetricsAPI):
+    queries = staticmethod(disk_queries)
 
     def get(self, request, *args, **kwargs):
         """
         Retrieve The Virtance Disk Metrics
         ---
         """
-        virtance = self.get_object()
-        vname = f"{settings.VM_NAME_PREFIX}{str(virtance.id)}"
-        today = timezone.now()
-        timestamp_today = time.mktime(today.timetuple())
-        timestamp_yesterday = time.mktime((today - timezone.timedelta(days=1)).timetuple())
-
-        r_query = f"irate(libvirt_domain_info_block_read_bytes{{dev='vda',domain='{vname}'}}[5m])/1048576"
-        w_query = f"irate(libvirt_domain_info_block_write_bytes{{dev='vda',domain='{vname}'}}[5m])/1048576"
-
-        wvcomp = WebVirtCompute(virtance.compute.token, virtance.compute.hostname)
-        rd_res = wvcomp.get_metrics(r_query, timestamp_yesterday, timestamp_today, "5m")
-        wr_res = wvcomp.get_metrics(w_query, timestamp_yesterday, timestamp_today, "5m")
-
-        try:
-            rd_val = rd_res["data"]["result"][0]["values"]
-        except (KeyError, IndexError):
-            rd_val = []
-
-        try:
-            wr_val = wr_res["data"]["result"][0]["values"]
-        except (KeyError, IndexError):
-            wr_val = []
-
-        return Response({"metrics": [{"name": "Disk", "unit": "MB/s", "data": {"read": rd_val, "write": wr_val}}]})
+        return super().get(request, *args, **kwargs)
+
+    def get_data(self, res, params):
+        data = {
+            "read": self.series(series_values(res["read"]), params),
+            "write": self.series(series_values(res["write"]), params),
+        }
+        return [{"name": "Disk", "unit": "MB/s", "data": data}]